@@ -1,45 +1,149 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
 import os
+import click
+import time
+import numpy as np
 import pandas as pd
-from datetime import datetime
-from models.ehi import calcular_ehi_completo, categorizar_ehi
+from models.ehi import calcular_ehi_compacto
+from models.incertidumbre import MAX_SEMILLA, simular_incertidumbre
+from models.resultado import ETIQUETAS, tabla_categorias
 from models.biodiversidad import calcular_shannon_wiener
 from models.tfi import calcular_tfi
 from models.vsi import calcular_vsi
+from services.agregados import AgregadosEHI, ecosistemas_de
+from services.alertas import DetectorAnomalias
+from services.almacen_datos import AlmacenDatos
+from services.almacenamiento import AlmacenamientoExcel, AlmacenamientoSQLite
+from services.cache_respuestas import CacheRespuestas
+from services.cambios import RegistroCambios
+from services.calculo_masivo import ErrorCalculoMasivo, calcular_en_bloques, registro_error, seleccionar_sitios
+from services.historial import HistorialEHI
+from services.ingesta import ColaIngesta, ErrorIngesta, parsear_lote, resolver_tabla, validar_lote
+from services.escritura import CoordinadorEscritura
+from services.fragmentos import CacheFragmentos, resultados_por_sitio
+from services.espacial import IndiceEspacial
+from services.incertidumbre import MAX_MUESTRAS, a_dataframe, resumen_sitio, simular_todos
+from services.indice_sitios import IndiceSitios
+from services import metricas
+from services.listados import (ErrorListado, ListadoSitios, columnas_compactas, leer_campos, leer_limite,
+                               registros, registros_en_bloques)
+from services.perfilador import PerfiladorMuestreo
+from services.trabajos import GestorRecalculo, RegistroTrabajos
+
+class ProveedorJSON(DefaultJSONProvider):
+    """Serializa también los escalares de numpy que devuelven pandas y los modelos"""
+    @staticmethod
+    def default(o):
+        if isinstance(o, np.generic):
+            return o.item()
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__)
+app.json = ProveedorJSON(app)
+app.jinja_env.globals['tabla_categorias'] = tabla_categorias
 
 # Configuración
 app.config['DATA_FOLDER'] = 'data'
 app.config['EXCEL_FILE'] = 'EcoBalance_Datos.xlsx'
 app.config['SECRET_KEY'] = 'eco-balance-2025'
+app.config['STORAGE_BACKEND'] = 'excel'  # 'excel' o 'sqlite'
+app.config['SQLITE_FILE'] = 'EcoBalance.db'
+app.config['COMPILADO_FILE'] = 'EcoBalance.snap'  # Instantánea compilada de los datos (None = no compilar)
+app.config['HISTORIAL_FILE'] = 'EcoBalance_historial.db'
+app.config['HISTORIAL_MAX_PUNTOS'] = 2000
+app.config['TRABAJOS_FILE'] = 'EcoBalance_trabajos.db'  # Estado de los recálculos, compartido entre procesos
+app.config['INGESTA_MAX_FILAS'] = 200000   # Capacidad de la cola antes de responder 429
+app.config['INGESTA_TAMANO_LOTE'] = 50000  # Filas por escritura al almacenamiento
+app.config['INGESTA_INTERVALO'] = 1.0      # Segundos máximos entre escrituras
+app.config['INGESTA_MAX_REINTENTOS'] = 5   # Intentos de escribir un lote antes de apartarlo a la carpeta de fallidos
+app.config['INGESTA_FALLIDOS_CARPETA'] = 'ingesta_fallida'  # Dentro de DATA_FOLDER; un CSV por lote apartado
+app.config['RECALCULO_PROCESOS'] = None    # Procesos del pool de recálculo (None = núcleos disponibles)
+app.config['RECALCULO_FRAGMENTO'] = 5000   # Sitios por fragmento enviado a cada proceso
+app.config['MAPA_MAX_SITIOS'] = 5000       # Máximo de sitios devueltos por /api/sitios/bbox
+app.config['LOTE_MAX_SITIOS'] = 5000       # Máximo de sitios por petición a /api/calcular_lote
+app.config['DASHBOARD_POR_PAGINA'] = 60     # Tarjetas de sitio por página en el dashboard
+app.config['CACHE_MAX_ENTRADAS'] = 512     # Respuestas guardadas en la caché LRU
+app.config['CACHE_TTL'] = 300              # Segundos que vive cada respuesta en caché
+app.config['FRAGMENTOS_MAX_ENTRADAS'] = 50000  # Fragmentos de plantilla por sitio guardados en caché
+app.config['ALERTAS_MAX'] = 10000          # Alertas de anomalías que se conservan para consultar
+app.config['ALERTAS_FILE'] = 'EcoBalance_alertas.db'  # Estado del detector de anomalías, compartido entre procesos
+app.config['ALERTAS_SSE_ESPERA'] = 15      # Segundos entre latidos del flujo SSE de alertas
+app.config['CAMBIOS_FILE'] = 'EcoBalance_cambios.db'  # Registro de cambios del dashboard, compartido entre procesos
+app.config['CAMBIOS_MAX_ENTRADAS'] = 100000  # Cambios que se conservan para la sincronización incremental
+app.config['CAMBIOS_MAX_SITIOS'] = 2000      # Más sitios cambiados que esto: se pide resincronizar todo
+app.config['ESCRITURA_ESPERA'] = 0.05      # Segundos que se esperan otros resultados para escribirlos juntos
+app.config['INCERTIDUMBRE_MUESTRAS'] = 1000   # Simulaciones Monte Carlo por defecto (API y detalle de sitio)
+app.config['INCERTIDUMBRE_SEMILLA_ZONA'] = 0  # Semilla fija del detalle de sitio (misma página en cada visita)
+app.config['PERFILADO_UMBRAL_MS'] = None   # Volcar un perfil de las peticiones más lentas que esto (None = apagado)
+app.config['PERFILADO_INTERVALO_MS'] = 5   # Intervalo de muestreo del perfilador
+app.config['PERFILADO_CARPETA'] = 'perfiles'
 
-'''Funciones auxiliares para cargar y guardar datos Excel ayuda por gemini.ia'''
-def cargar_datos_excel():
-    """Carga todos los DataFrames desde el archivo Excel y devuelve un diccionario."""
-    try:
-        excel_path = os.path.join(app.config['DATA_FOLDER'], app.config['EXCEL_FILE'])
-        
-        datos = {
-            'sites': pd.read_excel(excel_path, sheet_name='1-sites'),
-            'biodiversity': pd.read_excel(excel_path, sheet_name='2-biodiversity_data'),
-            'trophic': pd.read_excel(excel_path, sheet_name='3-trophic_data'),
-            'vsi': pd.read_excel(excel_path, sheet_name='4-vsi_data'),
-            'results': pd.read_excel(excel_path, sheet_name='5-results_ehi')
-        }
+# Backends ya creados, por (tipo, ruta), para reutilizar conexiones y firmas
+_almacenamientos = {}
 
-        for key in datos:
-            if 'site_id' in datos[key].columns:
-                datos[key]['site_id'] = datos[key]['site_id'].astype(str)
-        return datos
+def obtener_almacenamiento():
+    """Devuelve el backend de almacenamiento configurado (Excel o SQLite)"""
+    tipo = app.config['STORAGE_BACKEND']
+    if tipo == 'sqlite':
+        ruta = os.path.join(app.config['DATA_FOLDER'], app.config['SQLITE_FILE'])
+    else:
+        ruta = os.path.join(app.config['DATA_FOLDER'], app.config['EXCEL_FILE'])
     
-    except FileNotFoundError:
-        print(f"\n❌ ERROR: Archivo Excel no encontrado en la ruta esperada: {excel_path}")
-        return None
-        
-    except Exception as e:
-        print(f"\n❌ ERROR inesperado al cargar el Excel: {e}")
+    clave = (tipo, ruta)
+    if clave not in _almacenamientos:
+        _almacenamientos[clave] = AlmacenamientoSQLite(ruta) if tipo == 'sqlite' else AlmacenamientoExcel(ruta)
+    return _almacenamientos[clave]
+
+def obtener_ruta_compilado():
+    """Ruta de la instantánea compilada, o None si está desactivada"""
+    if not app.config['COMPILADO_FILE']:
         return None
+    return os.path.join(app.config['DATA_FOLDER'], app.config['COMPILADO_FILE'])
+
+def obtener_carpeta_ingesta_fallida():
+    """Carpeta donde se apartan los lotes de ingesta que no se pudieron escribir"""
+    return os.path.join(app.config['DATA_FOLDER'], app.config['INGESTA_FALLIDOS_CARPETA'])
+
+def obtener_historial():
+    """Devuelve el historial de resultados (SQLite particionado por mes)"""
+    ruta = os.path.join(app.config['DATA_FOLDER'], app.config['HISTORIAL_FILE'])
+    clave = ('historial', ruta)
+    if clave not in _almacenamientos:
+        _almacenamientos[clave] = HistorialEHI(ruta)
+    return _almacenamientos[clave]
+
+def obtener_registro_trabajos():
+    """Registro de trabajos de recálculo (SQLite compartido por todos los procesos de la app)"""
+    ruta = os.path.join(app.config['DATA_FOLDER'], app.config['TRABAJOS_FILE'])
+    clave = ('trabajos', ruta)
+    if clave not in _almacenamientos:
+        _almacenamientos[clave] = RegistroTrabajos(ruta)
+    return _almacenamientos[clave]
+
+def obtener_registro_cambios():
+    """Registro de cambios de sitios y resultados (SQLite compartido por todos los procesos de la app)"""
+    ruta = os.path.join(app.config['DATA_FOLDER'], app.config['CAMBIOS_FILE'])
+    clave = ('cambios', ruta)
+    if clave not in _almacenamientos:
+        _almacenamientos[clave] = RegistroCambios(ruta, max_entradas=app.config['CAMBIOS_MAX_ENTRADAS'])
+    return _almacenamientos[clave]
+
+def obtener_detector_anomalias():
+    """Detector de anomalías: estado por sitio y alertas (SQLite compartido por todos los procesos de la app)"""
+    ruta = os.path.join(app.config['DATA_FOLDER'], app.config['ALERTAS_FILE'])
+    clave = ('alertas', ruta)
+    if clave not in _almacenamientos:
+        _almacenamientos[clave] = DetectorAnomalias(ruta, max_alertas=app.config['ALERTAS_MAX'])
+    return _almacenamientos[clave]
+
+'''Funciones auxiliares para cargar y guardar datos Excel ayuda por gemini.ia'''
+def cargar_datos_excel():
+    """Carga todos los DataFrames desde el backend configurado y devuelve un diccionario."""
+    return obtener_almacenamiento().cargar()
 
 def transformar_datos(datos):
     """Transforma los datos del Excel a la estructura que espera el código"""
@@ -54,11 +158,16 @@ def transformar_datos(datos):
         'longitud': 'longitude'
     }, inplace=True)
     
-    # Agregar columnas que el código espera pero no están en el Excel
-    sites['location'] = sites.apply(lambda row: f"{row['latitude']}, {row['longitude']}", axis=1)
-    sites['ecosystem_type'] = sites['site_name'].apply(
-        lambda x: 'Bosque' if 'Bosque' in x else 'Humedal' if 'Humedal' in x else 'Zona Minera'
+    # Agregar columnas que el código espera pero no están en el Excel (por columnas, sin apply fila a fila)
+    sites['location'] = pd.Series(
+        [f"{lat}, {lon}" for lat, lon in zip(sites['latitude'].tolist(), sites['longitude'].tolist())],
+        index=sites.index, dtype='str'
     )
+    nombres = sites['site_name'].astype('str')
+    sites['ecosystem_type'] = pd.Series(np.select(
+        [nombres.str.contains('Bosque', regex=False, na=False), nombres.str.contains('Humedal', regex=False, na=False)],
+        ['Bosque', 'Humedal'], default='Zona Minera'
+    ), index=sites.index, dtype='str')
     
     # Transformar biodiversity_data
     biodiversity = datos['biodiversity'].copy()
@@ -67,8 +176,8 @@ def transformar_datos(datos):
         'abundancia': 'abundance'
     }, inplace=True)
     
-    # Transformar trophic_data  
-    trophic = datos['trophic'].copy()
+    # Transformar trophic_data (ordenada por fecha: la última fila de cada sitio es la medición más reciente)
+    trophic = ordenar_por_fecha(datos['trophic'])
     trophic.rename(columns={
         'conn_obs': 'connectance_observed',
         'conn_exp': 'connectance_expected', 
@@ -77,7 +186,7 @@ def transformar_datos(datos):
     }, inplace=True)
     
     # Transformar vsi_data
-    vsi = datos['vsi'].copy()
+    vsi = ordenar_por_fecha(datos['vsi'])
     vsi.rename(columns={
         'cobertura_pct': 'coverage_pct',
         'calidad_suelo_pct': 'soil_quality_pct'
@@ -91,81 +200,328 @@ def transformar_datos(datos):
         'results': datos['results']
     }
 
-def guardar_resultados_ehi(resultados_df):
-    """Guarda los resultados calculados en la hoja results_ehi"""
-    try:
-        excel_path = os.path.join(app.config['DATA_FOLDER'], app.config['EXCEL_FILE'])
+def ordenar_por_fecha(df):
+    """Copia ordenada por fecha (orden estable: con la misma fecha manda el orden de inserción; sin fecha, primero)"""
+    if 'fecha' not in df.columns or df.empty:
+        return df.copy()
+    fechas = pd.to_datetime(df['fecha'], errors='coerce')
+    return df.iloc[np.argsort(fechas.fillna(pd.Timestamp.min).to_numpy(), kind='stable')].reset_index(drop=True)
+
+# Las escrituras de resultados simultáneas se agrupan en una sola
+coordinador_escritura = CoordinadorEscritura(obtener_almacenamiento, espera=app.config['ESCRITURA_ESPERA'])
+
+def guardar_resultados_ehi(resultados_df, site_ids_vigentes=None, forzar=False):
+    """Guarda (upsert por site_id) los resultados calculados en el backend configurado"""
+    return coordinador_escritura.guardar_resultados(resultados_df, site_ids_vigentes, forzar)
+
+# Almacén en memoria: los datos se leen y transforman una sola vez por versión
+almacen = AlmacenDatos(obtener_almacenamiento, transformar_datos, obtener_ruta_compilado)
+
+# Cola de ingesta masiva: las filas aceptadas se escriben por lotes en segundo plano
+cola_ingesta = ColaIngesta(obtener_almacenamiento,
+                           max_filas=app.config['INGESTA_MAX_FILAS'],
+                           tamano_lote=app.config['INGESTA_TAMANO_LOTE'],
+                           intervalo=app.config['INGESTA_INTERVALO'],
+                           max_reintentos=app.config['INGESTA_MAX_REINTENTOS'],
+                           obtener_carpeta_fallidos=obtener_carpeta_ingesta_fallida)
+
+# Recálculos en segundo plano (uno a la vez entre todos los procesos, repartido en un pool)
+gestor_recalculo = GestorRecalculo(procesos=app.config['RECALCULO_PROCESOS'],
+                                   tamano_fragmento=app.config['RECALCULO_FRAGMENTO'],
+                                   obtener_registro=obtener_registro_trabajos)
+
+# Estadísticas de resultados mantenidas al guardar (globales y por ecosistema)
+agregados = AgregadosEHI(obtener_almacenamiento)
+
+# Respuestas ya generadas, por (ruta, argumentos, versión de datos)
+cache_respuestas = CacheRespuestas(max_entradas=app.config['CACHE_MAX_ENTRADAS'],
+                                   ttl=app.config['CACHE_TTL'])
+
+# Fragmentos de plantilla por sitio (filas del panel, tarjetas), por (plantilla, sitio, versión de datos)
+cache_fragmentos = CacheFragmentos(max_entradas=app.config['FRAGMENTOS_MAX_ENTRADAS'],
+                                   ttl=app.config['CACHE_TTL'])
+
+# Valores que ya llevan otros objetos, leídos al exportar /metrics
+metricas.registro.colector(
+    'ecobalance_cache_respuestas_total', 'counter', 'Consultas a la caché de respuestas por resultado',
+    lambda: [({'resultado': 'acierto'}, cache_respuestas.aciertos), ({'resultado': 'fallo'}, cache_respuestas.fallos)])
+metricas.registro.colector(
+    'ecobalance_cache_fragmentos_total', 'counter', 'Consultas a la caché de fragmentos de plantilla por resultado',
+    lambda: [({'resultado': 'acierto'}, cache_fragmentos.aciertos), ({'resultado': 'fallo'}, cache_fragmentos.fallos)])
+metricas.registro.colector(
+    'ecobalance_version_datos', 'gauge', 'Versión de los datos en memoria',
+    lambda: [({}, almacen.version)])
+metricas.registro.colector(
+    'ecobalance_ingesta_filas_pendientes', 'gauge', 'Filas de ingesta aceptadas aún sin escribir',
+    lambda: [({}, cola_ingesta.pendientes)])
+metricas.registro.colector(
+    'ecobalance_ingesta_filas_escritas_total', 'counter', 'Filas de ingesta escritas al almacenamiento',
+    lambda: [({}, cola_ingesta.escritas)])
+metricas.registro.colector(
+    'ecobalance_ingesta_filas_fallidas_total', 'counter',
+    'Filas de ingesta apartadas a la carpeta de fallidos tras agotar los reintentos de escritura',
+    lambda: [({}, cola_ingesta.filas_fallidas)])
+metricas.registro.colector(
+    'ecobalance_resultados_escrituras_total', 'counter',
+    'Pedidos de guardar resultados y escrituras reales (varios pedidos simultáneos se escriben juntos)',
+    lambda: [({'tipo': 'pedido'}, coordinador_escritura.pedidos),
+             ({'tipo': 'escritura'}, coordinador_escritura.escrituras)])
+metricas.registro.colector(
+    'ecobalance_agregados_reconstrucciones_total', 'counter',
+    'Reconstrucciones completas de las estadísticas por cambios externos',
+    lambda: [({}, agregados.reconstrucciones)])
+metricas.registro.colector(
+    'ecobalance_alertas_total', 'counter', 'Alertas de anomalías emitidas por tipo',
+    lambda: [({'tipo': tipo}, n) for tipo, n in sorted(obtener_detector_anomalias().conteos.items())])
+
+# Perfilador por muestreo (solo si PERFILADO_UMBRAL_MS está configurado)
+_perfiladores = {}
+
+def obtener_perfilador():
+    umbral = app.config['PERFILADO_UMBRAL_MS']
+    if umbral is None:
+        return None
+    clave = (umbral, app.config['PERFILADO_INTERVALO_MS'], app.config['PERFILADO_CARPETA'])
+    if clave not in _perfiladores:
+        _perfiladores[clave] = PerfiladorMuestreo(app.config['PERFILADO_CARPETA'], umbral / 1000,
+                                                  app.config['PERFILADO_INTERVALO_MS'] / 1000)
+    return _perfiladores[clave]
+
+@app.before_request
+def iniciar_metricas():
+    """Empieza a medir las fases de la petición (y a muestrearla si el perfilador está activo)"""
+    metricas.iniciar_peticion()
+    perfilador = obtener_perfilador()
+    if perfilador is not None:
+        perfilador.iniciar()
+
+@app.after_request
+def registrar_metricas(respuesta):
+    """Registra la duración por ruta (la regla, no la URL, para no multiplicar las series)"""
+    ruta = request.url_rule.rule if request.url_rule is not None else '(sin_ruta)'
+    duracion = metricas.terminar_peticion(ruta, request.method, respuesta.status_code)
+    perfilador = obtener_perfilador()
+    if perfilador is not None and duracion is not None:
+        volcado = perfilador.terminar(duracion, f'{request.method} {request.full_path}')
+        if volcado:
+            print(f"Petición lenta ({duracion * 1000:.0f} ms), perfil en {volcado}")
+    return respuesta
+
+@app.teardown_request
+def limpiar_metricas(error=None):
+    # Si la vista lanzó una excepción after_request no se ejecuta
+    metricas.descartar_peticion()
+    perfilador = obtener_perfilador()
+    if perfilador is not None:
+        perfilador.terminar(0, '')
+
+def _inicio_render(sender, template, context, **extra):
+    g.inicio_render = time.perf_counter()
+
+def _fin_render(sender, template, context, **extra):
+    metricas.sumar_fase('render', time.perf_counter() - g.pop('inicio_render', time.perf_counter()))
+
+before_render_template.connect(_inicio_render, app)
+template_rendered.connect(_fin_render, app)
+
+def obtener_instantanea():
+    """Instantánea vigente, fijada para toda la petición (caché y vista ven la misma versión)"""
+    if 'instantanea' not in g:
+        g.instantanea = almacen.obtener()
+    return g.instantanea
+
+def obtener_datos():
+    """Devuelve los datos transformados vigentes (compartidos, no modificar)"""
+    instantanea = obtener_instantanea()
+    return instantanea.datos if instantanea is not None else None
+
+def respuesta_cacheada(vista):
+    """
+    Cachea la respuesta de una vista que solo depende de los datos y de sus argumentos.
+    Añade ETag (de la huella de contenido) y Last-Modified (de la última escritura de la
+    fuente), iguales en todos los procesos; un cliente con If-None-Match
+    (o If-Modified-Since) vigente recibe 304 sin que se ejecute nada.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        instantanea = obtener_instantanea()
+        if instantanea is None:
+            return vista(*args, **kwargs)
         
-        with pd.ExcelWriter(excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
-            resultados_df.to_excel(writer, sheet_name='5-results_ehi', index=False)
+        argumentos = tuple(sorted(request.args.items(multi=True)))
+        clave = (request.endpoint, request.path, argumentos, instantanea.version)
+        etag = hashlib.blake2b(repr((request.path, argumentos, instantanea.etiqueta)).encode(),
+                               digest_size=10).hexdigest()
+        modificado = datetime.fromtimestamp(int(instantanea.modificado), timezone.utc)
         
-        return True
-    except Exception as e:
-        print(f"Error guardando resultados: {e}")
-        return False
+        if request.method in ('GET', 'HEAD'):
+            if request.if_none_match:
+                vigente = request.if_none_match.contains_weak(etag)
+            else:
+                vigente = request.if_modified_since is not None and request.if_modified_since >= modificado
+            if vigente:
+                respuesta = Response(status=304)
+                return marcar_respuesta(respuesta, etag, modificado)
+        
+        guardada = cache_respuestas.obtener(clave)
+        if guardada is not None:
+            cuerpo, estado, tipo = guardada
+            respuesta = Response(cuerpo, status=estado, mimetype=tipo)
+        else:
+            respuesta = app.make_response(vista(*args, **kwargs))
+            if respuesta.status_code != 200:
+                # Los errores no se cachean ni llevan ETag
+                return respuesta
+            cache_respuestas.guardar(clave, (respuesta.get_data(), respuesta.status_code, respuesta.mimetype))
+        
+        return marcar_respuesta(respuesta, etag, modificado)
+    return envoltura
+
+def marcar_respuesta(respuesta, etag, modificado):
+    """Cabeceras de validación: el cliente puede guardar la respuesta pero debe revalidarla"""
+    respuesta.set_etag(etag, weak=True)
+    respuesta.last_modified = modificado
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+def obtener_indice(instantanea):
+    """Índice por site_id de la instantánea (se construye una vez por versión de datos)"""
+    return instantanea.derivado('indice_sitios', IndiceSitios)
+
+def obtener_indice_espacial(instantanea):
+    """Índice en rejilla por coordenadas de la instantánea (uno por versión de datos)"""
+    return instantanea.derivado('indice_espacial', IndiceEspacial)
+
+def obtener_listado(instantanea):
+    """Sitios unidos con su último resultado, ordenados por site_id (uno por versión de datos)"""
+    return instantanea.derivado('listado_sitios', ListadoSitios)
+
+def obtener_resultados_por_sitio(instantanea):
+    """Último resultado de cada sitio, {site_id: registro} (uno por versión de datos)"""
+    return instantanea.derivado('resultados_por_sitio', resultados_por_sitio)
+
+def obtener_registros_sitios(instantanea):
+    """Filas de la hoja de sitios como diccionarios (una lista por versión de datos)"""
+    return instantanea.derivado('registros_sitios', lambda datos: datos['sites'].to_dict('records'))
+
+def fragmento(plantilla, clave, **contexto):
+    """Fragmento de plantilla de un sitio; se renderiza una vez por versión de datos"""
+    instantanea = obtener_instantanea()
+    version = instantanea.version if instantanea is not None else None
+    return cache_fragmentos.renderizar(app.jinja_env, plantilla, clave, version, contexto)
+
+app.jinja_env.globals['fragmento'] = fragmento
+
+def responder_listado(filas, siguiente, campos, formato):
+    """
+    Respuesta JSON paginada o, con formato=ndjson, un registro por línea generado
+    por bloques para no armar toda la respuesta en memoria. Con formato=compacto
+    se devuelve un arreglo por columna y las categorías como códigos.
+    """
+    if formato == 'ndjson':
+        def generar():
+            lineas = []
+            for registro in registros_en_bloques(filas, campos):
+                lineas.append(app.json.dumps(registro))
+                if len(lineas) >= 500:
+                    yield '\n'.join(lineas) + '\n'
+                    lineas = []
+            if lineas:
+                yield '\n'.join(lineas) + '\n'
+        
+        respuesta = Response(generar(), mimetype='application/x-ndjson')
+        if siguiente is not None:
+            respuesta.headers['X-Siguiente-Cursor'] = siguiente
+        return respuesta
+    
+    if formato == 'compacto':
+        return jsonify({
+            'columnas': columnas_compactas(filas, campos),
+            'categorias': ETIQUETAS.tolist(),
+            'siguiente_cursor': siguiente
+        })
+    
+    return jsonify({
+        'datos': registros(filas, campos),
+        'siguiente_cursor': siguiente
+    })
+
+def leer_rectangulo():
+    """Lee ?sur=&oeste=&norte=&este= (por defecto, el mundo entero)"""
+    return (request.args.get('sur', -90.0, type=float),
+            request.args.get('oeste', -180.0, type=float),
+            request.args.get('norte', 90.0, type=float),
+            request.args.get('este', 180.0, type=float))
+
+def calcular_indices_sitio(indice, site_id):
+    """Calcula BI, TFI, VSI y EHI de un sitio; devuelve también sus filas de biodiversidad"""
+    with metricas.fase('calculo'):
+        biodiv_data = indice.filas('biodiversity', site_id)
+        bi = calcular_shannon_wiener(biodiv_data)
+        tfi = calcular_tfi(indice.ultima('trophic', site_id))
+        vsi = calcular_vsi(indice.ultima('vsi', site_id))
+        ehi_result = calcular_ehi_compacto(tfi, bi, vsi)
+    return biodiv_data, bi, tfi, vsi, ehi_result
+
+def simular_sitio(indice, site_id, muestras, semilla=None, nivel=0.95):
+    """Incertidumbre Monte Carlo de un sitio con sus filas del índice"""
+    # El site_id de las tablas puede ser numérico: se usa el de la fila del sitio, no el de la URL
+    clave = indice.primera('sites', site_id).get('site_id', site_id)
+    with metricas.fase('calculo'):
+        resultado = simular_incertidumbre(indice.filas('biodiversity', site_id), indice.filas('trophic', site_id),
+                                          indice.filas('vsi', site_id), [clave], muestras=muestras,
+                                          semilla=semilla, nivel=nivel)
+    return resumen_sitio(resultado)
 
 # SOLO UNA DEFINICIÓN DE ESTA RUTA
 @app.route('/')
 def index():
     """Página principal con resumen de todos los sitios"""
-    datos = cargar_datos_excel()
-    datos_transformados = transformar_datos(datos)
+    instantanea = obtener_instantanea()
     
-    if datos_transformados is None:
-        return render_template('index.html', error="No se pudo cargar el archivo de datos", zonas=[])
+    if instantanea is None:
+        return render_template('index.html', error="No se pudo cargar el archivo de datos", zonas=[], total_sitios=0)
     
-    # Combinar datos de sitios con resultados
-    sites = datos_transformados['sites']
-    results = datos_transformados['results'] if not datos_transformados['results'].empty else None
+    # Sitios con su último resultado, una página de tarjetas por petición (?cursor=)
+    listado = obtener_listado(instantanea)
+    zonas, siguiente = listado.pagina(request.args.get('cursor'), app.config['DASHBOARD_POR_PAGINA'])
     
-    if results is not None:
-        zonas = pd.merge(sites, results, on='site_id', how='left')
-    else:
-        zonas = sites
-    
-    zonas_list = zonas.to_dict('records')
-    
-    return render_template('index.html', zonas=zonas_list)
+    # La página lleva la secuencia de cambios de estos datos, desde la que el cliente sincroniza
+    registro = obtener_registro_cambios()
+    registro.sincronizar(instantanea)
+    epoca, seq = registro.estado()
+    seq_datos = registro.seq_de(instantanea.etiqueta)
+    return render_template('index.html', zonas=registros(zonas), total_sitios=len(listado),
+                           siguiente_cursor=siguiente, seq_cambios=seq if seq_datos is None else seq_datos,
+                           epoca_cambios=epoca)
 
 
 @app.route('/zona/<site_id>')
+@respuesta_cacheada
 def zona_detalle(site_id):
     """Vista detallada de un sitio específico con todos sus índices"""
-    datos = cargar_datos_excel()
-    datos_transformados = transformar_datos(datos)
+    instantanea = obtener_instantanea()
     
-    if datos_transformados is None:
+    if instantanea is None:
         return "Error cargando datos", 500
     
+    indice = obtener_indice(instantanea)
+    
     # Buscar el sitio
-    site = datos_transformados['sites'][datos_transformados['sites']['site_id'] == site_id]
+    site_data = indice.primera('sites', site_id)
     
-    if site.empty:
+    if not site_data:
         return "Sitio no encontrado", 404
     
-    site_data = site.iloc[0].to_dict()
-    
-    # Obtener datos de biodiversidad para este sitio (usar datos transformados)
-    biodiv_data = datos_transformados['biodiversity'][datos_transformados['biodiversity']['site_id'] == site_id]
+    # Calcular índices con los datos transformados del sitio
+    biodiv_data, bi, tfi, vsi, ehi_result = calcular_indices_sitio(indice, site_id)
     
-    # Obtener datos tróficos
-    trophic_data = datos_transformados['trophic'][datos_transformados['trophic']['site_id'] == site_id]
-    
-    # Obtener datos VSI
-    vsi_data = datos_transformados['vsi'][datos_transformados['vsi']['site_id'] == site_id]
-    
-    # Calcular índices
-    bi = calcular_shannon_wiener(biodiv_data)
-    tfi = calcular_tfi(trophic_data.iloc[0].to_dict() if not trophic_data.empty else {})
-    vsi = calcular_vsi(vsi_data.iloc[0].to_dict() if not vsi_data.empty else {})
-    ehi_result = calcular_ehi_completo(tfi, bi, vsi)
+    # Intervalo de confianza y probabilidad de cada categoría del EHI
+    incertidumbre = simular_sitio(indice, site_id, app.config['INCERTIDUMBRE_MUESTRAS'],
+                                  app.config['INCERTIDUMBRE_SEMILLA_ZONA'])
     
     # Buscar resultados guardados
-    resultado_guardado = datos_transformados['results'][datos_transformados['results']['site_id'] == site_id]
-    if not resultado_guardado.empty:
-        resultado_guardado = resultado_guardado.iloc[0].to_dict()
-    else:
-        resultado_guardado = None
+    resultado_guardado = indice.primera('results', site_id) or None
     
     # Pasar los datos de biodiversidad transformados
     return render_template('zona.html', 
@@ -173,127 +529,216 @@ def zona_detalle(site_id):
                          bi=bi,
                          tfi=tfi,
                          vsi=vsi,
-                         ehi=ehi_result,
+                         ehi=ehi_result.a_dict(),
+                         incertidumbre=incertidumbre,
                          resultado_guardado=resultado_guardado,
                          biodiv_especies=biodiv_data.to_dict('records') if not biodiv_data.empty else [])
 
 @app.route('/admin')
 def admin():
     """Panel administrativo para recalcular todos los índices"""
-    datos = cargar_datos_excel()
+    instantanea = obtener_instantanea()
     
-    if datos is None:
+    if instantanea is None:
         return render_template('admin.html', error="No se pudo cargar el archivo de datos")
     
-    sites = datos['sites'].to_dict('records')
-    results = datos['results'].to_dict('records') if not datos['results'].empty else []
-    
-    return render_template('admin.html', zonas=sites, resultados=results)
+    # El cruce sitio → resultado se arma una vez por versión de datos, no en cada fila de la plantilla
+    # La secuencia se lee antes que las alertas: el flujo en vivo no se salta ninguna que llegue entre medias
+    detector = obtener_detector_anomalias()
+    ultimo_seq = detector.seq
+    return render_template('admin.html', zonas=obtener_registros_sitios(instantanea),
+                           resultados=obtener_resultados_por_sitio(instantanea),
+                           alertas=detector.recientes(), ultimo_seq_alertas=ultimo_seq)
 
-@app.route('/api/calcular/<site_id>', methods=['POST'])
+@app.route('/api/calcular/<site_id>', methods=['GET', 'POST'])
+@respuesta_cacheada
 def api_calcular_sitio(site_id):
-    """Calcula todos los índices para un sitio específico"""
+    """Calcula todos los índices para un sitio específico (?formato=compacto: solo valores y códigos)"""
     try:
-        datos = cargar_datos_excel()
+        instantanea = obtener_instantanea()
         
-        if datos is None:
+        if instantanea is None:
             return jsonify({'error': 'No se pudo cargar datos'}), 500
         
-        # Obtener datos del sitio
-        biodiv_data = datos['biodiversity'][datos['biodiversity']['site_id'] == site_id]
-        trophic_data = datos['trophic'][datos['trophic']['site_id'] == site_id]
-        vsi_data = datos['vsi'][datos['vsi']['site_id'] == site_id]
+        # Calcular índices con las filas del sitio
+        _, bi, tfi, vsi, ehi_result = calcular_indices_sitio(obtener_indice(instantanea), site_id)
         
-        # Calcular índices
-        bi = calcular_shannon_wiener(biodiv_data)
-        tfi = calcular_tfi(trophic_data.iloc[0].to_dict() if not trophic_data.empty else {})
-        vsi = calcular_vsi(vsi_data.iloc[0].to_dict() if not vsi_data.empty else {})
-        ehi_result = calcular_ehi_completo(tfi, bi, vsi)
+        if request.args.get('formato') == 'compacto':
+            return jsonify({'site_id': site_id, **ehi_result.a_compacto(), 'categorias': ETIQUETAS.tolist()})
         
         return jsonify({
             'site_id': site_id,
             'BI': bi,
             'TFI': tfi,
             'VSI': vsi,
-            'EHI': ehi_result
+            'EHI': ehi_result.a_dict()
         })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/incertidumbre/<site_id>')
+@respuesta_cacheada
+def api_incertidumbre_sitio(site_id):
+    """Intervalos de BI/TFI/VSI/EHI y probabilidad de cada categoría por Monte Carlo (?muestras=&semilla=&nivel=)"""
+    muestras = request.args.get('muestras', app.config['INCERTIDUMBRE_MUESTRAS'], type=int)
+    semilla = request.args.get('semilla', type=int)
+    nivel = request.args.get('nivel', 0.95, type=float)
+    
+    if not 1 <= muestras <= MAX_MUESTRAS:
+        return jsonify({'error': f'muestras debe estar entre 1 y {MAX_MUESTRAS}'}), 400
+    if not 0 < nivel < 1:
+        return jsonify({'error': 'nivel debe estar entre 0 y 1'}), 400
+    if semilla is not None and not 0 <= semilla < MAX_SEMILLA:
+        return jsonify({'error': f'semilla debe ser un entero entre 0 y {MAX_SEMILLA - 1}'}), 400
+    
+    try:
+        instantanea = obtener_instantanea()
+        
+        if instantanea is None:
+            return jsonify({'error': 'No se pudo cargar datos'}), 500
+        
+        indice = obtener_indice(instantanea)
+        if not indice.primera('sites', site_id):
+            return jsonify({'error': 'Sitio no encontrado'}), 404
+        
+        return jsonify(simular_sitio(indice, site_id, muestras, semilla, nivel))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/calcular_lote', methods=['POST'])
+def api_calcular_lote():
+    """
+    Calcula muchos sitios en una pasada y transmite un resultado por línea (NDJSON).
+    Cuerpo: {"site_ids": [...]} y/o {"filtro": {"ecosistema", "rectangulo", "categoria"}}.
+    Los sitios inexistentes o que fallan llegan como {"site_id", "error"}.
+    """
+    cuerpo = request.get_json(silent=True)
+    if not isinstance(cuerpo, dict):
+        return jsonify({'error': 'El cuerpo debe ser un objeto JSON con site_ids o filtro'}), 400
+
+    instantanea = obtener_instantanea()
+    if instantanea is None:
+        return jsonify({'error': 'No se pudo cargar datos'}), 500
+
+    try:
+        site_ids, faltantes = seleccionar_sitios(instantanea.datos, obtener_indice_espacial(instantanea),
+                                                 cuerpo.get('site_ids'), cuerpo.get('filtro'),
+                                                 app.config['LOTE_MAX_SITIOS'])
+    except ErrorCalculoMasivo as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # El generador usa los datos de la instantánea fijada, no el contexto de la petición
+    datos = instantanea.datos
+    def generar():
+        for site_id in faltantes:
+            yield app.json.dumps(registro_error(site_id, 'Sitio no encontrado')) + '\n'
+        # Una escritura por bloque calculado: el cliente recibe resultados mientras se calcula el resto
+        lineas = []
+        for registro in calcular_en_bloques(datos, site_ids):
+            lineas.append(app.json.dumps(registro))
+            if len(lineas) >= 500:
+                yield '\n'.join(lineas) + '\n'
+                lineas = []
+        if lineas:
+            yield '\n'.join(lineas) + '\n'
+    
+    respuesta = Response(generar(), mimetype='application/x-ndjson')
+    respuesta.headers['X-Total-Sitios'] = str(len(site_ids) + len(faltantes))
+    return respuesta
+
+def guardar_recalculo(instantanea, resumen, forzar=False):
+    """Persiste los resultados de un recálculo, los añade al historial y actualiza las estadísticas"""
+    site_ids = instantanea.datos['sites']['site_id']
+    # Forzado, se escribe aunque solo cambie la fecha del cálculo
+    if not guardar_resultados_ehi(resumen['nuevos'], site_ids, forzar):
+        return False
+    # Cada resultado calculado queda también en el historial
+    obtener_historial().agregar(resumen['nuevos'])
+    # Solo se suman/restan los sitios recalculados, sin recorrer todos los resultados
+    agregados.sincronizar(instantanea)
+    agregados.aplicar(resumen['nuevos'], ecosistemas_de(instantanea.datos), site_ids)
+    # Los resultados guardados antes son la línea base; cada resultado nuevo actualiza su sitio en O(1)
+    detector = obtener_detector_anomalias()
+    detector.sincronizar(instantanea)
+    detector.observar(resumen['nuevos'], site_ids)
+    return True
+
 @app.route('/api/calcular_todos', methods=['POST'])
 def api_calcular_todos():
-    """Recalcula EHI para todos los sitios y guarda en Excel"""
+    """Lanza (o se une a) el recálculo en segundo plano de los sitios cuyos datos cambiaron"""
     try:
-        datos = cargar_datos_excel()
-        datos_transformados = transformar_datos(datos)
+        instantanea = obtener_instantanea()
         
-        if datos_transformados is None:
+        if instantanea is None:
             return jsonify({'error': 'No se pudo cargar datos'}), 500
         
-        resultados = []
+        # ?forzar=1 (o {"forzar": true} en el cuerpo) recalcula todos los sitios
+        cuerpo = request.get_json(silent=True) or {}
+        forzar = request.args.get('forzar', '').lower() in ('1', 'true', 'si') or bool(cuerpo.get('forzar'))
         
-        for _, site in datos_transformados['sites'].iterrows():
-            site_id = site['site_id']
-            
-            # Obtener datos específicos
-            biodiv_data = datos_transformados['biodiversity'][datos_transformados['biodiversity']['site_id'] == site_id]
-            trophic_data = datos_transformados['trophic'][datos_transformados['trophic']['site_id'] == site_id]
-            vsi_data = datos_transformados['vsi'][datos_transformados['vsi']['site_id'] == site_id]
-            
-            # Calcular índices
-            bi = calcular_shannon_wiener(biodiv_data)
-            tfi = calcular_tfi(trophic_data.iloc[0].to_dict() if not trophic_data.empty else {})
-            vsi = calcular_vsi(vsi_data.iloc[0].to_dict() if not vsi_data.empty else {})
-            ehi_result = calcular_ehi_completo(tfi, bi, vsi)
-            
-            resultados.append({
-                'site_id': site_id,
-                'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'BI': bi['valor'],
-                'TFI': tfi['valor'], 
-                'VSI': vsi['valor'],
-                'EHI': ehi_result['valor'],
-                'categoria': ehi_result['categoria']
-            })
+        trabajo, nuevo = gestor_recalculo.iniciar(
+            instantanea, forzar, lambda resumen: guardar_recalculo(instantanea, resumen, forzar))
         
-        # Crear DataFrame y guardar
-        resultados_df = pd.DataFrame(resultados)
+        # ?esperar=1 mantiene el comportamiento síncrono para scripts
+        if request.args.get('esperar', '').lower() in ('1', 'true', 'si'):
+            trabajo.esperar()
+            estado = trabajo.a_dict()
+            if trabajo.estado == 'error':
+                return jsonify({'error': estado['error'], **estado}), 500
+            return jsonify({'success': True, 'resultados_calculados': trabajo.recalculados, **estado})
         
-        # Guardar en Excel (usando nombres de columnas consistentes)
-        if guardar_resultados_ehi(resultados_df):
-            return jsonify({
-                'success': True,
-                'total_sitios': len(datos_transformados['sites']),
-                'resultados_calculados': len(resultados)
-            })
-        else:
-            return jsonify({'error': 'Error guardando resultados'}), 500
+        respuesta = jsonify({
+            'success': True,
+            'nuevo': nuevo,
+            'estado_url': f"/api/trabajos/{trabajo.id}",
+            **trabajo.a_dict()
+        })
+        return respuesta, 202
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/trabajos/<trabajo_id>')
+def api_trabajo(trabajo_id):
+    """Progreso, rendimiento y conteos finales de un recálculo"""
+    trabajo = gestor_recalculo.obtener(trabajo_id)
+    if trabajo is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(trabajo.a_dict())
+
 @app.route('/api/estadisticas')
+@respuesta_cacheada
 def api_estadisticas():
-    """Devuelve estadísticas generales del ecosistema"""
+    """Devuelve estadísticas generales del ecosistema, globales y por tipo de ecosistema"""
     try:
-        datos = cargar_datos_excel()
+        instantanea = obtener_instantanea()
         
-        if datos is None or datos['results'].empty:
+        if instantanea is None:
             return jsonify({'error': 'No hay datos disponibles'}), 404
         
-        results = datos['results']
+        # Los agregados ya están al día; solo se reconstruyen si los datos cambiaron fuera de la app
+        with metricas.fase('calculo'):
+            agregados.sincronizar(instantanea)
+            resumen = agregados.resumen()
+        global_ = resumen['global']
         
-        # Usar nombres de columnas en minúsculas (como están en el Excel)
+        if global_['total_sitios'] == 0:
+            return jsonify({'error': 'No hay datos disponibles'}), 404
+        
+        indices = global_['indices']
         stats = {
-            'total_sitios': len(results),
-            'ehi_promedio': float(results['ehi'].mean()),
-            'ehi_max': float(results['ehi'].max()),
-            'ehi_min': float(results['ehi'].min()),
-            'por_categoria': results['categoria'].value_counts().to_dict(),
-            'bi_promedio': float(results['bi'].mean()),
-            'tfi_promedio': float(results['tfi'].mean()),
-            'vsi_promedio': float(results['vsi'].mean())
+            'total_sitios': global_['total_sitios'],
+            'ehi_promedio': indices['EHI']['promedio'],
+            'ehi_max': indices['EHI']['max'],
+            'ehi_min': indices['EHI']['min'],
+            'por_categoria': global_['por_categoria'],
+            'bi_promedio': indices['BI']['promedio'],
+            'tfi_promedio': indices['TFI']['promedio'],
+            'vsi_promedio': indices['VSI']['promedio'],
+            'indices': indices,
+            'por_ecosistema': resumen['por_ecosistema']
         }
         
         return jsonify(stats)
@@ -301,26 +746,284 @@ def api_estadisticas():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/historial/<site_id>')
+def api_historial(site_id):
+    """Serie histórica de un sitio, reducida en el servidor a ?puntos= intervalos"""
+    try:
+        hasta = pd.Timestamp(request.args['hasta']) if request.args.get('hasta') else pd.Timestamp.now()
+        desde = pd.Timestamp(request.args['desde']) if request.args.get('desde') else hasta - pd.Timedelta(days=365)
+        puntos = request.args.get('puntos', 200, type=int)
+    except ValueError:
+        return jsonify({'error': 'Parámetros desde/hasta/puntos inválidos'}), 400
+    
+    if desde > hasta:
+        return jsonify({'error': 'desde debe ser anterior a hasta'}), 400
+    puntos = max(0, min(puntos, app.config['HISTORIAL_MAX_PUNTOS']))
+    
+    try:
+        serie = obtener_historial().consultar(site_id, int(desde.timestamp()), int(hasta.timestamp()), puntos)
+        return jsonify({
+            'site_id': site_id,
+            'desde': desde.strftime('%Y-%m-%d %H:%M:%S'),
+            'hasta': hasta.strftime('%Y-%m-%d %H:%M:%S'),
+            'puntos': puntos,
+            'serie': serie
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/sitios/bbox')
+def api_sitios_bbox():
+    """Sitios dentro del rectángulo visible del mapa, con su último EHI y categoría"""
+    instantanea = obtener_instantanea()
+    if instantanea is None:
+        return jsonify({'error': 'No se pudo cargar datos'}), 500
+    
+    limite = max(1, min(request.args.get('limite', app.config['MAPA_MAX_SITIOS'], type=int),
+                        app.config['MAPA_MAX_SITIOS']))
+    sitios, total = obtener_indice_espacial(instantanea).en_rectangulo(*leer_rectangulo(), limite=limite)
+    sitios = sitios.astype(object).where(sitios.notna(), None)
+    
+    return jsonify({
+        'total': total,
+        'truncado': total > len(sitios),
+        'sitios': sitios.to_dict('records')
+    })
+
+@app.route('/api/sitios/clusters')
+def api_sitios_clusters():
+    """Sitios agrupados para el nivel de zoom del mapa, con conteos por categoría EHI"""
+    instantanea = obtener_instantanea()
+    if instantanea is None:
+        return jsonify({'error': 'No se pudo cargar datos'}), 500
+    
+    zoom = request.args.get('zoom', 0, type=int)
+    indice = obtener_indice_espacial(instantanea)
+    return jsonify({
+        'zoom': zoom,
+        'total_sitios': len(indice),
+        'clusters': indice.clusters(zoom, *leer_rectangulo())
+    })
+
+@app.route('/api/ingesta/<tabla>', methods=['POST'])
+def api_ingesta(tabla):
+    """Recibe un lote NDJSON o CSV de observaciones y lo encola para escribirlo por lotes"""
+    try:
+        clave = resolver_tabla(tabla)
+        lote = parsear_lote(request.get_data(cache=False), request.content_type)
+        validas, errores = validar_lote(clave, lote)
+    except ErrorIngesta as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if len(validas) and not cola_ingesta.encolar(clave, validas):
+        respuesta = jsonify({
+            'error': 'Cola de ingesta llena, reintente más tarde',
+            'pendientes': cola_ingesta.pendientes
+        })
+        respuesta.headers['Retry-After'] = str(max(1, int(app.config['INGESTA_INTERVALO'])))
+        return respuesta, 429
+    
+    return jsonify({
+        'tabla': clave,
+        'aceptadas': len(validas),
+        'rechazadas': len(lote) - len(validas),
+        'errores': errores,
+        'pendientes': cola_ingesta.pendientes
+    }), 202
+
+@app.route('/api/ingesta/fallidos')
+def api_ingesta_fallidos():
+    """Lotes de ingesta apartados tras agotar los reintentos (el más reciente primero)"""
+    return jsonify({
+        'filas_fallidas': cola_ingesta.filas_fallidas,
+        'lotes': list(reversed(cola_ingesta.fallidos))
+    })
+
+@app.route('/api/alertas')
+def api_alertas():
+    """Alertas de anomalías posteriores a ?desde=<seq> (?limite=&site_id=)"""
+    desde = request.args.get('desde', 0, type=int)
+    limite = request.args.get('limite', type=int)
+    if limite is not None and limite < 1:
+        return jsonify({'error': 'limite debe ser mayor que 0'}), 400
+    return jsonify(obtener_detector_anomalias().consultar(desde, limite, request.args.get('site_id')))
+
+@app.route('/api/alertas/stream')
+def api_alertas_stream():
+    """
+    Flujo Server-Sent Events de alertas. Empieza después de ?desde= o de la
+    cabecera Last-Event-ID (reconexión); sin ninguna de las dos, solo envía las nuevas.
+    """
+    detector = obtener_detector_anomalias()
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('desde', detector.seq, type=int)
+    espera = app.config['ALERTAS_SSE_ESPERA']
+    
+    def generar():
+        ultimo = desde
+        while True:
+            consulta = detector.esperar(ultimo, espera)
+            if consulta['truncado']:
+                # El cliente perdió alertas que ya salieron del búfer
+                yield f"event: truncado\ndata: {app.json.dumps({'desde': ultimo})}\n\n"
+            for alerta in consulta['alertas']:
+                yield f"id: {alerta['seq']}\nevent: alerta\ndata: {app.json.dumps(alerta)}\n\n"
+            if not consulta['alertas']:
+                yield ': latido\n\n'
+            ultimo = max(ultimo, consulta['ultimo_seq'])
+    
+    respuesta = Response(generar(), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no'  # Sin búfer en proxies (nginx)
+    return respuesta
+
+@app.route('/api/sitios')
+def api_sitios():
+    """Sitios con su último resultado, paginados por cursor (?cursor=&limite=&campos=&formato=ndjson|compacto)"""
+    try:
+        instantanea = obtener_instantanea()
+        
+        if instantanea is None:
+            return jsonify({'error': 'No se pudo cargar datos'}), 500
+        
+        listado = obtener_listado(instantanea)
+        formato = request.args.get('formato', 'json')
+        campos = listado.validar_campos(leer_campos(request.args.get('campos')))
+        limite = leer_limite(request.args.get('limite'), formato)
+        filas, siguiente = listado.pagina(request.args.get('cursor'), limite)
+        
+        return responder_listado(filas, siguiente, campos, formato)
+    
+    except ErrorListado as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/cambios')
+def api_cambios():
+    """
+    Sitios y resultados que cambiaron desde ?desde=<seq>&epoca= (sincronización incremental).
+    Con resync=true el cliente debe volver a cargar todo (sin desde, registro truncado,
+    otra época o demasiados cambios). Con ?tarjetas=<id>,<id> devuelve el HTML de la
+    tarjeta de esos sitios, si cambiaron, en lugar de sus filas en sitios.
+    """
+    instantanea = obtener_instantanea()
+    if instantanea is None:
+        return jsonify({'error': 'No se pudo cargar datos'}), 500
+    
+    registro = obtener_registro_cambios()
+    registro.sincronizar(instantanea)
+    desde = request.args.get('desde', type=int)
+    epoca, seq_actual = registro.estado()
+    base = {'epoca': epoca}
+    if desde is None:
+        return jsonify({**base, 'seq': seq_actual, 'resync': True})
+    
+    # Solo los cambios que ya están en los datos de esta instantánea: el resto llega en el próximo ciclo
+    hasta = registro.seq_de(instantanea.etiqueta)
+    if hasta is None:
+        # Este proceso aún no cargó la versión que otro ya registró
+        return jsonify({**base, 'seq': desde, 'resync': False, 'cambios': [], 'sitios': [], 'borrados': []})
+    consulta = registro.consultar(desde, request.args.get('epoca'), hasta)
+    if consulta is None:
+        return jsonify({**base, 'seq': seq_actual, 'resync': True})
+    seq, cambios = consulta
+    
+    borrados = [c['site_id'] for c in cambios if c['tabla'] == 'sites' and c['operacion'] == 'baja']
+    modificados = {c['site_id'] for c in cambios} - set(borrados)
+    if len(modificados) > app.config['CAMBIOS_MAX_SITIOS']:
+        return jsonify({**base, 'seq': seq, 'resync': True})
+    
+    # Filas actuales (sitio unido con su último resultado) solo de los sitios que cambiaron
+    listado = obtener_listado(instantanea)
+    filas, _ = listado.pagina(site_ids=modificados)
+    sitios = registros(filas)
+    tarjetas = {}
+    if request.args.get('tarjetas'):
+        # Solo las tarjetas que el cliente tiene en pantalla
+        pedidas = set(request.args['tarjetas'].split(','))
+        tarjetas = {str(zona['site_id']): str(fragmento('tarjeta_sitio.html', zona['site_id'], zona=zona))
+                    for zona in sitios if str(zona['site_id']) in pedidas}
+        sitios = [zona for zona in sitios if str(zona['site_id']) not in tarjetas]
+    respuesta = {**base, 'seq': seq, 'resync': False, 'cambios': cambios, 'sitios': sitios,
+                 'borrados': borrados, 'total_sitios': len(listado)}
+    if request.args.get('tarjetas'):
+        respuesta['tarjetas'] = tarjetas
+    return jsonify(respuesta)
+
+@app.route('/api/categorias')
+def api_categorias():
+    """Etiqueta, color e interpretación de cada código de categoría del formato compacto"""
+    return jsonify(tabla_categorias())
+
+@app.route('/metrics')
+def metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return Response(metricas.registro.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/comparar', methods=['POST'])
 def api_comparar_sitios():
     """Compara múltiples sitios"""
     try:
-        site_ids = request.json.get('site_ids', [])
+        cuerpo = request.get_json(silent=True) or {}
+        site_ids = cuerpo.get('site_ids', [])
         
         if not site_ids:
             return jsonify({'error': 'No se proporcionaron site_ids'}), 400
         
-        datos = cargar_datos_excel()
-        results = datos['results'][datos['results']['site_id'].isin(site_ids)]
-        sites = datos['sites'][datos['sites']['site_id'].isin(site_ids)]
+        instantanea = obtener_instantanea()
+        if instantanea is None:
+            return jsonify({'error': 'No se pudo cargar datos'}), 500
+        
+        # Los parámetros de paginación pueden ir en el cuerpo o en la URL
+        opciones = {clave: cuerpo.get(clave, request.args.get(clave))
+                    for clave in ('cursor', 'limite', 'campos', 'formato')}
+        
+        listado = obtener_listado(instantanea)
+        campos = listado.validar_campos(leer_campos(opciones['campos']))
         
-        comparacion = pd.merge(sites, results, on='site_id', how='left')
+        if opciones['cursor'] is None and opciones['limite'] is None and opciones['formato'] is None:
+            # Sin paginación se mantiene la respuesta original: una lista con todos los sitios
+            filas, _ = listado.pagina(site_ids=site_ids)
+            return jsonify(registros(filas, campos))
         
-        return jsonify(comparacion.to_dict('records'))
+        formato = opciones['formato'] or 'json'
+        limite = leer_limite(opciones['limite'], formato)
+        filas, siguiente = listado.pagina(opciones['cursor'], limite, site_ids=site_ids)
+        return responder_listado(filas, siguiente, campos, formato)
     
+    except ErrorListado as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.cli.command('compilar')
+def compilar_datos():
+    """Compila los datos de la fuente configurada en la instantánea binaria (flask --app app compilar)"""
+    ruta = almacen.compilar()
+    if ruta is None:
+        print("No se pudo compilar: revise la fuente de datos y COMPILADO_FILE")
+    else:
+        print(f"Instantánea compilada en {ruta} ({os.path.getsize(ruta) / 2**20:.1f} MB)")
+
+@app.cli.command('incertidumbre')
+@click.argument('salida')
+@click.option('--muestras', default=10000, show_default=True, help='Simulaciones por sitio')
+@click.option('--semilla', type=click.IntRange(0, MAX_SEMILLA - 1), default=None, help='Semilla para repetir exactamente la corrida')
+@click.option('--nivel', default=0.95, show_default=True, help='Nivel del intervalo de confianza')
+@click.option('--procesos', type=int, default=None, help='Procesos en paralelo (por defecto, todos los núcleos)')
+def incertidumbre_todos(salida, muestras, semilla, nivel, procesos):
+    """Incertidumbre Monte Carlo de todos los sitios en un CSV (flask --app app incertidumbre salida.csv)"""
+    datos = obtener_datos()
+    if datos is None:
+        print("No se pudo cargar datos")
+        return
+    inicio = time.perf_counter()
+    resultado = simular_todos(datos, muestras=muestras, semilla=semilla, nivel=nivel, procesos=procesos)
+    a_dataframe(resultado).to_csv(salida, index=False)
+    print(f"{len(resultado['site_id'])} sitios × {muestras} muestras en {time.perf_counter() - inicio:.1f} s "
+          f"(semilla {resultado['semilla']}) → {salida}")
+
 if __name__ == '__main__':
     # Crear carpeta de datos si no existe
     os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
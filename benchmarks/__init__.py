@@ -0,0 +1,4 @@
+"""
+Herramientas de rendimiento de EcoBalance: generador de datos sintéticos con el
+esquema del libro Excel y un ejecutor de benchmarks para los modelos y las rutas.
+"""
@@ -0,0 +1,292 @@
+"""
+Benchmarks de los modelos y de las rutas de la aplicación.
+
+Para cada tamaño genera un conjunto de datos sintético, lo carga en la app y
+mide cada función de models/ y cada ruta (con el cliente de pruebas de Flask):
+rendimiento por segundo, latencias p50/p99 y memoria máxima. Los resultados
+se guardan en JSON y pueden compararse con una ejecución anterior.
+
+    python -m benchmarks.ejecutar --tamanos 100,10000 --salida benchmarks/resultados/base.json
+    python -m benchmarks.ejecutar --tamanos 100,10000 --comparar benchmarks/resultados/base.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generador import escribir, generar_datos
+from models import calcular_ehi_completo, calcular_lote, calcular_shannon_wiener, calcular_tfi, calcular_vsi
+from services.indice_sitios import IndiceSitios
+
+CARPETA_RESULTADOS = os.path.join(os.path.dirname(__file__), 'resultados')
+
+
+def medir(funcion, repeticiones, elementos=1, memoria=True):
+    """
+    Ejecuta funcion(i) `repeticiones` veces y resume las latencias.
+    elementos es cuántas unidades (sitios, filas…) procesa cada llamada, para el
+    rendimiento por segundo. La memoria máxima se mide en una llamada extra con
+    tracemalloc, para que su sobrecoste no contamine los tiempos.
+    """
+    tiempos = []
+    for i in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(i)
+        tiempos.append(time.perf_counter() - inicio)
+
+    resultado = resumir_tiempos(tiempos, elementos)
+    if memoria:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcion(repeticiones)
+            resultado['pico_memoria_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 3)
+        finally:
+            tracemalloc.stop()
+    return resultado
+
+
+def resumir_tiempos(tiempos, elementos=1):
+    tiempos = np.asarray(tiempos)
+    total = float(tiempos.sum())
+    return {
+        'repeticiones': len(tiempos),
+        'p50_ms': round(float(np.percentile(tiempos, 50)) * 1000, 4),
+        'p99_ms': round(float(np.percentile(tiempos, 99)) * 1000, 4),
+        'media_ms': round(float(tiempos.mean()) * 1000, 4),
+        'por_segundo': round(len(tiempos) * elementos / total, 2) if total > 0 else None
+    }
+
+
+def benchmark_modelos(datos, muestra, repeticiones, rng):
+    """Funciones escalares de models/ sobre una muestra de sitios y calcular_lote sobre todos"""
+    indice = IndiceSitios(datos)
+    site_ids = datos['sites']['site_id'].to_numpy()
+    elegidos = rng.choice(site_ids, size=min(muestra, len(site_ids)), replace=False)
+
+    filas_bio = [indice.filas('biodiversity', s) for s in elegidos]
+    troficos = [indice.ultima('trophic', s) for s in elegidos]
+    vsis = [indice.ultima('vsi', s) for s in elegidos]
+    bis = [calcular_shannon_wiener(f) for f in filas_bio]
+    tfis = [calcular_tfi(t) for t in troficos]
+    vsi_res = [calcular_vsi(v) for v in vsis]
+    k = len(elegidos)
+
+    resultados = {
+        'calcular_shannon_wiener': medir(lambda i: calcular_shannon_wiener(filas_bio[i % k]), repeticiones * k // 10 or 1),
+        'calcular_tfi': medir(lambda i: calcular_tfi(troficos[i % k]), repeticiones * k),
+        'calcular_vsi': medir(lambda i: calcular_vsi(vsis[i % k]), repeticiones * k),
+        'calcular_ehi_completo': medir(
+            lambda i: calcular_ehi_completo(tfis[i % k], bis[i % k], vsi_res[i % k]), repeticiones * k),
+        'calcular_lote': medir(
+            lambda i: calcular_lote(datos['biodiversity'], datos['trophic'], datos['vsi'], site_ids),
+            max(1, repeticiones // 10), elementos=len(site_ids))
+    }
+    return resultados
+
+
+def casos_rutas(site_ids, rng):
+    """
+    Rutas a medir: (nombre, método, url(i) -> (url, cuerpo json), repeticiones relativas,
+    máximo de sitios para el que tiene sentido medirla).
+    """
+    def sitio(i):
+        return site_ids[i % len(site_ids)]
+
+    def rectangulo(i):
+        lat, lon = rng.uniform(-50, 50), rng.uniform(-170, 160)
+        return f'sur={lat:.3f}&oeste={lon:.3f}&norte={lat + 10:.3f}&este={lon + 15:.3f}'
+
+    return [
+        ('GET /', 'GET', lambda i: ('/', None), 1.0, None),
+        ('GET /zona/<site_id>', 'GET', lambda i: (f'/zona/{sitio(i)}', None), 1.0, None),
+        ('POST /api/calcular/<site_id>', 'POST', lambda i: (f'/api/calcular/{sitio(i)}', None), 1.0, None),
+        ('GET /api/estadisticas', 'GET', lambda i: ('/api/estadisticas', None), 1.0, None),
+        ('GET /api/sitios', 'GET', lambda i: ('/api/sitios?limite=100', None), 1.0, None),
+        ('GET /api/sitios?formato=ndjson', 'GET', lambda i: ('/api/sitios?formato=ndjson', None), 0.1, None),
+        ('GET /api/sitios/bbox', 'GET', lambda i: (f'/api/sitios/bbox?{rectangulo(i)}', None), 1.0, None),
+        ('GET /api/sitios/clusters', 'GET', lambda i: (f'/api/sitios/clusters?zoom={i % 8}', None), 1.0, None),
+        ('POST /api/comparar', 'POST',
+         lambda i: ('/api/comparar', {'site_ids': [sitio(i + j) for j in range(50)]}), 1.0, None),
+        ('POST /api/calcular_lote', 'POST',
+         lambda i: ('/api/calcular_lote', {'site_ids': [sitio(i + j) for j in range(500)]}), 1.0, None),
+        ('GET /api/historial/<site_id>', 'GET', lambda i: (f'/api/historial/{sitio(i)}', None), 1.0, None),
+        # Página completa de todos los sitios: pocas repeticiones
+        ('GET /admin', 'GET', lambda i: ('/admin', None), 0.1, None),
+    ]
+
+
+def benchmark_rutas(modulo_app, site_ids, repeticiones, rng):
+    """Mide cada ruta con el cliente de pruebas de Flask sobre los datos ya cargados"""
+    cliente = modulo_app.app.test_client()
+    n_sitios = len(site_ids)
+    resultados = {}
+
+    def peticion(metodo, url, cuerpo=None, esperado=(200,)):
+        respuesta = cliente.open(url, method=metodo, json=cuerpo)
+        respuesta.get_data()  # Consume también las respuestas transmitidas
+        if respuesta.status_code not in esperado:
+            raise RuntimeError(f'{metodo} {url} respondió {respuesta.status_code}')
+        return respuesta
+
+    # Primero el recálculo completo, así el resto de rutas ve resultados guardados
+    resultados['POST /api/calcular_todos (completo)'] = medir(
+        lambda i: peticion('POST', '/api/calcular_todos?esperar=1&forzar=1'), 1, elementos=n_sitios, memoria=False)
+    resultados['POST /api/calcular_todos (sin cambios)'] = medir(
+        lambda i: peticion('POST', '/api/calcular_todos?esperar=1'), 3, elementos=n_sitios, memoria=False)
+
+    for nombre, metodo, url, factor, max_sitios in casos_rutas(site_ids, rng):
+        if max_sitios is not None and n_sitios > max_sitios:
+            resultados[nombre] = {'omitido': f'más de {max_sitios} sitios'}
+            continue
+        veces = max(1, int(repeticiones * factor))
+        resultados[nombre] = medir(lambda i: peticion(metodo, *url(i)), veces)
+
+    # Ingesta al final porque cambia los datos
+    lote = pd.DataFrame({
+        'site_id': rng.choice(site_ids, 1000),
+        'especie_nombre': 'Especie_bench',
+        'abundancia': rng.integers(1, 50, 1000)
+    }).to_json(orient='records', lines=True)
+
+    def ingerir(i):
+        respuesta = cliente.post('/api/ingesta/biodiversity', data=lote, content_type='application/x-ndjson')
+        if respuesta.status_code not in (202, 429):
+            raise RuntimeError(f'POST /api/ingesta respondió {respuesta.status_code}')
+
+    resultados['POST /api/ingesta/<tabla>'] = medir(ingerir, max(1, repeticiones // 4), elementos=1000)
+    modulo_app.cola_ingesta.vaciar()
+    return resultados
+
+
+def ejecutar(tamanos, especies, repeticiones, muestra, backend, semilla, partes):
+    import app as modulo_app
+
+    rng = np.random.default_rng(semilla)
+    informe = {
+        'meta': {
+            'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'plataforma': platform.platform(),
+            'nucleos': os.cpu_count(),
+            'parametros': {'tamanos': tamanos, 'especies': especies, 'repeticiones': repeticiones,
+                           'muestra': muestra, 'backend': backend, 'semilla': semilla}
+        },
+        'resultados': {}
+    }
+
+    for tamano in tamanos:
+        print(f"\n== {tamano} sitios, {especies} especies por sitio ({backend}) ==")
+        carpeta = tempfile.mkdtemp(prefix='ecobalance_bench_')
+        try:
+            archivo = 'bench.xlsx' if backend == 'excel' else 'bench.db'
+            inicio = time.perf_counter()
+            escribir(generar_datos(tamano, especies, semilla=semilla), os.path.join(carpeta, archivo))
+            print(f"  datos generados en {time.perf_counter() - inicio:.1f} s")
+
+            modulo_app.app.config.update({
+                'DATA_FOLDER': carpeta,
+                'STORAGE_BACKEND': backend,
+                'EXCEL_FILE': archivo,
+                'SQLITE_FILE': archivo
+            })
+
+            def cargar(i):
+                modulo_app.almacen.invalidar()
+                if modulo_app.almacen.obtener() is None:
+                    raise RuntimeError('No se pudieron cargar los datos generados')
+
+            casos = {'carga_datos': medir(cargar, 3, elementos=tamano)}
+            instantanea = modulo_app.almacen.obtener()
+            site_ids = instantanea.datos['sites']['site_id'].tolist()
+
+            if 'modelos' in partes:
+                casos.update(benchmark_modelos(instantanea.datos, muestra, repeticiones, rng))
+            if 'rutas' in partes:
+                casos.update(benchmark_rutas(modulo_app, site_ids, repeticiones, rng))
+
+            informe['resultados'][str(tamano)] = casos
+            imprimir_casos(casos)
+        finally:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+    return informe
+
+
+def imprimir_casos(casos):
+    print(f"  {'caso':<42} {'p50 ms':>10} {'p99 ms':>10} {'por seg':>12} {'mem MB':>9}")
+    for nombre, r in casos.items():
+        if 'omitido' in r:
+            print(f"  {nombre:<42} omitido ({r['omitido']})")
+            continue
+        print(f"  {nombre:<42} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f} {r['por_segundo'] or 0:>12.1f} "
+              f"{r.get('pico_memoria_mb', float('nan')):>9.2f}")
+
+
+def comparar(informe, base, umbral):
+    """
+    Compara p50 y memoria con un informe anterior. Devuelve la lista de regresiones
+    (casos cuyo p50 o memoria crece más que el umbral, p. ej. 1.25 = +25 %).
+    """
+    regresiones = []
+    print(f"\n== Comparación con {base['meta']['fecha']} (umbral x{umbral}) ==")
+    for tamano, casos in informe['resultados'].items():
+        for nombre, r in casos.items():
+            previo = base['resultados'].get(tamano, {}).get(nombre)
+            if not previo or 'omitido' in r or 'omitido' in previo:
+                continue
+            for metrica in ('p50_ms', 'pico_memoria_mb'):
+                if not previo.get(metrica) or metrica not in r:
+                    continue
+                razon = r[metrica] / previo[metrica]
+                marca = '  REGRESIÓN' if razon > umbral else ''
+                if marca or razon < 1 / umbral:
+                    print(f"  [{tamano}] {nombre} {metrica}: {previo[metrica]} -> {r[metrica]} (x{razon:.2f}){marca}")
+                if marca:
+                    regresiones.append({'tamano': tamano, 'caso': nombre, 'metrica': metrica, 'razon': round(razon, 3)})
+    if not regresiones:
+        print("  Sin regresiones")
+    return regresiones
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks de EcoBalance')
+    parser.add_argument('--tamanos', default='100,10000', help='Número de sitios, separados por comas')
+    parser.add_argument('--especies', type=int, default=10, help='Filas de biodiversidad por sitio')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--muestra', type=int, default=200, help='Sitios usados en los modelos escalares')
+    parser.add_argument('--backend', choices=('sqlite', 'excel'), default='sqlite')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--solo', choices=('modelos', 'rutas'), help='Medir solo una parte')
+    parser.add_argument('--salida', help='Ruta del JSON de resultados (por defecto en benchmarks/resultados/)')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior para detectar regresiones')
+    parser.add_argument('--umbral', type=float, default=1.25)
+    args = parser.parse_args()
+
+    tamanos = [int(t) for t in args.tamanos.split(',') if t.strip()]
+    partes = (args.solo,) if args.solo else ('modelos', 'rutas')
+    informe = ejecutar(tamanos, args.especies, args.repeticiones, args.muestra, args.backend, args.semilla, partes)
+
+    salida = args.salida or os.path.join(CARPETA_RESULTADOS, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+        if comparar(informe, base, args.umbral):
+            sys.exit(1)
@@ -0,0 +1,103 @@
+"""
+Generador de datos sintéticos con el mismo esquema de cinco hojas que
+data/EcoBalance_Datos.xlsx (mismas columnas y tipos), a cualquier tamaño.
+
+    python -m benchmarks.generador --sitios 10000 --especies 20 data/sintetico.db
+    python -m benchmarks.generador --sitios 100 data/sintetico.xlsx
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from services.almacenamiento import HOJAS, escribir_sqlite
+
+# transformar_datos deduce ecosystem_type del nombre del sitio
+TIPOS_SITIO = ('Bosque_Protegido', 'Humedal_Urbano', 'Zona_Minera')
+MAX_FILAS_EXCEL = 1048575  # Límite de filas de una hoja xlsx (sin contar la cabecera)
+
+
+def generar_datos(sitios=100, especies=10, mediciones=1, semilla=0, fecha='2025-10-15'):
+    """
+    Devuelve un diccionario {clave: DataFrame} con las columnas del Excel.
+    Cada sitio tiene `especies` filas de biodiversidad y `mediciones` filas
+    tróficas y de VSI (la app usa la más reciente). La hoja de resultados va vacía.
+    """
+    rng = np.random.default_rng(semilla)
+    site_ids = np.arange(101, 101 + sitios)
+    fecha = pd.Timestamp(fecha)
+
+    tipos = np.asarray(TIPOS_SITIO, dtype=object)[rng.integers(0, len(TIPOS_SITIO), sitios)]
+    sites = pd.DataFrame({
+        'site_id': site_ids,
+        'nombre': [f'{tipo}_{i}' for tipo, i in zip(tipos, range(1, sitios + 1))],
+        'latitud': np.round(rng.uniform(-60, 70, sitios), 4),
+        'longitud': np.round(rng.uniform(-180, 180, sitios), 4)
+    })
+
+    # Abundancias log-normales: pocas especies dominantes y muchas raras
+    catalogo = np.asarray([f'Especie_{k}' for k in range(max(especies * 5, 1))], dtype=object)
+    filas_bio = sitios * especies
+    biodiversity = pd.DataFrame({
+        'site_id': np.repeat(site_ids, especies),
+        'data_id': np.arange(1, filas_bio + 1),
+        'fecha': fecha,
+        'especie_nombre': catalogo[rng.integers(0, len(catalogo), filas_bio)],
+        'abundancia': np.maximum(1, rng.lognormal(2.0, 1.0, filas_bio)).astype(np.int64)
+    })
+
+    filas_med = sitios * mediciones
+    ids_med = np.repeat(site_ids, mediciones)
+    trophic = pd.DataFrame({
+        'site_id': ids_med,
+        'trophic_id': np.arange(201, 201 + filas_med),
+        'fecha': fecha,
+        'conn_obs': np.round(rng.uniform(0.1, 0.9, filas_med), 2),
+        'conn_exp': np.round(rng.uniform(0.5, 0.9, filas_med), 2),
+        'len_obs': np.round(rng.uniform(2.0, 5.5, filas_med), 1),
+        'len_exp': np.round(rng.uniform(4.0, 6.0, filas_med), 1)
+    })
+    vsi = pd.DataFrame({
+        'site_id': ids_med,
+        'vsi_id': np.arange(301, 301 + filas_med),
+        'fecha': fecha,
+        'cobertura_pct': rng.integers(5, 100, filas_med),
+        'calidad_suelo_pct': rng.integers(5, 100, filas_med)
+    })
+
+    results = pd.DataFrame(columns=['site_id', 'fecha', 'BI', 'TFI', 'VSI', 'EHI', 'categoria'])
+
+    return {'sites': sites, 'biodiversity': biodiversity, 'trophic': trophic, 'vsi': vsi, 'results': results}
+
+
+def escribir_excel(datos, ruta):
+    """Escribe los datos como libro .xlsx con los nombres de hoja originales"""
+    excedidas = [HOJAS[clave] for clave, df in datos.items() if len(df) > MAX_FILAS_EXCEL]
+    if excedidas:
+        raise ValueError(f"Demasiadas filas para una hoja xlsx en {', '.join(excedidas)}; use una salida .db")
+    with pd.ExcelWriter(ruta, engine='openpyxl') as writer:
+        for clave, hoja in HOJAS.items():
+            datos[clave].to_excel(writer, sheet_name=hoja, index=False)
+
+
+def escribir(datos, ruta):
+    """Escribe en Excel o SQLite según la extensión de la ruta"""
+    if ruta.endswith('.xlsx'):
+        escribir_excel(datos, ruta)
+    else:
+        escribir_sqlite(datos, ruta)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera datos sintéticos de EcoBalance')
+    parser.add_argument('salida', help='Ruta de salida (.xlsx o .db)')
+    parser.add_argument('--sitios', type=int, default=100)
+    parser.add_argument('--especies', type=int, default=10, help='Filas de biodiversidad por sitio')
+    parser.add_argument('--mediciones', type=int, default=1, help='Filas tróficas y de VSI por sitio')
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    datos = generar_datos(args.sitios, args.especies, args.mediciones, args.semilla)
+    escribir(datos, args.salida)
+    for clave, df in datos.items():
+        print(f"{HOJAS[clave]}: {len(df)} filas")
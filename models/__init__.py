@@ -6,12 +6,22 @@ Módulo de cálculos ecológicos para EcoBalance
 from .biodiversidad import calcular_shannon_wiener
 from .tfi import calcular_tfi
 from .vsi import calcular_vsi
-from .ehi import calcular_ehi_completo, categorizar_ehi
+from .ehi import calcular_ehi_completo, calcular_ehi_compacto, categorizar_ehi
+from .lote import calcular_lote
+from .incertidumbre import simular_incertidumbre
+from .resultado import Categoria, ResultadoEHI, ResultadoIndice, tabla_categorias
 
 __all__ = [
     'calcular_shannon_wiener',
     'calcular_tfi',
     'calcular_vsi',
     'calcular_ehi_completo',
-    'categorizar_ehi'
+    'calcular_ehi_compacto',
+    'categorizar_ehi',
+    'calcular_lote',
+    'simular_incertidumbre',
+    'Categoria',
+    'ResultadoEHI',
+    'ResultadoIndice',
+    'tabla_categorias'
 ]
\ No newline at end of file
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+
+from .lote import _codigos, _columna, _ultimas_filas, categorizar_lote
+from .resultado import ETIQUETAS, PESOS, UMBRALES_EHI
+
+# Error de medición supuesto de cada lectura de campo
+ERRORES = {
+    'connectance_observed': 0.05,  # desviación relativa
+    'length_observed': 0.05,       # desviación relativa
+    'coverage_pct': 5.0,           # puntos porcentuales
+    'soil_quality_pct': 5.0        # puntos porcentuales
+}
+# Las abundancias se muestrean como conteos de Poisson alrededor del valor observado
+SITIOS_POR_BLOQUE = 256         # Cada bloque de sitios tiene su propia semilla derivada
+VALORES_POR_LOTE = 4_000_000    # Muestras × filas de biodiversidad generadas a la vez (acota la memoria)
+INDICES = ('BI', 'TFI', 'VSI', 'EHI')
+MAX_SEMILLA = 2 ** 53           # Las semillas caben exactas en un número JSON (double)
+CATEGORIAS_EHI = tuple(ETIQUETAS[:len(UMBRALES_EHI) + 1])
+
+
+def simular_incertidumbre(biodiversidad, troficos, vsi, site_ids, muestras=1000, semilla=None,
+                          nivel=0.95, errores=None, bloque_inicial=0):
+    """
+    Propaga el error de medición a BI, TFI, VSI y EHI por Monte Carlo.
+    Cada muestra perturba las lecturas del sitio (abundancias ~ Poisson, lecturas
+    tróficas con error normal relativo sobre lo observado, porcentajes con error
+    normal absoluto recortado a [0, 100]) y pasa por las mismas fórmulas que
+    calcular_lote. Devuelve, alineados con site_ids, la media, la desviación y el
+    intervalo central de nivel `nivel` de cada índice, la probabilidad de cada
+    categoría de EHI y la semilla usada (la generada si no se indicó ninguna).
+    Con la misma semilla el resultado es el mismo: los sitios se procesan en bloques
+    de SITIOS_POR_BLOQUE y cada bloque usa la semilla (semilla, bloque_inicial + j).
+    """
+    errores = {**ERRORES, **(errores or {})}
+    site_ids = pd.Index(site_ids)
+    inversa, unicos = pd.factorize(site_ids)
+    unicos = pd.Index(unicos)
+    n = len(unicos)
+    if semilla is None:
+        semilla = nueva_semilla()
+    raiz = np.random.SeedSequence(semilla)
+    alfa = (1 - nivel) / 2
+
+    salida = {indice: {clave: np.zeros(n) for clave in ('media', 'desviacion', 'inferior', 'superior')}
+              for indice in INDICES}
+    probabilidades = np.zeros((n, len(CATEGORIAS_EHI)))
+
+    for j, inicio in enumerate(range(0, n, SITIOS_POR_BLOQUE)):
+        bloque = unicos[inicio:inicio + SITIOS_POR_BLOQUE]
+        rng = np.random.default_rng(np.random.SeedSequence(raiz.entropy, spawn_key=(bloque_inicial + j,)))
+        muestras_bloque = _simular_bloque(biodiversidad, troficos, vsi, bloque, muestras, errores, rng)
+
+        fin = inicio + len(bloque)
+        for indice, valores in muestras_bloque.items():
+            limites = np.quantile(valores, [alfa, 1 - alfa], axis=0)
+            salida[indice]['media'][inicio:fin] = valores.mean(axis=0)
+            salida[indice]['desviacion'][inicio:fin] = valores.std(axis=0)
+            salida[indice]['inferior'][inicio:fin] = limites[0]
+            salida[indice]['superior'][inicio:fin] = limites[1]
+
+        codigos = categorizar_lote(muestras_bloque['EHI'], UMBRALES_EHI)
+        for codigo in range(len(CATEGORIAS_EHI)):
+            probabilidades[inicio:fin, codigo] = (codigos == codigo).mean(axis=0)
+
+    resultado = {'site_id': site_ids.to_numpy(), 'muestras': muestras, 'nivel': nivel, 'semilla': semilla}
+    for indice in INDICES:
+        resultado[indice] = {clave: valores[inversa] for clave, valores in salida[indice].items()}
+    resultado['probabilidades'] = probabilidades[inversa]
+    return resultado
+
+
+def nueva_semilla():
+    """Semilla aleatoria menor que MAX_SEMILLA, para poder devolverla y repetir la corrida"""
+    return int(np.random.default_rng().integers(MAX_SEMILLA))
+
+
+def _simular_bloque(biodiversidad, troficos, vsi, site_ids, muestras, errores, rng):
+    """Matrices (muestras × sitios) de BI, TFI, VSI y EHI para un bloque de sitios"""
+    bi = _muestras_bi(biodiversidad, site_ids, muestras, rng)
+    tfi = _muestras_tfi(troficos, site_ids, muestras, errores, rng)
+    vsi_muestras = _muestras_vsi(vsi, site_ids, muestras, errores, rng)
+    ehi = (tfi * PESOS['TFI']) + (bi * PESOS['BI']) + (vsi_muestras * PESOS['VSI'])
+    return {'BI': bi, 'TFI': tfi, 'VSI': vsi_muestras, 'EHI': ehi}
+
+
+def _muestras_bi(biodiversidad, site_ids, muestras, rng):
+    """Shannon-Wiener normalizado con abundancias remuestreadas, por lotes de muestras"""
+    n = len(site_ids)
+    bi = np.zeros((muestras, n))
+    codigos = _codigos(biodiversidad, site_ids)
+    validas = np.flatnonzero(codigos >= 0)
+    if not len(validas) or 'abundance' not in biodiversidad.columns:
+        return bi
+
+    # Filas ordenadas por sitio para sumar cada sitio con reduceat
+    orden = validas[np.argsort(codigos[validas], kind='stable')]
+    sitio_fila = codigos[orden]
+    abundancia = biodiversidad['abundance'].to_numpy(dtype=float)[orden]
+    abundancia = np.where(np.isnan(abundancia), 0.0, np.maximum(abundancia, 0.0))
+
+    num_especies = np.bincount(sitio_fila, minlength=n)
+    con_filas = np.flatnonzero(num_especies)
+    inicios = np.concatenate([[0], np.cumsum(num_especies[con_filas])[:-1]])
+    posicion_sitio = np.repeat(np.arange(len(con_filas)), num_especies[con_filas])
+    max_posible = np.log(num_especies[con_filas].astype(float))
+
+    por_lote = max(1, VALORES_POR_LOTE // len(orden))
+    for desde in range(0, muestras, por_lote):
+        hasta = min(muestras, desde + por_lote)
+        conteos = rng.poisson(abundancia, size=(hasta - desde, len(orden))).astype(float)
+        total = np.add.reduceat(conteos, inicios, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            proporcion = conteos / total[:, posicion_sitio]
+            termino = np.where(proporcion > 0, proporcion * np.log(np.where(proporcion > 0, proporcion, 1.0)), 0.0)
+            shannon = -np.add.reduceat(termino, inicios, axis=1)
+            valor = np.where((max_posible > 0) & (total > 0), shannon / np.where(max_posible > 0, max_posible, 1.0), 0.0)
+        bi[desde:hasta, con_filas] = valor
+    return bi
+
+
+def _muestras_tfi(troficos, site_ids, muestras, errores, rng):
+    """TFI con conectancia y longitud observadas perturbadas (las esperadas son referencias)"""
+    filas, tiene = _ultimas_filas(troficos, site_ids)
+    conn_obs = _columna(troficos, 'connectance_observed', filas, 0.0)
+    conn_exp = _columna(troficos, 'connectance_expected', filas, 1.0)
+    len_obs = _columna(troficos, 'length_observed', filas, 0.0)
+    len_exp = _columna(troficos, 'length_expected', filas, 1.0)
+
+    forma = (muestras, len(site_ids))
+    conn = np.maximum(conn_obs * (1 + errores['connectance_observed'] * rng.standard_normal(forma)), 0.0)
+    largo = np.maximum(len_obs * (1 + errores['length_observed'] * rng.standard_normal(forma)), 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio_conn = np.where(conn_exp > 0, conn / conn_exp, 0.0)
+        ratio_len = np.where(len_exp > 0, largo / len_exp, 0.0)
+    return np.where(tiene, ratio_conn * ratio_len, 0.0)
+
+
+def _muestras_vsi(vsi, site_ids, muestras, errores, rng):
+    """VSI con cobertura y calidad del suelo perturbadas dentro de [0, 100] %"""
+    filas, tiene = _ultimas_filas(vsi, site_ids)
+    forma = (muestras, len(site_ids))
+    cobertura = np.clip(_columna(vsi, 'coverage_pct', filas, 0.0) +
+                        errores['coverage_pct'] * rng.standard_normal(forma), 0.0, 100.0) / 100.0
+    calidad_suelo = np.clip(_columna(vsi, 'soil_quality_pct', filas, 0.0) +
+                            errores['soil_quality_pct'] * rng.standard_normal(forma), 0.0, 100.0) / 100.0
+    return np.where(tiene, (cobertura * 0.6) + (calidad_suelo * 0.4), 0.0)
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+from .resultado import UMBRALES_COMPONENTE, UMBRALES_EHI, Categoria
+
+
+def calcular_lote(biodiversidad, troficos, vsi, site_ids):
+    """
+    Calcula BI, TFI, VSI y EHI de todos los sitios en una sola pasada agrupada.
+    Recibe las tablas transformadas completas y la lista de site_id a calcular;
+    devuelve un diccionario de arreglos alineados con site_ids. Los valores
+    coinciden con calcular_shannon_wiener, calcular_tfi, calcular_vsi y
+    calcular_ehi_completo aplicados sitio por sitio; las categorías van como
+    códigos uint8 de Categoria (etiquetas en resultado.ETIQUETAS).
+    """
+    site_ids = pd.Index(site_ids)
+    # Se calcula por sitio único y al final se expande al orden pedido
+    inversa, unicos = pd.factorize(site_ids)
+    unicos = pd.Index(unicos)
+
+    bi = calcular_bi_lote(biodiversidad, unicos)
+    tfi = calcular_tfi_lote(troficos, unicos)
+    vsi_lote = calcular_vsi_lote(vsi, unicos)
+    ehi = calcular_ehi_lote(tfi['valor'], bi['valor'], vsi_lote['valor'])
+
+    return {
+        'site_id': site_ids.to_numpy(),
+        'BI': bi['valor'][inversa],
+        'TFI': tfi['valor'][inversa],
+        'VSI': vsi_lote['valor'][inversa],
+        'EHI': ehi['valor'][inversa],
+        'categoria': ehi['categoria'][inversa],
+        'categoria_bi': bi['categoria'][inversa],
+        'categoria_tfi': tfi['categoria'][inversa],
+        'categoria_vsi': vsi_lote['categoria'][inversa]
+    }
+
+
+def calcular_bi_lote(biodiversidad, site_ids):
+    """
+    Shannon-Wiener normalizado por ln(número de especies) para cada sitio.
+    H' = -Σ(pᵢ × ln(pᵢ)) acumulado por sitio con np.bincount.
+    """
+    n = len(site_ids)
+    codigos = _codigos(biodiversidad, site_ids)
+    validas = codigos >= 0
+    codigos = codigos[validas]
+
+    num_especies = np.bincount(codigos, minlength=n)
+    sin_datos = num_especies == 0
+
+    if biodiversidad is None or 'abundance' not in biodiversidad.columns:
+        # Mismo resultado que el modelo escalar cuando falla el cálculo
+        categoria = np.where(sin_datos, Categoria.SIN_DATOS, Categoria.ERROR).astype(np.uint8)
+        return {'valor': np.zeros(n), 'categoria': categoria, 'num_especies': num_especies}
+
+    abundancia = biodiversidad['abundance'].to_numpy(dtype=float)[validas]
+    # Los NaN no suman al total ni al índice (igual que pandas.sum y la comparación p > 0)
+    abundancia_total = np.bincount(codigos, weights=np.where(np.isnan(abundancia), 0.0, abundancia), minlength=n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proporcion = abundancia / abundancia_total[codigos]
+        termino = np.where(proporcion > 0, proporcion * np.log(np.where(proporcion > 0, proporcion, 1.0)), 0.0)
+        shannon_index = -np.bincount(codigos, weights=termino, minlength=n)
+
+        max_posible = np.where(num_especies > 0, np.log(np.maximum(num_especies, 1)), 0.0)
+        valor = np.where(max_posible > 0, shannon_index / np.where(max_posible > 0, max_posible, 1.0), 0.0)
+
+    sin_especies = ~sin_datos & (abundancia_total == 0)
+    valor = np.where(sin_datos | sin_especies, 0.0, valor)
+
+    categoria = categorizar_lote(valor, UMBRALES_COMPONENTE)
+    categoria[sin_especies] = Categoria.SIN_ESPECIES
+    categoria[sin_datos] = Categoria.SIN_DATOS
+
+    return {
+        'valor': valor,
+        'categoria': categoria,
+        'num_especies': num_especies,
+        'abundancia_total': abundancia_total,
+        'shannon_index': np.where(sin_datos | sin_especies, 0.0, shannon_index)
+    }
+
+
+def calcular_tfi_lote(troficos, site_ids):
+    """TFI = (Conectividad Obs / Esp) × (Longitud Obs / Esp) con la medición más reciente de cada sitio"""
+    filas, tiene = _ultimas_filas(troficos, site_ids)
+
+    conn_obs = _columna(troficos, 'connectance_observed', filas, 0.0)
+    conn_exp = _columna(troficos, 'connectance_expected', filas, 1.0)
+    len_obs = _columna(troficos, 'length_observed', filas, 0.0)
+    len_exp = _columna(troficos, 'length_expected', filas, 1.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio_conn = np.where(conn_exp > 0, conn_obs / conn_exp, 0.0)
+        ratio_len = np.where(len_exp > 0, len_obs / len_exp, 0.0)
+    valor = np.where(tiene, ratio_conn * ratio_len, 0.0)
+
+    categoria = categorizar_lote(valor, UMBRALES_COMPONENTE)
+    categoria[~tiene] = Categoria.SIN_DATOS
+    return {'valor': valor, 'categoria': categoria}
+
+
+def calcular_vsi_lote(vsi, site_ids):
+    """VSI = (Cobertura × 0.6) + (Calidad del Suelo × 0.4) con la medición más reciente de cada sitio"""
+    filas, tiene = _ultimas_filas(vsi, site_ids)
+
+    cobertura = _columna(vsi, 'coverage_pct', filas, 0.0) / 100.0
+    calidad_suelo = _columna(vsi, 'soil_quality_pct', filas, 0.0) / 100.0
+    valor = np.where(tiene, (cobertura * 0.6) + (calidad_suelo * 0.4), 0.0)
+
+    categoria = categorizar_lote(valor, UMBRALES_COMPONENTE)
+    categoria[~tiene] = Categoria.SIN_DATOS
+    return {'valor': valor, 'categoria': categoria}
+
+
+def calcular_ehi_lote(valor_tfi, valor_bi, valor_vsi):
+    """EHI = (TFI × 0.5) + (BI × 0.3) + (VSI × 0.2) y su categoría para cada sitio"""
+    valor = (valor_tfi * 0.5) + (valor_bi * 0.3) + (valor_vsi * 0.2)
+    return {'valor': valor, 'categoria': categorizar_lote(valor, UMBRALES_EHI)}
+
+
+def categorizar_lote(valores, umbrales):
+    """Código de categoría de cada valor; los NaN caen en Crítico como en los modelos escalares"""
+    condiciones = [valores > umbral for umbral in umbrales]
+    return np.select(condiciones, range(len(umbrales)), default=Categoria.CRITICO).astype(np.uint8)
+
+
+def _codigos(df, site_ids):
+    """Posición de cada fila de df en site_ids (-1 si el sitio no se calcula)"""
+    if df is None or df.empty or 'site_id' not in df.columns:
+        return np.empty(0, dtype=np.intp)
+    return site_ids.get_indexer(df['site_id'])
+
+
+def _ultimas_filas(df, site_ids):
+    """
+    Fila de la última medición de cada sitio y máscara de sitios con datos.
+    Las tablas llegan ordenadas por fecha (transformar_datos): la última es la más reciente.
+    """
+    n = len(site_ids)
+    codigos = _codigos(df, site_ids)
+    filas = np.zeros(n, dtype=np.intp)
+    tiene = np.zeros(n, dtype=bool)
+
+    posiciones = np.flatnonzero(codigos >= 0)
+    if len(posiciones):
+        # Sobre las filas invertidas, return_index da la última aparición de cada sitio
+        invertidas = posiciones[::-1]
+        sitios, ultimas = np.unique(codigos[invertidas], return_index=True)
+        filas[sitios] = invertidas[ultimas]
+        tiene[sitios] = True
+    return filas, tiene
+
+
+def _columna(df, nombre, filas, por_defecto):
+    """Valores de una columna en las filas dadas, o el valor por defecto si no existe"""
+    if df is None or nombre not in df.columns or len(df) == 0:
+        return np.full(len(filas), por_defecto, dtype=float)
+    return df[nombre].to_numpy(dtype=float)[filas]
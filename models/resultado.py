@@ -0,0 +1,140 @@
+from enum import IntEnum
+
+import numpy as np
+
+
+class Categoria(IntEnum):
+    """Código de categoría (un byte por sitio en los arreglos del lote)"""
+    EXCELENTE = 0
+    BUENO = 1
+    REGULAR = 2
+    POBRE = 3
+    CRITICO = 4
+    SIN_DATOS = 5
+    SIN_ESPECIES = 6
+    ERROR = 7
+
+
+# Tabla única de etiqueta, color e interpretación por código; los resultados solo guardan el código
+TABLA_CATEGORIAS = (
+    ('Excelente', '#3B9A6F', 'El ecosistema se encuentra en excelente estado de salud'),
+    ('Bueno', '#36A2EB', 'El ecosistema presenta buena salud con algunos aspectos a mejorar'),
+    ('Regular', '#FFC107', 'El ecosistema requiere atención y posibles intervenciones'),
+    ('Pobre', '#DC3545', 'El ecosistema está en estado pobre, requiere intervención urgente'),
+    ('Crítico', '#0F1D1F', 'El ecosistema está en estado crítico, necesita restauración inmediata'),
+    ('Sin datos', '#9ca3af', None),
+    ('Sin especies', '#9ca3af', None),
+    ('Error', '#9ca3af', None)
+)
+ETIQUETAS = np.asarray([fila[0] for fila in TABLA_CATEGORIAS], dtype=object)
+CODIGOS = {etiqueta: Categoria(codigo) for codigo, etiqueta in enumerate(ETIQUETAS)}
+SIN_CODIGO = -1  # Sitios sin resultado en las respuestas compactas
+
+# Pesos de cada índice en el EHI
+PESOS = {'TFI': 0.5, 'BI': 0.3, 'VSI': 0.2}
+# Umbrales de Excelente, Bueno, Regular y Pobre (por debajo del último, Crítico)
+UMBRALES_COMPONENTE = (0.8, 0.6, 0.4, 0.2)
+UMBRALES_EHI = (0.76, 0.51, 0.26, 0.11)
+
+
+def codigo_categoria(valor, umbrales):
+    """Código de la categoría de un valor; los NaN caen en Crítico como en categorizar_ehi"""
+    for codigo, umbral in enumerate(umbrales):
+        if valor > umbral:
+            return Categoria(codigo)
+    return Categoria.CRITICO
+
+
+def codificar(etiquetas):
+    """Códigos int8 de un arreglo de etiquetas (SIN_CODIGO si falta o no se conoce)"""
+    return np.asarray([CODIGOS.get(e, SIN_CODIGO) for e in etiquetas], dtype=np.int8)
+
+
+def tabla_categorias():
+    """La tabla compartida como lista de diccionarios, en orden de código"""
+    return [{'codigo': codigo, 'etiqueta': etiqueta, 'color': color, 'interpretacion': interpretacion}
+            for codigo, (etiqueta, color, interpretacion) in enumerate(TABLA_CATEGORIAS)]
+
+
+class ResultadoIndice:
+    """Valor y código de categoría de un índice (BI, TFI o VSI); codigo None = 'N/A'"""
+
+    __slots__ = ('nombre', 'valor', 'codigo')
+
+    def __init__(self, nombre, valor, codigo):
+        self.nombre = nombre
+        self.valor = float(valor)
+        self.codigo = None if codigo is None else Categoria(codigo)
+
+    @classmethod
+    def desde(cls, nombre, resultado):
+        """Desde el diccionario de calcular_shannon_wiener/calcular_tfi/calcular_vsi o un número"""
+        if isinstance(resultado, dict):
+            etiqueta = resultado.get('categoria', 'N/A')
+            return cls(nombre, resultado.get('valor', 0) or 0, CODIGOS.get(etiqueta))
+        return cls(nombre, resultado or 0, None)
+
+    @property
+    def categoria(self):
+        return 'N/A' if self.codigo is None else TABLA_CATEGORIAS[self.codigo][0]
+
+    @property
+    def contribucion(self):
+        return self.valor * PESOS[self.nombre]
+
+
+class ResultadoEHI:
+    """
+    EHI de un sitio con sus tres componentes. Guarda solo números y códigos;
+    la etiqueta, el color y la interpretación salen de TABLA_CATEGORIAS.
+    """
+
+    __slots__ = ('valor', 'codigo', 'tfi', 'bi', 'vsi')
+
+    def __init__(self, tfi, bi, vsi):
+        self.tfi = tfi
+        self.bi = bi
+        self.vsi = vsi
+        self.valor = tfi.contribucion + bi.contribucion + vsi.contribucion
+        self.codigo = codigo_categoria(self.valor, UMBRALES_EHI)
+
+    @property
+    def categoria(self):
+        return TABLA_CATEGORIAS[self.codigo][0]
+
+    @property
+    def color(self):
+        return TABLA_CATEGORIAS[self.codigo][1]
+
+    @property
+    def interpretacion(self):
+        return TABLA_CATEGORIAS[self.codigo][2]
+
+    def a_dict(self):
+        """Formato anidado original de calcular_ehi_completo"""
+        componentes = {}
+        for indice in (self.tfi, self.bi, self.vsi):
+            componentes[indice.nombre] = {
+                'valor': indice.valor,
+                'contribucion': indice.contribucion,
+                'categoria': indice.categoria
+            }
+        return {
+            'valor': self.valor,
+            'categoria': self.categoria,
+            'color': self.color,
+            'interpretacion': self.interpretacion,
+            'componentes': componentes
+        }
+
+    def a_compacto(self):
+        """Valores y códigos planos, sin textos repetidos"""
+        return {
+            'EHI': self.valor, 'BI': self.bi.valor, 'TFI': self.tfi.valor, 'VSI': self.vsi.valor,
+            'categoria': int(self.codigo), 'categoria_bi': _codigo(self.bi),
+            'categoria_tfi': _codigo(self.tfi), 'categoria_vsi': _codigo(self.vsi)
+        }
+
+
+def _codigo(indice):
+    return SIN_CODIGO if indice.codigo is None else int(indice.codigo)
@@ -0,0 +1,10 @@
+"""
+Servicios de infraestructura para EcoBalance (carga, caché e índices de datos)
+"""
+
+from .almacen_datos import AlmacenDatos, Instantanea
+
+__all__ = [
+    'AlmacenDatos',
+    'Instantanea'
+]
@@ -0,0 +1,299 @@
+import heapq
+import threading
+
+import numpy as np
+import pandas as pd
+
+INDICES = ('EHI', 'BI', 'TFI', 'VSI')
+CUANTILES = (0.1, 0.5, 0.9)
+GLOBAL = None                 # Clave del grupo que reúne a todos los sitios
+SIN_ECOSISTEMA = 'Sin ecosistema'
+
+# Esbozo de cuantiles: histograma de ancho fijo sobre [0, 1] (más una cubeta por
+# debajo y otra por encima). Sumar o restar un valor es O(1) y dos esbozos se
+# combinan sumando sus cubetas; el error de un cuantil es como mucho 1/CUBETAS.
+CUBETAS = 1000
+
+
+def _cubeta(valor):
+    return min(max(int(np.floor(valor * CUBETAS)), -1), CUBETAS) + 1
+
+
+class _Metrica:
+    """Conteo, suma, mínimo/máximo y esbozo de cuantiles de un índice en un grupo"""
+
+    __slots__ = ('n', 'suma', 'cubetas', 'minimos', 'maximos')
+
+    def __init__(self):
+        self.n = 0
+        self.suma = 0.0
+        self.cubetas = np.zeros(CUBETAS + 2, dtype=np.int64)
+        # Montículos con borrado perezoso: las entradas viejas se descartan al leer
+        self.minimos = []
+        self.maximos = []
+
+    def agregar(self, valor, site_id):
+        self.n += 1
+        self.suma += valor
+        self.cubetas[_cubeta(valor)] += 1
+        heapq.heappush(self.minimos, (valor, site_id))
+        heapq.heappush(self.maximos, (-valor, site_id))
+
+    def quitar(self, valor):
+        self.n -= 1
+        self.suma -= valor
+        self.cubetas[_cubeta(valor)] -= 1
+
+    def extremos(self, vigente):
+        """(mínimo, máximo) exactos; vigente(valor, site_id) dice si una entrada sigue valiendo"""
+        if self.n == 0:
+            self.minimos.clear()
+            self.maximos.clear()
+            return None, None
+        while not vigente(*self.minimos[0]):
+            heapq.heappop(self.minimos)
+        while not vigente(-self.maximos[0][0], self.maximos[0][1]):
+            heapq.heappop(self.maximos)
+        # Si las entradas viejas dominan el montículo, se compacta
+        if len(self.minimos) > 2 * self.n + 64:
+            self.minimos = [e for e in self.minimos if vigente(*e)]
+            heapq.heapify(self.minimos)
+        if len(self.maximos) > 2 * self.n + 64:
+            self.maximos = [e for e in self.maximos if vigente(-e[0], e[1])]
+            heapq.heapify(self.maximos)
+        return self.minimos[0][0], -self.maximos[0][0]
+
+    def cuantil(self, q, minimo, maximo):
+        """Cuantil aproximado interpolando dentro de la cubeta que lo contiene"""
+        if self.n == 0:
+            return None
+        rango = q * self.n
+        acumulado = np.cumsum(self.cubetas)
+        k = int(np.searchsorted(acumulado, rango, side='left'))
+        k = min(k, len(self.cubetas) - 1)
+        previo = acumulado[k - 1] if k > 0 else 0
+        en_cubeta = self.cubetas[k]
+
+        if k == 0:
+            inferior, superior = minimo, 0.0
+        elif k == CUBETAS + 1:
+            inferior, superior = 1.0, maximo
+        else:
+            inferior, superior = (k - 1) / CUBETAS, k / CUBETAS
+        fraccion = (rango - previo) / en_cubeta if en_cubeta else 0.0
+        return float(min(max(inferior + fraccion * (superior - inferior), minimo), maximo))
+
+    def a_dict(self, vigente):
+        minimo, maximo = self.extremos(vigente)
+        resumen = {
+            'n': self.n,
+            'promedio': self.suma / self.n if self.n else None,
+            'min': minimo,
+            'max': maximo
+        }
+        for q in CUANTILES:
+            resumen[f'p{int(q * 100)}'] = self.cuantil(q, minimo, maximo) if self.n else None
+        return resumen
+
+
+class _Grupo:
+    """Agregados de un conjunto de sitios (todos o los de un ecosistema)"""
+
+    __slots__ = ('n', 'categorias', 'metricas')
+
+    def __init__(self):
+        self.n = 0
+        self.categorias = {}
+        self.metricas = {indice: _Metrica() for indice in INDICES}
+
+
+class AgregadosEHI:
+    """
+    Estadísticas de resultados mantenidas de forma incremental: al guardar
+    resultados se resta la contribución anterior de cada sitio y se suma la
+    nueva (O(1) por sitio, salvo los montículos de min/max, O(log n)). Se agrupan
+    de forma global y por ecosystem_type, y consultarlas no depende del número
+    de sitios.
+
+    Una versión de datos nueva que solo viene de escrituras de este proceso (sus
+    resultados ya se aplicaron) no se vuelve a recorrer. Para detectar cambios
+    hechos fuera (otro proceso, alguien edita el Excel) se guarda una huella
+    aditiva de las filas: si la de una instantánea nueva no coincide con la
+    mantenida, se reconstruye todo una vez.
+    """
+
+    def __init__(self, obtener_almacenamiento=None):
+        self._obtener_almacenamiento = obtener_almacenamiento
+        self._lock = threading.RLock()
+        self._sitios = {}     # site_id -> (ecosistema, valores, categoria, huella de la fila)
+        self._grupos = {GLOBAL: _Grupo()}
+        self._huella = 0
+        self.version = None   # Versión de datos con la que se sincronizó por última vez
+        self.etiqueta = None  # Huella de contenido de esa versión
+        self.reconstrucciones = 0
+        self.comprobaciones = 0  # Recorridos completos de los resultados para comparar huellas
+
+    def sincronizar(self, instantanea):
+        """Se asegura de reflejar los resultados de la instantánea (barato si ya coinciden)"""
+        with self._lock:
+            if self.version == instantanea.version:
+                return
+            if not self._solo_escrituras_propias(instantanea):
+                self.comprobaciones += 1
+                filas = filas_agregables(instantanea.datos)
+                huellas = _huellas_filas(filas)
+                if int(huellas.sum()) != self._huella:
+                    self._reconstruir(filas, huellas)
+            self.version = instantanea.version
+            self.etiqueta = instantanea.etiqueta
+
+    def _solo_escrituras_propias(self, instantanea):
+        """La instantánea solo difiere de la sincronizada por escrituras de este proceso (ya aplicadas)"""
+        if self.etiqueta is None or self._obtener_almacenamiento is None:
+            return False
+        return self._obtener_almacenamiento().escrituras_propias(self.etiqueta, instantanea.etiqueta)
+
+    def aplicar(self, resultados, ecosistemas, site_ids_vigentes=None):
+        """
+        Incorpora resultados recién guardados (upsert por site_id).
+        ecosistemas es una Series site_id -> ecosystem_type. Con site_ids_vigentes
+        se quitan además los sitios que ya no existen.
+        """
+        filas = _normalizar(resultados, ecosistemas)
+        huellas = _huellas_filas(filas)
+        with self._lock:
+            if site_ids_vigentes is not None:
+                for site_id in set(self._sitios) - set(pd.Index(site_ids_vigentes).astype(str)):
+                    self._quitar_sitio(site_id)
+            for fila, huella in zip(filas.itertuples(index=False), huellas.tolist()):
+                self._quitar_sitio(fila.site_id)
+                self._agregar_sitio(fila, huella)
+
+    def resumen(self):
+        """Resumen global y por ecosistema"""
+        with self._lock:
+            por_ecosistema = {clave: self._resumen_grupo(clave) for clave in sorted(
+                (k for k, g in self._grupos.items() if k is not GLOBAL and g.n), key=str)}
+            return {
+                'global': self._resumen_grupo(GLOBAL),
+                'por_ecosistema': por_ecosistema
+            }
+
+    def _resumen_grupo(self, clave):
+        grupo = self._grupos[clave]
+        indices = {}
+        for i, indice in enumerate(INDICES):
+            indices[indice] = grupo.metricas[indice].a_dict(self._vigente(clave, i))
+        return {
+            'total_sitios': grupo.n,
+            'por_categoria': {c: n for c, n in grupo.categorias.items() if n},
+            'indices': indices
+        }
+
+    def _vigente(self, clave, i):
+        """Una entrada de montículo vale si el sitio sigue en el grupo con ese mismo valor"""
+        def vigente(valor, site_id):
+            estado = self._sitios.get(site_id)
+            return (estado is not None and (clave is GLOBAL or estado[0] == clave)
+                    and estado[1][i] == valor)
+        return vigente
+
+    def _agregar_sitio(self, fila, huella):
+        valores = tuple(getattr(fila, indice) for indice in INDICES)
+        self._sitios[fila.site_id] = (fila.ecosistema, valores, fila.categoria, huella)
+        self._huella = (self._huella + huella) % (1 << 64)
+        for clave in (GLOBAL, fila.ecosistema):
+            grupo = self._grupos.get(clave)
+            if grupo is None:
+                grupo = self._grupos[clave] = _Grupo()
+            grupo.n += 1
+            grupo.categorias[fila.categoria] = grupo.categorias.get(fila.categoria, 0) + 1
+            for indice, valor in zip(INDICES, valores):
+                if valor == valor:  # NaN no cuenta
+                    grupo.metricas[indice].agregar(valor, fila.site_id)
+
+    def _quitar_sitio(self, site_id):
+        estado = self._sitios.pop(site_id, None)
+        if estado is None:
+            return
+        ecosistema, valores, categoria, huella = estado
+        self._huella = (self._huella - huella) % (1 << 64)
+        for clave in (GLOBAL, ecosistema):
+            grupo = self._grupos[clave]
+            grupo.n -= 1
+            grupo.categorias[categoria] -= 1
+            for indice, valor in zip(INDICES, valores):
+                if valor == valor:
+                    grupo.metricas[indice].quitar(valor)
+
+    def _reconstruir(self, filas, huellas):
+        """Reconstrucción completa y vectorizada (arranque o cambios externos)"""
+        self._sitios = {}
+        self._grupos = {GLOBAL: _Grupo()}
+        self._huella = int(huellas.sum())
+        self.reconstrucciones += 1
+
+        valores = filas[list(INDICES)].to_numpy(dtype=float)
+        self._sitios = dict(zip(filas['site_id'].tolist(), zip(
+            filas['ecosistema'].tolist(), map(tuple, valores.tolist()),
+            filas['categoria'].tolist(), huellas.tolist())))
+
+        codigos, ecosistemas = pd.factorize(filas['ecosistema'])
+        grupos = [(GLOBAL, np.ones(len(filas), dtype=bool))]
+        grupos += [(e, codigos == i) for i, e in enumerate(ecosistemas)]
+        for clave, mascara in grupos:
+            grupo = self._grupos.setdefault(clave, _Grupo())
+            grupo.n = int(mascara.sum())
+            grupo.categorias = filas['categoria'][mascara].value_counts().to_dict()
+            ids = filas['site_id'].to_numpy()[mascara]
+            for i, indice in enumerate(INDICES):
+                columna = valores[mascara, i]
+                validos = ~np.isnan(columna)
+                columna, ids_validos = columna[validos], ids[validos]
+                metrica = grupo.metricas[indice]
+                metrica.n = len(columna)
+                metrica.suma = float(columna.sum())
+                posiciones = np.clip(np.floor(columna * CUBETAS), -1, CUBETAS).astype(np.int64) + 1
+                metrica.cubetas = np.bincount(posiciones, minlength=CUBETAS + 2).astype(np.int64)
+                metrica.minimos = list(zip(columna.tolist(), ids_validos.tolist()))
+                metrica.maximos = list(zip((-columna).tolist(), ids_validos.tolist()))
+                heapq.heapify(metrica.minimos)
+                heapq.heapify(metrica.maximos)
+
+
+def ecosistemas_de(datos):
+    """Series site_id -> ecosystem_type (el que deriva transformar_datos)"""
+    return datos['sites'].drop_duplicates('site_id', keep='first').set_index('site_id')['ecosystem_type']
+
+
+def filas_agregables(datos):
+    """Último resultado de cada sitio, con su ecosystem_type"""
+    ecosistemas = ecosistemas_de(datos)
+    resultados = datos['results']
+    if resultados is None or resultados.empty or 'EHI' not in resultados.columns:
+        return _normalizar(pd.DataFrame(columns=['site_id', 'categoria', *INDICES]), ecosistemas)
+    return _normalizar(resultados, ecosistemas)
+
+
+def _normalizar(resultados, ecosistemas):
+    """Columnas y tipos comunes, para que la huella de una fila no dependa de su origen"""
+    ultimos = resultados.drop_duplicates('site_id', keep='last')
+    site_ids = ultimos['site_id'].astype(str)
+    filas = pd.DataFrame({
+        'site_id': site_ids.to_numpy(dtype=object),
+        'ecosistema': ecosistemas.reindex(site_ids).fillna(SIN_ECOSISTEMA).astype(str).to_numpy(dtype=object),
+        'categoria': ultimos['categoria'].fillna('Sin datos').astype(str).to_numpy(dtype=object)
+    })
+    for indice in INDICES:
+        filas[indice] = pd.to_numeric(ultimos[indice], errors='coerce').to_numpy(dtype=float)
+    return filas
+
+
+def _huellas_filas(filas):
+    """Hash de 64 bits por fila; su suma (módulo 2^64) no depende del orden"""
+    if filas.empty:
+        return np.empty(0, dtype=np.uint64)
+    redondeadas = filas.copy()
+    for indice in INDICES:
+        redondeadas[indice] = redondeadas[indice].round(10)
+    return pd.util.hash_pandas_object(redondeadas, index=False).to_numpy(dtype=np.uint64)
@@ -0,0 +1,292 @@
+"""
+Detección en línea de anomalías del EHI por sitio.
+Cada sitio guarda un estado pequeño: media y varianza con suavizado
+exponencial (EWMA) de EHI, BI, TFI y VSI, una suma acumulada (CUSUM) de las
+caídas del EHI y la última categoría. Cada resultado nuevo actualiza ese
+estado en O(1) y puede generar alertas:
+- cambio_categoria: el EHI cruza un umbral de categorizar_ehi
+- desviacion: un índice se aleja de su media más de UMBRAL_Z desviaciones
+- tendencia_baja: el EHI baja de forma sostenida (CUSUM por encima de CUSUM_H)
+Las alertas llevan un número de secuencia creciente; los clientes piden las
+posteriores a la última que vieron.
+
+El estado de los sitios, la secuencia y las alertas viven en una base SQLite
+compartida por todos los procesos de la app: da igual qué proceso guarde los
+resultados o atienda al cliente, y un reinicio no pierde la línea base ni
+repite números de secuencia. Se conservan las últimas `max_alertas`.
+"""
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import pandas as pd
+
+from models.resultado import ETIQUETAS, UMBRALES_EHI, codigo_categoria
+from services.almacenamiento import conectar_sqlite
+
+INDICES = ('EHI', 'BI', 'TFI', 'VSI')
+ALFA = 0.3                # Peso del resultado nuevo en la EWMA
+UMBRAL_Z = 3.0            # Desviaciones respecto de la media para alertar
+MIN_OBSERVACIONES = 3     # Resultados previos necesarios antes de alertar por desviación
+DESVIACION_MINIMA = 0.02  # Piso de la desviación (evita alertas por varianza casi nula)
+CUSUM_K = 0.02            # Caída del EHI por resultado que se tolera sin acumular
+CUSUM_H = 0.10            # Caída acumulada que dispara la alerta de tendencia
+MAX_ALERTAS = 10000       # Alertas que se conservan para consultar
+ESPERA_SONDEO = 0.5       # Intervalo con que se buscan alertas emitidas por otro proceso
+SITIOS_POR_CONSULTA = 500 # site_id por consulta al leer estados (límite de parámetros de SQLite)
+
+COLUMNAS_ESTADO = (['site_id', 'n'] + [f'media_{i}' for i in INDICES] + [f'varianza_{i}' for i in INDICES] +
+                   ['cusum', 'codigo'])
+
+
+class _EstadoSitio:
+    __slots__ = ('n', 'media', 'varianza', 'cusum', 'codigo')
+
+    def __init__(self, valores):
+        self.n = 1
+        self.media = list(valores)
+        self.varianza = [0.0] * len(valores)
+        self.cusum = 0.0
+        self.codigo = codigo_categoria(valores[0], UMBRALES_EHI)
+
+    @classmethod
+    def desde_fila(cls, fila):
+        """Estado guardado (SQLite devuelve NULL en lugar de NaN)"""
+        estado = cls.__new__(cls)
+        k = len(INDICES)
+        flotantes = [float('nan') if v is None else v for v in fila[2:2 + 2 * k]]
+        estado.n = fila[1]
+        estado.media = flotantes[:k]
+        estado.varianza = flotantes[k:]
+        estado.cusum = fila[2 + 2 * k]
+        estado.codigo = fila[3 + 2 * k]
+        return estado
+
+    def a_fila(self, site_id):
+        return (site_id, self.n, *self.media, *self.varianza, self.cusum, int(self.codigo))
+
+
+class DetectorAnomalias:
+    """Estado EWMA/CUSUM por sitio y registro de alertas con número de secuencia (SQLite compartido)"""
+
+    def __init__(self, ruta, max_alertas=MAX_ALERTAS):
+        self.ruta = ruta
+        self.max_alertas = max_alertas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._nuevas = threading.Condition(self._lock)
+        self._etiqueta = None  # Última versión de datos que este proceso ya tomó como línea base
+        con = self._conexion()
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)')
+            columnas = ', '.join(f'{c} REAL' for c in COLUMNAS_ESTADO[2:-2])
+            con.execute(f'CREATE TABLE IF NOT EXISTS sitios (site_id TEXT PRIMARY KEY, n INTEGER NOT NULL, '
+                        f'{columnas}, cusum REAL NOT NULL, codigo INTEGER NOT NULL) WITHOUT ROWID')
+            con.execute('CREATE TABLE IF NOT EXISTS alertas (seq INTEGER PRIMARY KEY, site_id TEXT NOT NULL, '
+                        'tipo TEXT NOT NULL, datos TEXT NOT NULL)')
+            con.execute('CREATE INDEX IF NOT EXISTS idx_alertas_site_id ON alertas (site_id, seq)')
+            con.execute('CREATE TABLE IF NOT EXISTS conteos (tipo TEXT PRIMARY KEY, n INTEGER NOT NULL)')
+            con.execute("INSERT OR IGNORE INTO meta VALUES ('seq', '0')")
+
+    def _conexion(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = conectar_sqlite(self.ruta)
+            self._local.con = con
+        return con
+
+    @property
+    def seq(self):
+        """Última secuencia asignada (por cualquier proceso)"""
+        return _seq(self._conexion())
+
+    @property
+    def conteos(self):
+        """tipo -> alertas emitidas"""
+        return dict(self._conexion().execute('SELECT tipo, n FROM conteos'))
+
+    def sincronizar(self, instantanea):
+        """
+        Toma los resultados guardados como línea base de los sitios que aún no
+        tienen estado. Se repite con cada versión de datos nueva, así los sitios
+        que llegan por otra vía (ingesta, edición del Excel) también la tienen.
+        """
+        with self._lock:
+            if instantanea.etiqueta == self._etiqueta:
+                return
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            meta = dict(con.execute('SELECT clave, valor FROM meta'))
+            # Otro proceso ya la tomó, o este aún no cargó la versión que ya se tomó
+            vista = meta.get('etiqueta') == instantanea.etiqueta or \
+                ('modificado' in meta and instantanea.modificado < float(meta['modificado']))
+            if not vista:
+                marcas = ', '.join('?' * len(COLUMNAS_ESTADO))
+                con.executemany(f'INSERT OR IGNORE INTO sitios VALUES ({marcas})',
+                                (_EstadoSitio(valores).a_fila(site_id)
+                                 for site_id, *valores in _filas(instantanea.datos['results'])))
+                con.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                                [('etiqueta', instantanea.etiqueta),
+                                 ('modificado', repr(float(instantanea.modificado)))])
+        with self._lock:
+            self._etiqueta = instantanea.etiqueta
+
+    def observar(self, resultados, site_ids_vigentes=None):
+        """Actualiza el estado con resultados recién guardados y devuelve las alertas emitidas"""
+        fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        filas = _filas(resultados)
+        emitidas = []
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            if site_ids_vigentes is not None:
+                vigentes = set(pd.Index(site_ids_vigentes).astype(str))
+                guardados = [site_id for (site_id,) in con.execute('SELECT site_id FROM sitios')]
+                con.executemany('DELETE FROM sitios WHERE site_id = ?',
+                                ((site_id,) for site_id in guardados if site_id not in vigentes))
+            estados = _leer_estados(con, list(dict.fromkeys(fila[0] for fila in filas)))
+            seq = _seq(con)
+            for site_id, *valores in filas:
+                estado = estados.get(site_id)
+                if estado is None:
+                    estados[site_id] = _EstadoSitio(valores)
+                    continue
+                for alerta in _actualizar(estado, valores):
+                    seq += 1
+                    alerta.update({'seq': seq, 'site_id': site_id, 'fecha': fecha})
+                    emitidas.append(alerta)
+
+            marcas = ', '.join('?' * len(COLUMNAS_ESTADO))
+            con.executemany(f'INSERT OR REPLACE INTO sitios VALUES ({marcas})',
+                            (estado.a_fila(site_id) for site_id, estado in estados.items()))
+            if emitidas:
+                con.executemany('INSERT INTO alertas VALUES (?, ?, ?, ?)',
+                                ((a['seq'], a['site_id'], a['tipo'], json.dumps(a)) for a in emitidas))
+                con.executemany('INSERT INTO conteos VALUES (?, ?) ON CONFLICT (tipo) DO UPDATE SET n = n + excluded.n',
+                                Counter(a['tipo'] for a in emitidas).items())
+                con.execute('DELETE FROM alertas WHERE seq <= ?', (seq - self.max_alertas,))
+                con.execute("UPDATE meta SET valor = ? WHERE clave = 'seq'", (str(seq),))
+        if emitidas:
+            with self._lock:
+                self._nuevas.notify_all()
+        return emitidas
+
+    def consultar(self, desde=0, limite=None, site_id=None):
+        """
+        Alertas con seq mayor que `desde` (como mucho `limite`).
+        truncado indica que se descartaron alertas posteriores a `desde` por el
+        tamaño del registro: el cliente perdió alertas.
+        """
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN')
+            seq = _seq(con)
+            primera = con.execute('SELECT MIN(seq) FROM alertas').fetchone()[0] or seq + 1
+            condicion, parametros = ('seq > ?', [desde]) if site_id is None else \
+                ('site_id = ? AND seq > ?', [str(site_id), desde])
+            consulta = f'SELECT datos FROM alertas WHERE {condicion} ORDER BY seq'
+            if limite is not None:
+                consulta += ' LIMIT ?'
+                parametros.append(limite + 1)
+            alertas = [json.loads(datos) for (datos,) in con.execute(consulta, parametros)]
+
+        siguiente = None
+        if limite is not None and len(alertas) > limite:
+            alertas = alertas[:limite]
+            siguiente = alertas[-1]['seq']
+        return {
+            'alertas': alertas,
+            'ultimo_seq': seq,
+            'siguiente': siguiente,
+            'truncado': desde + 1 < primera and desde < seq
+        }
+
+    def recientes(self, n=20):
+        """Las últimas n alertas, de la más nueva a la más vieja"""
+        if n <= 0:
+            return []
+        filas = self._conexion().execute('SELECT datos FROM alertas ORDER BY seq DESC LIMIT ?', (n,))
+        return [json.loads(datos) for (datos,) in filas]
+
+    def esperar(self, desde, timeout):
+        """
+        Bloquea hasta que haya alertas posteriores a `desde` (o venza el timeout) y las devuelve.
+        Las de este proceso despiertan al momento; las de otro, en la siguiente consulta.
+        """
+        limite = time.monotonic() + timeout
+        while True:
+            consulta = self.consultar(desde)
+            restante = limite - time.monotonic()
+            if consulta['ultimo_seq'] > desde or restante <= 0:
+                return consulta
+            with self._lock:
+                self._nuevas.wait(min(restante, ESPERA_SONDEO))
+
+
+def _actualizar(estado, valores):
+    """Actualiza el estado de un sitio en O(1) y devuelve sus alertas"""
+    alertas = []
+    ehi = valores[0]
+
+    # Cambio de categoría del EHI
+    codigo = codigo_categoria(ehi, UMBRALES_EHI)
+    if codigo != estado.codigo:
+        alertas.append({
+            'tipo': 'cambio_categoria', 'indice': 'EHI', 'valor': ehi,
+            'categoria_anterior': ETIQUETAS[estado.codigo], 'categoria': ETIQUETAS[codigo],
+            # Los códigos menores son mejores categorías
+            'direccion': 'empeora' if codigo > estado.codigo else 'mejora'
+        })
+        estado.codigo = codigo
+
+    # CUSUM de caídas del EHI respecto de su media
+    estado.cusum = max(0.0, estado.cusum + (estado.media[0] - ehi) - CUSUM_K)
+    if estado.cusum > CUSUM_H:
+        alertas.append({'tipo': 'tendencia_baja', 'indice': 'EHI', 'valor': ehi,
+                        'esperado': estado.media[0], 'caida_acumulada': estado.cusum})
+        estado.cusum = 0.0
+
+    # Desviación de cada índice y actualización de la EWMA
+    for i, (indice, valor) in enumerate(zip(INDICES, valores)):
+        if valor != valor:  # NaN no actualiza el estado
+            continue
+        diferencia = valor - estado.media[i]
+        desviacion = max(estado.varianza[i] ** 0.5, DESVIACION_MINIMA)
+        z = diferencia / desviacion
+        if estado.n >= MIN_OBSERVACIONES and abs(z) > UMBRAL_Z:
+            alertas.append({'tipo': 'desviacion', 'indice': indice, 'valor': valor,
+                            'esperado': estado.media[i], 'z': z})
+        incremento = ALFA * diferencia
+        estado.media[i] += incremento
+        estado.varianza[i] = (1 - ALFA) * (estado.varianza[i] + diferencia * incremento)
+    estado.n += 1
+    return alertas
+
+
+def _filas(resultados):
+    """Tuplas (site_id, EHI, BI, TFI, VSI) de una tabla de resultados"""
+    if resultados is None or resultados.empty or 'site_id' not in resultados.columns:
+        return []
+    columnas = [resultados[indice] if indice in resultados.columns else pd.Series(float('nan'), index=resultados.index)
+                for indice in INDICES]
+    valores = pd.concat(columnas, axis=1).apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return list(zip(resultados['site_id'].astype(str).tolist(), *(valores[:, i].tolist() for i in range(len(INDICES)))))
+
+
+def _seq(con):
+    return int(con.execute("SELECT valor FROM meta WHERE clave = 'seq'").fetchone()[0])
+
+
+def _leer_estados(con, site_ids):
+    """{site_id: estado} de los sitios que ya tienen estado guardado"""
+    estados = {}
+    for i in range(0, len(site_ids), SITIOS_POR_CONSULTA):
+        parte = site_ids[i:i + SITIOS_POR_CONSULTA]
+        filas = con.execute(f"SELECT {', '.join(COLUMNAS_ESTADO)} FROM sitios "
+                            f"WHERE site_id IN ({', '.join('?' * len(parte))})", parte)
+        estados.update((fila[0], _EstadoSitio.desde_fila(fila)) for fila in filas)
+    return estados
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+import uuid
+
+from services import compilado, metricas
+
+
+class Instantanea:
+    """Versión inmutable de los datos transformados que comparten las peticiones"""
+
+    __slots__ = ('version', 'datos', 'cargado_en', 'etiqueta', 'modificado', '_derivados', '_lock')
+
+    def __init__(self, version, datos, cargado_en, etiqueta=None, modificado=None):
+        self.version = version
+        self.datos = datos
+        self.cargado_en = cargado_en
+        # Identifica el contenido en todos los procesos y entre reinicios (base de los ETag)
+        self.etiqueta = etiqueta or str(version)
+        # Fecha de modificación de la fuente (base de Last-Modified); sin ella, la de carga
+        self.modificado = modificado or cargado_en
+        self._derivados = {}
+        self._lock = threading.RLock()  # Reentrante: un derivado puede depender de otro
+
+    def derivado(self, nombre, constructor):
+        """
+        Devuelve una estructura derivada de estos datos (índices, uniones...),
+        construyéndola una sola vez por versión con constructor(datos).
+        """
+        try:
+            return self._derivados[nombre]
+        except KeyError:
+            pass
+        with self._lock:
+            if nombre not in self._derivados:
+                with metricas.fase('calculo'):
+                    self._derivados[nombre] = constructor(self.datos)
+            return self._derivados[nombre]
+
+
+class AlmacenDatos:
+    """
+    Mantiene en memoria los datos transformados para todo el proceso.
+    Solo recarga cuando cambia la firma del backend de almacenamiento (mtime/tamaño
+    del Excel, revisión de SQLite) y además cambia su contenido. Cada recarga
+    incrementa la versión de datos.
+    Con obtener_compilado, los datos se leen de la instantánea compilada si su
+    huella coincide con la de la fuente; si no, se cargan, se transforman y se
+    vuelve a compilar, de modo que todos los procesos mapean el mismo archivo.
+    """
+
+    def __init__(self, obtener_fuente, transformar, obtener_compilado=None):
+        self._obtener_fuente = obtener_fuente  # Función que devuelve el backend de almacenamiento actual
+        self._transformar = transformar        # Función que transforma los datos crudos (o None)
+        self._obtener_compilado = obtener_compilado  # Función que devuelve la ruta de la instantánea (o None)
+        self._lock = threading.Lock()
+        self._actual = None
+        self._version = 0
+        self._firma = None
+        self._hash = None
+        self._proceso = uuid.uuid4().hex[:8]   # Etiqueta de respaldo si la fuente no da huella
+
+    @property
+    def version(self):
+        """Versión de los datos actualmente en memoria (0 si nunca se cargaron)"""
+        return self._version
+
+    def obtener(self):
+        """Devuelve la instantánea vigente, recargando solo si los datos cambiaron"""
+        fuente = self._obtener_fuente()
+        actual = self._actual
+
+        # Camino rápido sin bloqueo: la firma no cambió desde la última carga
+        if actual is not None and self._firma_fuente(fuente) == self._firma:
+            return actual
+
+        with self._lock:
+            # Otro hilo pudo haber recargado mientras esperábamos el bloqueo
+            firma = self._firma_fuente(fuente)
+            if self._actual is not None and firma == self._firma:
+                return self._actual
+
+            if firma is None:
+                # Sin datos: se siguen sirviendo los últimos datos válidos
+                return self._actual
+
+            modificado = fuente.modificado()
+            contenido = (id(fuente), fuente.huella_contenido())
+            if self._actual is not None and contenido == self._hash:
+                # Solo cambió la firma (p. ej. un "touch"), el contenido es el mismo
+                self._firma = firma
+                return self._actual
+
+            datos = self._cargar(fuente, contenido[1])
+            if datos is None:
+                # Carga fallida (archivo a medio escribir, etc.): se reintenta en la próxima petición
+                return self._actual
+
+            self._version += 1
+            metricas.RECARGAS_DATOS.incrementar()
+            # La etiqueta sale del contenido de la fuente: todos los procesos dan la misma a los mismos datos
+            etiqueta = str(contenido[1]) if contenido[1] is not None else f'{self._proceso}-{self._version}'
+            self._actual = Instantanea(self._version, datos, time.time(), etiqueta, modificado)
+            self._firma = firma
+            self._hash = contenido
+            return self._actual
+
+    def compilar(self):
+        """Compila la fuente actual aunque la instantánea ya esté vigente; devuelve la ruta o None"""
+        ruta = self._ruta_compilado()
+        if ruta is None:
+            return None
+        fuente = self._obtener_fuente()
+        huella = fuente.huella_contenido()
+        datos = self._transformar(fuente.cargar())
+        if huella is None or datos is None:
+            return None
+        compilado.compilar(datos, ruta, _origen(fuente), huella)
+        return ruta
+
+    def _cargar(self, fuente, huella):
+        """Abre la instantánea compilada si está vigente; si no, carga, transforma y la compila"""
+        ruta = self._ruta_compilado()
+        if ruta is not None and huella is not None:
+            with metricas.fase('carga'):
+                datos = compilado.abrir(ruta, _origen(fuente), huella)
+            if datos is not None:
+                return datos
+
+        with metricas.fase('carga'):
+            crudos = fuente.cargar()
+        with metricas.fase('transformar'):
+            datos = self._transformar(crudos)
+        if datos is None or ruta is None or huella is None:
+            return datos
+
+        try:
+            with metricas.fase('persistencia'):
+                compilado.compilar(datos, ruta, _origen(fuente), huella)
+            # Se usa el archivo mapeado para que la copia en memoria sea la compartida
+            return compilado.abrir(ruta, _origen(fuente), huella) or datos
+        except Exception as e:
+            print(f"No se pudo compilar la instantánea de datos en {ruta}: {e}")
+            return datos
+
+    def _ruta_compilado(self):
+        return self._obtener_compilado() if self._obtener_compilado is not None else None
+
+    def invalidar(self):
+        """Fuerza a que la próxima lectura vuelva a comprobar el contenido de los datos"""
+        with self._lock:
+            self._firma = None
+            self._hash = None
+
+    @staticmethod
+    def _firma_fuente(fuente):
+        firma = fuente.firma()
+        return None if firma is None else (id(fuente), firma)
+
+
+def _origen(fuente):
+    """Identifica la fuente de una instantánea compilada (tipo de backend y ruta)"""
+    return f"{type(fuente).__name__}:{os.path.abspath(getattr(fuente, 'ruta', ''))}"
@@ -0,0 +1,494 @@
+"""
+Backends de almacenamiento de EcoBalance.
+AlmacenamientoExcel conserva el formato original del libro (.xlsx) y
+AlmacenamientoSQLite guarda las mismas tablas en una base SQLite embebida.
+Ambos devuelven las tablas con los nombres de columna del Excel, listas para
+transformar_datos.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from services.escritura import bloqueo_archivo, ruta_bloqueo, sin_cambios
+from services.lector_excel import leer_hoja, leer_libro
+
+# Clave interna -> nombre de la hoja del Excel
+HOJAS = {
+    'sites': '1-sites',
+    'biodiversity': '2-biodiversity_data',
+    'trophic': '3-trophic_data',
+    'vsi': '4-vsi_data',
+    'results': '5-results_ehi'
+}
+
+# Clave interna -> (tabla SQLite, columnas con su tipo)
+ESQUEMA_SQLITE = {
+    'sites': ('sites', [
+        ('site_id', 'TEXT PRIMARY KEY'), ('nombre', 'TEXT'), ('latitud', 'REAL'), ('longitud', 'REAL')
+    ]),
+    'biodiversity': ('biodiversity_data', [
+        ('site_id', 'TEXT NOT NULL'), ('data_id', 'INTEGER'), ('fecha', 'TEXT'),
+        ('especie_nombre', 'TEXT'), ('abundancia', 'INTEGER')
+    ]),
+    'trophic': ('trophic_data', [
+        ('site_id', 'TEXT NOT NULL'), ('trophic_id', 'INTEGER'), ('fecha', 'TEXT'),
+        ('conn_obs', 'REAL'), ('conn_exp', 'REAL'), ('len_obs', 'REAL'), ('len_exp', 'REAL')
+    ]),
+    'vsi': ('vsi_data', [
+        ('site_id', 'TEXT NOT NULL'), ('vsi_id', 'INTEGER'), ('fecha', 'TEXT'),
+        ('cobertura_pct', 'REAL'), ('calidad_suelo_pct', 'REAL')
+    ]),
+    'results': ('results_ehi', [
+        ('site_id', 'TEXT PRIMARY KEY'), ('fecha', 'TEXT'), ('BI', 'REAL'), ('TFI', 'REAL'),
+        ('VSI', 'REAL'), ('EHI', 'REAL'), ('categoria', 'TEXT'), ('huella', 'TEXT')
+    ])
+}
+
+
+# Milisegundos epoch actuales en SQL (fecha de la última escritura en la tabla meta)
+AHORA_MS_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+# Columna de id de cada hoja de observaciones (se numera al ingestar filas sin id)
+COLUMNAS_ID = {'biodiversity': 'data_id', 'trophic': 'trophic_id', 'vsi': 'vsi_id'}
+
+# Columnas que se leen de cada hoja (las demás columnas del libro se ignoran al cargar)
+COLUMNAS_EXCEL = {clave: [nombre for nombre, _ in columnas] for clave, (_, columnas) in ESQUEMA_SQLITE.items()}
+
+
+class Almacenamiento:
+    """Interfaz común de los backends de almacenamiento"""
+
+    MAX_ESCRITURAS_PROPIAS = 64
+
+    def __init__(self):
+        # Huella de contenido antes -> después de cada escritura hecha por este proceso
+        self._escrituras = OrderedDict()
+        self._lock_escrituras = threading.Lock()
+
+    def escrituras_propias(self, desde, hasta):
+        """
+        True si se pasa del contenido con huella `desde` al de huella `hasta` solo con
+        escrituras de este proceso (nadie más tocó los datos entre medio).
+        """
+        desde, hasta = str(desde), str(hasta)
+        with self._lock_escrituras:
+            for _ in range(len(self._escrituras) + 1):
+                if desde == hasta:
+                    return True
+                desde = self._escrituras.get(desde)
+                if desde is None:
+                    return False
+        return False
+
+    def _registrar_escritura(self, antes, despues):
+        """Anota una escritura propia (llamar con el bloqueo de escritura aún tomado)"""
+        if antes is None or despues is None:
+            return
+        with self._lock_escrituras:
+            self._escrituras[str(antes)] = str(despues)
+            self._escrituras.move_to_end(str(antes))
+            while len(self._escrituras) > self.MAX_ESCRITURAS_PROPIAS:
+                self._escrituras.popitem(last=False)
+
+    def cargar(self):
+        """Devuelve un diccionario de DataFrames con las columnas del Excel, o None si falla"""
+        raise NotImplementedError
+
+    def guardar_resultados(self, resultados_df, site_ids_vigentes=None, forzar=False):
+        """
+        Inserta o reemplaza (por site_id) las filas de resultados dadas.
+        Si se indica site_ids_vigentes, elimina los resultados de sitios que ya no existen.
+        Si las filas ya estaban guardadas (salvo la fecha) no se escribe nada, a menos que se fuerce.
+        Devuelve True si se guardó correctamente.
+        """
+        raise NotImplementedError
+
+    def agregar_filas(self, clave, filas_df):
+        """Añade filas de observaciones (biodiversity, trophic o vsi) con las columnas del Excel"""
+        raise NotImplementedError
+
+    def firma(self):
+        """Firma barata que cambia cuando pueden haber cambiado los datos (None si no hay datos)"""
+        raise NotImplementedError
+
+    def huella_contenido(self):
+        """Huella del contenido para descartar cambios de firma sin cambios reales"""
+        return self.firma()
+
+    def modificado(self):
+        """Fecha (segundos epoch) de la última modificación de los datos, igual en todos los procesos"""
+        return None
+
+
+class AlmacenamientoExcel(Almacenamiento):
+    """
+    Libro Excel con las cinco hojas de EcoBalance.
+    Cada escritura se hace bajo un bloqueo de archivo (también entre procesos)
+    sobre una copia del libro que luego reemplaza al original con os.replace:
+    quien lee el libro nunca ve un archivo a medio escribir.
+    """
+
+    def __init__(self, ruta):
+        super().__init__()
+        self.ruta = ruta
+        self._huella = (None, None)  # (firma, huella): el libro no se vuelve a leer si no cambió
+
+    def cargar(self):
+        try:
+            datos = leer_libro(self.ruta, HOJAS, COLUMNAS_EXCEL)
+            faltantes = [HOJAS[clave] for clave in HOJAS if clave not in datos]
+            if faltantes:
+                raise ValueError(f"Faltan hojas en el libro: {', '.join(faltantes)}")
+            return normalizar_site_id(datos)
+
+        except FileNotFoundError:
+            print(f"\n❌ ERROR: Archivo Excel no encontrado en la ruta esperada: {self.ruta}")
+            return None
+
+        except Exception as e:
+            print(f"\n❌ ERROR inesperado al cargar el Excel: {e}")
+            return None
+
+    def guardar_resultados(self, resultados_df, site_ids_vigentes=None, forzar=False):
+        try:
+            with bloqueo_archivo(ruta_bloqueo(self.ruta)):
+                try:
+                    previos = leer_hoja(self.ruta, HOJAS['results'])
+                    previos['site_id'] = previos['site_id'].astype(str)
+                except ValueError:
+                    # La hoja de resultados aún no existe
+                    previos = pd.DataFrame(columns=['site_id'])
+                combinados = combinar_resultados(previos, resultados_df, site_ids_vigentes)
+
+                # Otro proceso ya escribió estos mismos resultados (p. ej. recálculos simultáneos)
+                if not forzar and sin_cambios(previos, combinados):
+                    return True
+                antes = self.huella_contenido()
+                self._reemplazar_hoja(HOJAS['results'], combinados)
+                self._registrar_escritura(antes, self.huella_contenido())
+
+            return True
+        except Exception as e:
+            print(f"Error guardando resultados: {e}")
+            return False
+
+    def agregar_filas(self, clave, filas_df):
+        # El formato xlsx obliga a reescribir la hoja completa: por eso se llama con lotes grandes
+        hoja = HOJAS[clave]
+        with bloqueo_archivo(ruta_bloqueo(self.ruta)):
+            previas = leer_hoja(self.ruta, hoja)
+            filas_df = asignar_ids(clave, filas_df, previas[COLUMNAS_ID[clave]].max() if len(previas) else 0)
+            combinadas = pd.concat([previas, filas_df.reindex(columns=previas.columns)], ignore_index=True)
+            antes = self.huella_contenido()
+            self._reemplazar_hoja(hoja, combinadas)
+            self._registrar_escritura(antes, self.huella_contenido())
+
+    def _reemplazar_hoja(self, hoja, df):
+        """Escribe la hoja en una copia del libro y la pone en lugar del original"""
+        carpeta = os.path.dirname(os.path.abspath(self.ruta))
+        descriptor, temporal = tempfile.mkstemp(prefix='.escritura_', suffix='.xlsx', dir=carpeta)
+        os.close(descriptor)
+        try:
+            shutil.copyfile(self.ruta, temporal)
+            shutil.copymode(self.ruta, temporal)
+            with pd.ExcelWriter(temporal, engine='openpyxl', mode='a', if_sheet_exists='replace') as writer:
+                df.to_excel(writer, sheet_name=hoja, index=False)
+            os.replace(temporal, self.ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+
+    def firma(self):
+        try:
+            estado = os.stat(self.ruta)
+        except OSError:
+            return None
+        return (estado.st_mtime_ns, estado.st_size)
+
+    def modificado(self):
+        try:
+            return os.stat(self.ruta).st_mtime
+        except OSError:
+            return None
+
+    def huella_contenido(self):
+        firma = self.firma()
+        if firma is not None and self._huella[0] == firma:
+            return self._huella[1]
+        h = hashlib.blake2b(digest_size=16)
+        try:
+            with open(self.ruta, 'rb') as f:
+                for bloque in iter(lambda: f.read(1 << 20), b''):
+                    h.update(bloque)
+        except OSError:
+            return None
+        self._huella = (firma, h.hexdigest())
+        return self._huella[1]
+
+
+class AlmacenamientoSQLite(Almacenamiento):
+    """
+    Base SQLite embebida con las mismas tablas que el Excel.
+    Usa WAL para que los lectores no se bloqueen durante las escrituras, índices
+    por site_id y una revisión en la tabla meta que cada escritura incrementa
+    dentro de la misma transacción.
+    """
+
+    def __init__(self, ruta):
+        super().__init__()
+        self.ruta = ruta
+        self._local = threading.local()
+        if os.path.exists(ruta):
+            crear_esquema(self._conexion())
+
+    def _conexion(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = conectar_sqlite(self.ruta)
+            self._local.con = con
+        return con
+
+    def cargar(self):
+        if not os.path.exists(self.ruta):
+            print(f"\n❌ ERROR: Base SQLite no encontrada en la ruta esperada: {self.ruta}")
+            return None
+        try:
+            con = self._conexion()
+            datos = {}
+            for clave, (tabla, columnas) in ESQUEMA_SQLITE.items():
+                # ORDER BY rowid conserva el orden de inserción (desempata las mediciones con la misma fecha)
+                df = pd.read_sql_query(f'SELECT * FROM {tabla} ORDER BY rowid', con)
+                if clave != 'results' and 'fecha' in df.columns:
+                    df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
+                datos[clave] = df
+            return normalizar_site_id(datos)
+
+        except Exception as e:
+            print(f"\n❌ ERROR inesperado al cargar SQLite: {e}")
+            return None
+
+    def guardar_resultados(self, resultados_df, site_ids_vigentes=None, forzar=False):
+        tabla, columnas = ESQUEMA_SQLITE['results']
+        nombres = [nombre for nombre, _ in columnas]
+        filas = resultados_df.reindex(columns=nombres).astype(object)
+        filas = filas.where(filas.notna(), None)
+        filas['site_id'] = filas['site_id'].astype(str)
+
+        actualizar = ', '.join(f'{c} = excluded.{c}' for c in nombres if c != 'site_id')
+        sentencia = (f'INSERT INTO {tabla} ({", ".join(nombres)}) VALUES ({", ".join("?" * len(nombres))}) '
+                     f'ON CONFLICT(site_id) DO UPDATE SET {actualizar}')
+        try:
+            con = self._conexion()
+            with con:
+                # IMMEDIATE toma el bloqueo de escritura antes de leer: otro proceso que
+                # escriba a la vez espera aquí y después ve lo que este dejó escrito
+                con.execute('BEGIN IMMEDIATE')
+                antes = huella_sqlite(con)
+                # Solo se leen las filas guardadas de los sitios que llegan
+                cargar_ids_temporales(con, 'entrantes', filas['site_id'])
+                previos = pd.read_sql_query(
+                    f'SELECT * FROM {tabla} WHERE site_id IN (SELECT site_id FROM entrantes)', con)
+                iguales = not forzar and sin_cambios(previos, filas)
+                if not iguales:
+                    con.executemany(sentencia, filas.itertuples(index=False, name=None))
+                borrados = 0
+                if site_ids_vigentes is not None:
+                    cargar_ids_temporales(con, 'vigentes', site_ids_vigentes)
+                    borrados = con.execute(
+                        f'DELETE FROM {tabla} WHERE site_id NOT IN (SELECT site_id FROM vigentes)').rowcount
+                # Otro proceso ya escribió estos mismos resultados (p. ej. recálculos simultáneos)
+                if iguales and not borrados:
+                    return True
+                incrementar_revision(con)
+                self._registrar_escritura(antes, huella_sqlite(con))
+            return True
+        except Exception as e:
+            print(f"Error guardando resultados: {e}")
+            return False
+
+    def agregar_filas(self, clave, filas_df):
+        tabla, columnas = ESQUEMA_SQLITE[clave]
+        nombres = [nombre for nombre, _ in columnas]
+        columna_id = COLUMNAS_ID[clave]
+
+        con = self._conexion()
+        with con:
+            # El máximo id se lee con el bloqueo de escritura tomado: dos ingestas no repiten ids
+            con.execute('BEGIN IMMEDIATE')
+            maximo = con.execute(f'SELECT MAX({columna_id}) FROM {tabla}').fetchone()[0]
+            filas = filas_para_sqlite(asignar_ids(clave, filas_df, maximo).reindex(columns=nombres))
+            antes = huella_sqlite(con)
+            con.executemany(f'INSERT INTO {tabla} ({", ".join(nombres)}) VALUES ({", ".join("?" * len(nombres))})',
+                            filas.itertuples(index=False, name=None))
+            incrementar_revision(con)
+            self._registrar_escritura(antes, huella_sqlite(con))
+
+    def firma(self):
+        if not os.path.exists(self.ruta):
+            return None
+        try:
+            fila = self._conexion().execute("SELECT valor FROM meta WHERE clave = 'revision'").fetchone()
+        except sqlite3.Error:
+            return None
+        return fila[0] if fila else 0
+
+    def huella_contenido(self):
+        try:
+            return huella_sqlite(self._conexion())
+        except sqlite3.Error:
+            return None
+
+    def modificado(self):
+        try:
+            fila = self._conexion().execute("SELECT valor FROM meta WHERE clave = 'modificado'").fetchone()
+        except sqlite3.Error:
+            return None
+        return fila[0] / 1000 if fila else None
+
+
+def normalizar_site_id(datos):
+    """Convierte site_id a texto en todas las tablas (así se comparan en toda la app)"""
+    for key in datos:
+        if 'site_id' in datos[key].columns:
+            datos[key]['site_id'] = datos[key]['site_id'].astype(str)
+    return datos
+
+
+def combinar_resultados(previos, nuevos, site_ids_vigentes=None):
+    """Reemplaza en previos las filas de los sitios presentes en nuevos (upsert por site_id)"""
+    nuevos = nuevos.copy()
+    nuevos['site_id'] = nuevos['site_id'].astype(str)
+    conservados = previos[~previos['site_id'].isin(nuevos['site_id'])]
+    combinados = pd.concat([conservados, nuevos], ignore_index=True)
+
+    if site_ids_vigentes is not None:
+        vigentes = pd.Index(pd.Series(site_ids_vigentes).astype(str))
+        combinados = combinados[combinados['site_id'].isin(vigentes)]
+        # Mismo orden que la hoja de sitios
+        combinados = combinados.iloc[vigentes.get_indexer(combinados['site_id']).argsort(kind='stable')]
+
+    return combinados.reset_index(drop=True)
+
+
+def asignar_ids(clave, filas_df, maximo):
+    """
+    Numera a continuación de `maximo` las filas que llegan sin id, para que la
+    columna quede entera (sin NaN que la conviertan en real al leerla).
+    """
+    columna = COLUMNAS_ID[clave]
+    ids = pd.to_numeric(filas_df[columna], errors='coerce') if columna in filas_df.columns else \
+        pd.Series(float('nan'), index=filas_df.index)
+    faltan = ids.isna().to_numpy()
+    if not faltan.any():
+        return filas_df
+    inicio = max(0 if pd.isna(maximo) else int(maximo), int(ids.max()) if (~faltan).any() else 0) + 1
+    ids = ids.to_numpy(dtype=float, copy=True)
+    ids[faltan] = range(inicio, inicio + int(faltan.sum()))
+    filas_df = filas_df.copy()
+    filas_df[columna] = ids.astype('int64')
+    return filas_df
+
+
+def filas_para_sqlite(df):
+    """Convierte fechas a texto ISO y NaN a None para insertarlas con sqlite3"""
+    df = df.copy()
+    df['site_id'] = df['site_id'].astype(str)
+    if 'fecha' in df.columns:
+        df['fecha'] = df['fecha'].astype(object).where(df['fecha'].notna(), None).map(
+            lambda f: f.isoformat(sep=' ') if hasattr(f, 'isoformat') else f)
+    return df.astype(object).where(df.notna(), None)
+
+
+def conectar_sqlite(ruta):
+    """Abre una conexión SQLite en modo WAL"""
+    con = sqlite3.connect(ruta, timeout=30)
+    con.execute('PRAGMA journal_mode=WAL')
+    con.execute('PRAGMA synchronous=NORMAL')
+    return con
+
+
+def crear_esquema(con):
+    """Crea las tablas, índices por site_id y la tabla meta si no existen"""
+    with con:
+        for clave, (tabla, columnas) in ESQUEMA_SQLITE.items():
+            definicion = ', '.join(f'{nombre} {tipo}' for nombre, tipo in columnas)
+            con.execute(f'CREATE TABLE IF NOT EXISTS {tabla} ({definicion})')
+            if clave not in ('sites', 'results'):
+                con.execute(f'CREATE INDEX IF NOT EXISTS idx_{tabla}_site_id ON {tabla} (site_id)')
+        con.execute('CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor INTEGER)')
+        con.execute("INSERT OR IGNORE INTO meta VALUES ('revision', 0)")
+        con.execute(f"INSERT OR IGNORE INTO meta VALUES ('modificado', {AHORA_MS_SQL})")
+
+
+def cargar_ids_temporales(con, nombre, site_ids):
+    """Llena una tabla temporal de site_id (para filtrar con IN sin pasar miles de parámetros)"""
+    con.execute(f'CREATE TEMP TABLE IF NOT EXISTS {nombre} (site_id TEXT PRIMARY KEY)')
+    con.execute(f'DELETE FROM {nombre}')
+    con.executemany(f'INSERT OR IGNORE INTO {nombre} VALUES (?)', ((str(s),) for s in site_ids))
+
+
+def huella_sqlite(con):
+    """Revisión y hora de la última escritura: la revisión vuelve a empezar en una base nueva, la hora no se repite"""
+    filas = dict(con.execute("SELECT clave, valor FROM meta WHERE clave IN ('revision', 'modificado')").fetchall())
+    return f"{filas.get('revision', 0)}-{filas.get('modificado', 0)}"
+
+
+def incrementar_revision(con):
+    """Marca un cambio de datos (debe llamarse dentro de la transacción de escritura)"""
+    con.execute("UPDATE meta SET valor = valor + 1 WHERE clave = 'revision'")
+    # Milisegundos epoch de la escritura (Last-Modified y huella de contenido)
+    con.execute(f"INSERT OR REPLACE INTO meta VALUES ('modificado', {AHORA_MS_SQL})")
+
+
+def importar_excel(ruta_excel, ruta_sqlite):
+    """
+    Importa de una vez el libro Excel (hojas 1-sites … 5-results_ehi) a SQLite.
+    Reemplaza el contenido previo de las tablas en una sola transacción.
+    """
+    return escribir_sqlite(leer_libro(ruta_excel, HOJAS, COLUMNAS_EXCEL), ruta_sqlite)
+
+
+def escribir_sqlite(datos, ruta_sqlite):
+    """
+    Escribe un diccionario de DataFrames con las columnas del Excel (claves sites,
+    biodiversity, trophic, vsi, results) en SQLite, reemplazando el contenido previo.
+    Devuelve el número de filas escritas por tabla.
+    """
+    con = conectar_sqlite(ruta_sqlite)
+    crear_esquema(con)
+
+    totales = {}
+    with con:
+        for clave, (tabla, columnas) in ESQUEMA_SQLITE.items():
+            nombres = [nombre for nombre, _ in columnas]
+            df = datos.get(clave, pd.DataFrame(columns=nombres)).reindex(columns=nombres)
+            filas = filas_para_sqlite(df)
+
+            con.execute(f'DELETE FROM {tabla}')
+            con.executemany(f'INSERT INTO {tabla} ({", ".join(nombres)}) VALUES ({", ".join("?" * len(nombres))})',
+                            filas.itertuples(index=False, name=None))
+            totales[tabla] = len(df)
+        incrementar_revision(con)
+    con.close()
+    return totales
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Herramientas de almacenamiento de EcoBalance')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    importar = sub.add_parser('importar', help='Importa el libro Excel a una base SQLite')
+    importar.add_argument('excel', help='Ruta del .xlsx de origen')
+    importar.add_argument('sqlite', help='Ruta de la base SQLite de destino')
+    args = parser.parse_args()
+
+    for tabla, total in importar_excel(args.excel, args.sqlite).items():
+        print(f"{tabla}: {total} filas importadas")
@@ -0,0 +1,46 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheRespuestas:
+    """
+    Caché LRU acotada con caducidad (TTL) para respuestas ya generadas.
+    Las claves incluyen la versión de datos, así que una recarga deja las
+    entradas viejas sin uso y la LRU las va desalojando.
+    """
+
+    def __init__(self, max_entradas=512, ttl=300):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def obtener(self, clave):
+        """Valor guardado para la clave, o None si no existe o ya caducó"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or time.monotonic() - entrada[0] > self.ttl:
+                if entrada is not None:
+                    del self._entradas[clave]
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic(), valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
@@ -0,0 +1,153 @@
+"""
+Cálculo de muchos sitios en una sola petición.
+Los sitios se eligen por lista de site_id o por filtro (tipo de ecosistema,
+rectángulo y categoría del último EHI guardado). Las tablas se reparten en
+bloques con una sola pasada (recalculo.fragmentar) y cada bloque se calcula
+con calcular_lote; los registros salen a medida que termina cada bloque. Un
+sitio que no existe o que falla se informa en su propia línea, sin cortar el
+resto del lote.
+"""
+import numpy as np
+import pandas as pd
+
+from models.resultado import ETIQUETAS
+from services.recalculo import calcular_fragmento, fragmentar
+
+MAX_SITIOS = 5000
+SITIOS_POR_BLOQUE = 500
+CLAVES_FILTRO = ('ecosistema', 'rectangulo', 'categoria')
+
+
+class ErrorCalculoMasivo(ValueError):
+    """Pedido de cálculo masivo inválido (filtro mal formado o demasiados sitios)"""
+
+
+def seleccionar_sitios(datos, indice_espacial, site_ids=None, filtro=None, max_sitios=MAX_SITIOS):
+    """
+    Sitios a calcular. Con site_ids se respeta su orden (y el filtro, si hay,
+    se aplica sobre ellos); sin site_ids se toman todos los sitios que cumplen
+    el filtro. Devuelve (site_ids encontrados, site_ids pedidos que no existen).
+    """
+    if site_ids is None and not filtro:
+        raise ErrorCalculoMasivo('Indique site_ids o un filtro')
+    if site_ids is not None and not isinstance(site_ids, list):
+        raise ErrorCalculoMasivo('site_ids debe ser una lista')
+    if filtro is not None and not isinstance(filtro, dict):
+        raise ErrorCalculoMasivo('filtro debe ser un objeto')
+    desconocidas = sorted(set(filtro or {}) - set(CLAVES_FILTRO))
+    if desconocidas:
+        raise ErrorCalculoMasivo(f"Claves de filtro desconocidas: {', '.join(desconocidas)}. "
+                                 f"Disponibles: {', '.join(CLAVES_FILTRO)}")
+
+    sitios = datos['sites']
+    todos = pd.Index(sitios['site_id']).unique()
+    faltantes = []
+    if site_ids is None:
+        candidatos = todos
+    else:
+        if len(site_ids) > max_sitios:
+            raise ErrorCalculoMasivo(f'Se pidieron {len(site_ids)} sitios; el máximo por lote es {max_sitios}')
+        # Los site_id llegan como texto o número: se comparan como texto
+        por_texto = dict(zip(todos.astype(str), todos))
+        pedidos = list(dict.fromkeys(str(s) for s in site_ids))
+        candidatos = pd.Index([por_texto[s] for s in pedidos if s in por_texto], dtype=todos.dtype)
+        faltantes = [s for s in pedidos if s not in por_texto]
+
+    if filtro:
+        candidatos = candidatos[_mascara_filtro(datos, indice_espacial, candidatos, filtro)]
+
+    if len(candidatos) > max_sitios:
+        raise ErrorCalculoMasivo(f'El filtro selecciona {len(candidatos)} sitios; el máximo por lote es '
+                                 f'{max_sitios} (acote el filtro o pida por partes)')
+    return candidatos, faltantes
+
+
+def calcular_en_bloques(datos, site_ids, tamano=SITIOS_POR_BLOQUE):
+    """Generador de registros de resultado, un bloque de sitios a la vez"""
+    for fragmento in fragmentar(datos, site_ids, tamano):
+        if not len(fragmento['site_ids']):
+            continue
+        try:
+            yield from registros_lote(calcular_fragmento(fragmento))
+        except Exception:
+            # Se aísla el sitio que falla calculando el bloque sitio por sitio
+            yield from _calcular_uno_a_uno(fragmento)
+
+
+def registros_lote(lote):
+    """Diccionarios (uno por sitio) a partir de los arreglos de calcular_lote"""
+    columnas = {
+        'site_id': lote['site_id'].tolist(),
+        'BI': lote['BI'].tolist(),
+        'TFI': lote['TFI'].tolist(),
+        'VSI': lote['VSI'].tolist(),
+        'EHI': lote['EHI'].tolist(),
+        'categoria': ETIQUETAS[lote['categoria']].tolist(),
+        'categoria_bi': ETIQUETAS[lote['categoria_bi']].tolist(),
+        'categoria_tfi': ETIQUETAS[lote['categoria_tfi']].tolist(),
+        'categoria_vsi': ETIQUETAS[lote['categoria_vsi']].tolist()
+    }
+    nombres = list(columnas)
+    return [dict(zip(nombres, valores)) for valores in zip(*columnas.values())]
+
+
+def registro_error(site_id, mensaje):
+    return {'site_id': site_id, 'error': mensaje}
+
+
+def _calcular_uno_a_uno(fragmento):
+    for site_id in fragmento['site_ids']:
+        sitio = {'site_ids': pd.Index([site_id])}
+        for clave in ('biodiversity', 'trophic', 'vsi'):
+            df = fragmento[clave]
+            sitio[clave] = df[df['site_id'] == site_id] if 'site_id' in df.columns else df
+        try:
+            yield from registros_lote(calcular_fragmento(sitio))
+        except Exception as e:
+            print(f"Error calculando sitio {site_id}: {e}")
+            yield registro_error(site_id, str(e))
+
+
+def _mascara_filtro(datos, indice_espacial, candidatos, filtro):
+    """Máscara sobre candidatos de los sitios que cumplen todas las condiciones del filtro"""
+    mascara = np.ones(len(candidatos), dtype=bool)
+    sitios = datos['sites'].drop_duplicates('site_id').set_index('site_id')
+
+    if filtro.get('ecosistema') is not None:
+        tipos = _lista(filtro['ecosistema'])
+        ecosistema = sitios['ecosystem_type'].reindex(candidatos) if 'ecosystem_type' in sitios.columns else \
+            pd.Series(None, index=candidatos, dtype=object)
+        mascara &= ecosistema.isin(tipos).to_numpy()
+
+    if filtro.get('rectangulo') is not None:
+        sur, oeste, norte, este = _leer_rectangulo(filtro['rectangulo'])
+        dentro, _ = indice_espacial.en_rectangulo(sur, oeste, norte, este)
+        mascara &= candidatos.isin(dentro['site_id'])
+
+    if filtro.get('categoria') is not None:
+        categorias = _lista(filtro['categoria'])
+        resultados = datos['results']
+        if resultados is not None and not resultados.empty and 'categoria' in resultados.columns:
+            ultimas = resultados.drop_duplicates('site_id', keep='last').set_index('site_id')['categoria']
+            categoria = ultimas.reindex(candidatos).fillna('Sin datos')
+        else:
+            categoria = pd.Series('Sin datos', index=candidatos)
+        mascara &= categoria.isin(categorias).to_numpy()
+
+    return mascara
+
+
+def _lista(valor):
+    """Acepta un valor o una lista de valores"""
+    return [str(v) for v in valor] if isinstance(valor, list) else [str(valor)]
+
+
+def _leer_rectangulo(valor):
+    """[sur, oeste, norte, este] o {'sur':, 'oeste':, 'norte':, 'este':}"""
+    try:
+        if isinstance(valor, dict):
+            valor = [valor['sur'], valor['oeste'], valor['norte'], valor['este']]
+        sur, oeste, norte, este = (float(v) for v in valor)
+    except (KeyError, TypeError, ValueError):
+        raise ErrorCalculoMasivo('rectangulo debe ser [sur, oeste, norte, este] o un objeto con esas claves')
+    return sur, oeste, norte, este
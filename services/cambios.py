@@ -0,0 +1,176 @@
+"""
+Registro de cambios para la sincronización incremental del dashboard.
+Cada vez que aparece una versión de datos nueva se compara la huella de las
+filas de cada sitio (en sites y en results) con la de la versión anterior y
+cada alta, modificación o baja recibe un número de secuencia creciente. Da
+igual de dónde venga el cambio (recálculo, ingesta o alguien que edita el
+Excel): el cliente pide lo posterior a la última secuencia que vio y recibe
+solo esas filas.
+
+El registro vive en una base SQLite compartida por todos los procesos de la
+app: la época, la secuencia y las huellas de la última versión registrada son
+las mismas atienda quien atienda al cliente. Está acotado: si el cliente pide
+una secuencia que ya se descartó, o de otra época (se borró el registro), se
+le indica que haga una resincronización completa.
+"""
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from services.almacenamiento import conectar_sqlite
+from services.huellas import huellas_tabla
+
+TABLAS = ('sites', 'results')
+MAX_ENTRADAS = 100000
+MAX_VERSIONES = 1000
+
+
+class RegistroCambios:
+    """Altas, modificaciones y bajas por (tabla, site_id) con número de secuencia"""
+
+    def __init__(self, ruta, max_entradas=MAX_ENTRADAS):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._etiqueta = None  # Última versión de datos que este proceso ya comprobó
+        con = self._conexion()
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT)')
+            con.execute('CREATE TABLE IF NOT EXISTS cambios (seq INTEGER PRIMARY KEY, tabla TEXT NOT NULL, '
+                        'operacion TEXT NOT NULL, site_id TEXT NOT NULL)')
+            con.execute('CREATE TABLE IF NOT EXISTS huellas (tabla TEXT NOT NULL, site_id TEXT NOT NULL, '
+                        'huella INTEGER NOT NULL, PRIMARY KEY (tabla, site_id)) WITHOUT ROWID')
+            # Secuencia hasta la que llega cada versión de datos registrada (por su huella de contenido)
+            con.execute('CREATE TABLE IF NOT EXISTS versiones (etiqueta TEXT PRIMARY KEY, seq INTEGER NOT NULL)')
+            # La época solo cambia si se borra el registro (las secuencias vuelven a 0)
+            con.execute("INSERT OR IGNORE INTO meta VALUES ('epoca', ?)", (uuid.uuid4().hex[:8],))
+            con.execute("INSERT OR IGNORE INTO meta VALUES ('seq', '0')")
+
+    def _conexion(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = conectar_sqlite(self.ruta)
+            self._local.con = con
+        return con
+
+    def estado(self):
+        """(época, secuencia actual) del registro"""
+        meta = dict(self._conexion().execute("SELECT clave, valor FROM meta WHERE clave IN ('epoca', 'seq')"))
+        return meta['epoca'], int(meta['seq'])
+
+    def seq_de(self, etiqueta):
+        """Secuencia hasta la que llega la versión de datos con esa etiqueta (None si no se registró)"""
+        fila = self._conexion().execute('SELECT seq FROM versiones WHERE etiqueta = ?', (etiqueta,)).fetchone()
+        return None if fila is None else fila[0]
+
+    def sincronizar(self, instantanea):
+        """Registra las diferencias entre la última versión registrada (por cualquier proceso) y la instantánea"""
+        with self._lock:
+            if instantanea.etiqueta == self._etiqueta:
+                return
+            if self.seq_de(instantanea.etiqueta) is None:
+                huellas = {tabla: _huellas(instantanea.datos.get(tabla)) for tabla in TABLAS}
+                self._registrar(instantanea, huellas)
+            self._etiqueta = instantanea.etiqueta
+
+    def _registrar(self, instantanea, huellas):
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            if con.execute('SELECT 1 FROM versiones WHERE etiqueta = ?', (instantanea.etiqueta,)).fetchone():
+                return  # Otro proceso la registró mientras se calculaban las huellas
+            meta = dict(con.execute('SELECT clave, valor FROM meta'))
+            if 'modificado' in meta and instantanea.modificado < float(meta['modificado']):
+                return  # Este proceso aún no cargó la versión que ya está registrada
+
+            seq = int(meta['seq'])
+            for tabla in TABLAS:
+                actuales = huellas[tabla]
+                if 'etiqueta' not in meta:
+                    # Primera versión: solo es la base de las comparaciones
+                    _guardar_huellas(con, tabla, actuales)
+                    continue
+                for operacion, site_ids in _diferencias(_huellas_guardadas(con, tabla), actuales):
+                    con.executemany('INSERT INTO cambios VALUES (?, ?, ?, ?)',
+                                    ((seq + i, tabla, operacion, site_id) for i, site_id in enumerate(site_ids, 1)))
+                    seq += len(site_ids)
+                    if operacion == 'baja':
+                        con.executemany('DELETE FROM huellas WHERE tabla = ? AND site_id = ?',
+                                        ((tabla, site_id) for site_id in site_ids))
+                    else:
+                        _guardar_huellas(con, tabla, actuales[site_ids])
+
+            con.execute('DELETE FROM cambios WHERE seq <= ?', (seq - self.max_entradas,))
+            con.execute('INSERT INTO versiones VALUES (?, ?)', (instantanea.etiqueta, seq))
+            con.execute('DELETE FROM versiones WHERE rowid NOT IN '
+                        '(SELECT rowid FROM versiones ORDER BY rowid DESC LIMIT ?)', (MAX_VERSIONES,))
+            con.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                            [('seq', str(seq)), ('etiqueta', instantanea.etiqueta),
+                             ('modificado', repr(float(instantanea.modificado)))])
+
+    def consultar(self, desde, epoca=None, hasta=None):
+        """
+        (seq, cambios posteriores a `desde` y hasta `hasta`) compactados: por
+        (tabla, site_id) queda solo la última operación. `hasta` es la secuencia
+        de la versión de datos con la que se responde (por defecto, la última).
+        Devuelve None si el cliente debe resincronizar todo.
+        """
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN')
+            epoca_actual, seq_actual = self.estado()
+            primera = con.execute('SELECT MIN(seq) FROM cambios').fetchone()[0] or seq_actual + 1
+            if epoca != epoca_actual or desde > seq_actual or desde + 1 < primera:
+                return None
+            hasta = seq_actual if hasta is None else hasta
+            if hasta <= desde:
+                return desde, []
+            filas = con.execute('SELECT seq, tabla, operacion, site_id FROM cambios WHERE seq > ? AND seq <= ? '
+                                'ORDER BY seq', (desde, hasta)).fetchall()
+
+        ultimas = {}
+        for seq, tabla, operacion, site_id in filas:
+            # Reinsertar deja la clave al final, en el orden de su último cambio
+            ultimas.pop((tabla, site_id), None)
+            ultimas[(tabla, site_id)] = (seq, operacion)
+        return hasta, [{'seq': seq, 'tabla': tabla, 'operacion': operacion, 'site_id': site_id}
+                       for (tabla, site_id), (seq, operacion) in ultimas.items()]
+
+
+def _huellas(df):
+    """Serie site_id (texto) -> huella de todas sus filas en la tabla"""
+    if df is None or df.empty or 'site_id' not in df.columns:
+        return pd.Series(dtype=np.uint64)
+    site_ids = pd.Index(df['site_id']).unique()
+    return pd.Series(huellas_tabla(df, site_ids), index=site_ids.astype(str))
+
+
+def _huellas_guardadas(con, tabla):
+    """Huellas de la última versión registrada (SQLite guarda enteros con signo: se reinterpretan)"""
+    filas = con.execute('SELECT site_id, huella FROM huellas WHERE tabla = ?', (tabla,)).fetchall()
+    site_ids = [site_id for site_id, _ in filas]
+    huellas = np.array([huella for _, huella in filas], dtype=np.int64).view(np.uint64)
+    return pd.Series(huellas, index=pd.Index(site_ids, dtype=object))
+
+
+def _guardar_huellas(con, tabla, huellas):
+    valores = huellas.to_numpy(dtype=np.uint64).view(np.int64).tolist()
+    con.executemany('INSERT OR REPLACE INTO huellas VALUES (?, ?, ?)',
+                    zip([tabla] * len(valores), huellas.index.tolist(), valores))
+
+
+def _diferencias(anteriores, actuales):
+    """(operación, site_ids) de altas, modificaciones y bajas entre dos series de huellas"""
+    anteriores = anteriores[~anteriores.index.duplicated()]
+    actuales = actuales[~actuales.index.duplicated()]
+    comunes = actuales.index.intersection(anteriores.index)
+    cambiadas = comunes[actuales[comunes].to_numpy() != anteriores[comunes].to_numpy()]
+    return [
+        ('alta', actuales.index.difference(anteriores.index).tolist()),
+        ('modificacion', sorted(cambiadas.tolist())),
+        ('baja', anteriores.index.difference(actuales.index).tolist())
+    ]
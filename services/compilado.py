@@ -0,0 +1,161 @@
+"""
+Instantánea compilada de los datos transformados.
+Un solo archivo columnar que se abre con mmap: las columnas numéricas y de
+fecha se usan directamente desde el mapa (sin copiar, y todos los procesos
+que abren el mismo archivo comparten las páginas en memoria) y las de texto
+se guardan codificadas con diccionario y se abren como Categorical sobre
+los códigos mapeados, de modo que solo se decodifican los valores distintos.
+Las columnas que no son números, fechas ni texto no se compilan. La cabecera
+registra la huella de la fuente para saber si la instantánea sigue vigente.
+
+Formato: MAGIA, longitud de la cabecera (uint64), cabecera JSON y después
+los búferes de cada columna alineados a 64 bytes.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+MAGIA = b'ECOSNAP1'
+ALINEACION = 64
+
+
+def compilar(datos, ruta, fuente, huella):
+    """
+    Escribe los DataFrames de `datos` en `ruta` (reemplazo atómico).
+    fuente identifica el origen (tipo y ruta) y huella su contenido.
+    """
+    tablas = {}
+    buferes = []
+    desplazamiento = 0
+
+    def agregar(arreglo):
+        nonlocal desplazamiento
+        arreglo = np.ascontiguousarray(arreglo)
+        inicio = desplazamiento
+        buferes.append((inicio, arreglo))
+        desplazamiento = _alinear(inicio + arreglo.nbytes)
+        return {'inicio': inicio, 'dtype': arreglo.dtype.str, 'n': len(arreglo)}
+
+    for clave, df in datos.items():
+        columnas = []
+        for nombre in df.columns:
+            columnas.append({'nombre': nombre, **_codificar(df[nombre], agregar)})
+        tablas[clave] = {'filas': len(df), 'columnas': columnas}
+
+    cabecera = json.dumps({'fuente': fuente, 'huella': huella, 'tablas': tablas}).encode('utf-8')
+    inicio_datos = _alinear(len(MAGIA) + 8 + len(cabecera))
+
+    carpeta = os.path.dirname(os.path.abspath(ruta))
+    descriptor, temporal = tempfile.mkstemp(prefix='.compilado_', dir=carpeta)
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(MAGIA + struct.pack('<Q', len(cabecera)) + cabecera)
+            for inicio, arreglo in buferes:
+                f.seek(inicio_datos + inicio)
+                f.write(memoryview(arreglo).cast('B'))
+            f.truncate(inicio_datos + desplazamiento)
+        os.chmod(temporal, 0o644)  # mkstemp crea el archivo solo para su dueño
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+
+
+def leer_cabecera(ruta):
+    """Cabecera de la instantánea, o None si no existe o no es válida"""
+    leida = _leer_cabecera(ruta)
+    return None if leida is None else leida[0]
+
+
+def _leer_cabecera(ruta):
+    """(cabecera, posición donde empiezan los búferes)"""
+    try:
+        with open(ruta, 'rb') as f:
+            inicio = f.read(len(MAGIA) + 8)
+            if len(inicio) < len(MAGIA) + 8 or inicio[:len(MAGIA)] != MAGIA:
+                return None
+            (longitud,) = struct.unpack('<Q', inicio[len(MAGIA):])
+            cabecera = json.loads(f.read(longitud).decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    return cabecera, _alinear(len(MAGIA) + 8 + longitud)
+
+
+def abrir(ruta, fuente=None, huella=None):
+    """
+    Mapea la instantánea y devuelve el diccionario de DataFrames.
+    Si se indican fuente/huella y no coinciden con las de la cabecera, devuelve None.
+    """
+    leida = _leer_cabecera(ruta)
+    if leida is None:
+        return None
+    cabecera, inicio_datos = leida
+    if fuente is not None and (cabecera['fuente'] != fuente or cabecera['huella'] != huella):
+        return None
+
+    with open(ruta, 'rb') as f:
+        mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def bufer(descripcion):
+        # Los arreglos quedan en solo lectura y mantienen vivo el mapa
+        return np.frombuffer(mapa, dtype=np.dtype(descripcion['dtype']), count=descripcion['n'],
+                             offset=inicio_datos + descripcion['inicio'])
+
+    datos = {}
+    for clave, tabla in cabecera['tablas'].items():
+        columnas = {c['nombre']: _decodificar(c, bufer) for c in tabla['columnas']}
+        datos[clave] = pd.DataFrame(columnas, index=pd.RangeIndex(tabla['filas']), copy=False)
+    return datos
+
+
+def _codificar(serie, agregar):
+    """Describe una columna y agrega sus búferes; el tipo decide cómo se reconstruye"""
+    dtype = serie.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biuf':
+        return {'tipo': 'numero', 'valores': agregar(serie.to_numpy())}
+    if isinstance(dtype, np.dtype) and dtype.kind == 'M':
+        return {'tipo': 'fecha', 'dtype': dtype.str, 'valores': agregar(serie.to_numpy().view(np.int64))}
+
+    valores = serie.to_numpy(dtype=object)
+    nulos = pd.isna(valores)
+    if not all(isinstance(v, str) for v in valores[~nulos]):
+        raise ValueError(f"La columna {serie.name} mezcla tipos y no se puede compilar")
+
+    # Categorías ordenadas: ordenar la columna da el mismo orden que el texto
+    codigos, unicos = pd.factorize(valores, sort=True, use_na_sentinel=True)
+    # Los códigos se guardan con el tipo que usa Categorical para no copiarlos al abrir
+    codigos = pd.Categorical.from_codes(codigos, categories=unicos).codes
+    codificados = [u.encode('utf-8') for u in unicos]
+    posiciones = np.zeros(len(codificados) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in codificados], out=posiciones[1:])
+    return {'tipo': 'texto', 'dtype': str(dtype),
+            'codigos': agregar(codigos),
+            'posiciones': agregar(posiciones),
+            'bytes': agregar(np.frombuffer(b''.join(codificados), dtype=np.uint8))}
+
+
+def _decodificar(columna, bufer):
+    tipo = columna['tipo']
+    if tipo == 'numero':
+        return pd.Series(bufer(columna['valores']), copy=False)
+    if tipo == 'fecha':
+        return pd.Series(bufer(columna['valores']).view(np.dtype(columna['dtype'])), copy=False)
+    if tipo == 'texto':
+        posiciones = bufer(columna['posiciones']).tolist()
+        contenido = bufer(columna['bytes']).tobytes()
+        unicos = [contenido[a:b].decode('utf-8') for a, b in zip(posiciones, posiciones[1:])]
+        # Solo se decodifican las categorías; los códigos (-1 = nulo) se usan desde el mapa
+        categorias = pd.Index(unicos, dtype=columna['dtype'])
+        return pd.Series(pd.Categorical.from_codes(bufer(columna['codigos']), categories=categorias,
+                                                   validate=False), copy=False)
+    raise ValueError(f"Tipo de columna desconocido en la instantánea: {tipo}")
+
+
+def _alinear(n):
+    return -(-n // ALINEACION) * ALINEACION
@@ -0,0 +1,134 @@
+"""
+Coordinación de las escrituras de resultados.
+Las peticiones que quieren guardar resultados a la vez (varios recálculos,
+un doble clic en el panel) se agrupan: el primer hilo que consigue el turno
+escribe en una sola operación todo lo pendiente y los demás reciben ese
+mismo resultado. Entre procesos, los backends de archivo serializan la
+lectura-modificación-escritura con bloqueo_archivo.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def bloqueo_archivo(ruta):
+    """Bloqueo exclusivo entre procesos sobre un archivo auxiliar (se espera si otro lo tiene)"""
+    with open(ruta, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK se rinde tras 10 intentos; se sigue esperando
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class _Pedido:
+    __slots__ = ('resultados', 'site_ids_vigentes', 'forzar', 'listo', 'exito')
+
+    def __init__(self, resultados, site_ids_vigentes, forzar):
+        self.resultados = resultados
+        self.site_ids_vigentes = site_ids_vigentes
+        self.forzar = forzar
+        self.listo = False
+        self.exito = False
+
+
+class CoordinadorEscritura:
+    """
+    Une los pedidos de guardar resultados en una sola escritura (group commit).
+    `espera` es el tiempo que el escritor aguarda a que se sumen más pedidos
+    antes de escribir.
+    """
+
+    def __init__(self, obtener_almacenamiento, espera=0.05):
+        self._obtener_almacenamiento = obtener_almacenamiento
+        self.espera = espera
+        self._lock = threading.Lock()   # Protege la lista de pendientes
+        self._turno = threading.Lock()  # Un solo escritor a la vez
+        self._pendientes = []
+        self.pedidos = 0
+        self.escrituras = 0
+
+    def guardar_resultados(self, resultados_df, site_ids_vigentes=None, forzar=False):
+        """
+        Guarda (upsert por site_id) y devuelve True cuando los resultados ya están escritos.
+        Con forzar se escribe aunque los resultados solo difieran en la fecha.
+        """
+        pedido = _Pedido(resultados_df, site_ids_vigentes, forzar)
+        with self._lock:
+            self._pendientes.append(pedido)
+            self.pedidos += 1
+
+        with self._turno:
+            if not pedido.listo:
+                if self.espera:
+                    time.sleep(self.espera)
+                with self._lock:
+                    lote, self._pendientes = self._pendientes, []
+                exito = self._escribir(lote)
+                for otro in lote:
+                    otro.exito = exito
+                    otro.listo = True
+        return pedido.exito
+
+    def _escribir(self, lote):
+        # Si dos pedidos traen el mismo sitio gana el más reciente
+        resultados = pd.concat([p.resultados for p in lote], ignore_index=True)
+        resultados['site_id'] = resultados['site_id'].astype(str)
+        resultados = resultados.drop_duplicates('site_id', keep='last')
+        vigentes = next((p.site_ids_vigentes for p in reversed(lote) if p.site_ids_vigentes is not None), None)
+        forzar = any(p.forzar for p in lote)
+
+        self.escrituras += 1
+        return self._obtener_almacenamiento().guardar_resultados(resultados, vigentes, forzar)
+
+
+def sin_cambios(previos, combinados, ignorar=('fecha',)):
+    """True si los resultados combinados son los que ya estaban (sin contar la fecha del cálculo)"""
+    if len(previos) != len(combinados) or set(previos.columns) != set(combinados.columns):
+        return False
+    previos = previos.sort_values('site_id', kind='stable')
+    combinados = combinados.sort_values('site_id', kind='stable')
+    for columna in combinados.columns:
+        if columna in ignorar:
+            continue
+        a = previos[columna].to_numpy(dtype=object)
+        b = combinados[columna].to_numpy(dtype=object)
+        iguales = (a == b) | (pd.isna(a) & pd.isna(b))
+        if not iguales.all():
+            # El xlsx guarda ~16 cifras significativas: los índices releídos difieren en el último dígito
+            numeros_a = pd.to_numeric(previos[columna], errors='coerce').to_numpy(dtype=float)
+            numeros_b = pd.to_numeric(combinados[columna], errors='coerce').to_numpy(dtype=float)
+            if not (iguales | np.isclose(numeros_a, numeros_b, rtol=1e-12, atol=0.0)).all():
+                return False
+    return True
+
+
+def ruta_bloqueo(ruta):
+    """Archivo auxiliar de bloqueo junto al archivo de datos"""
+    carpeta, nombre = os.path.split(os.path.abspath(ruta))
+    return os.path.join(carpeta, f'.{nombre}.lock')
@@ -0,0 +1,170 @@
+import math
+import threading
+
+import numpy as np
+import pandas as pd
+
+from services.indice_sitios import limites_grupos
+
+CATEGORIAS_MAPA = ('Excelente', 'Bueno', 'Regular', 'Pobre', 'Crítico', 'Sin datos')
+COLUMNAS_SITIO = ['site_id', 'site_name', 'latitude', 'longitude', 'ecosystem_type']
+
+# Tamaño aproximado de un cluster en píxeles de tesela (las teselas miden 256 px)
+PIXELES_CLUSTER = 60
+ZOOM_MAXIMO = 20
+
+
+class IndiceEspacial:
+    """
+    Índice en rejilla sobre latitude/longitude de los sitios.
+    Los sitios se ordenan por celda y se guarda el rango de cada celda, de modo
+    que una consulta por rectángulo solo revisa las celdas que lo tocan. Los
+    clusters por nivel de zoom se calculan bajo demanda y se guardan por nivel.
+    """
+
+    def __init__(self, datos, tamano_celda=1.0):
+        self.tamano_celda = tamano_celda
+        sitios = datos['sites']
+        resultados = datos['results']
+
+        tabla = sitios.reindex(columns=COLUMNAS_SITIO).copy()
+        tabla['latitude'] = pd.to_numeric(tabla['latitude'], errors='coerce')
+        tabla['longitude'] = pd.to_numeric(tabla['longitude'], errors='coerce')
+        tabla = tabla[tabla['latitude'].between(-90, 90) & tabla['longitude'].between(-180, 180)]
+
+        # Último resultado guardado de cada sitio
+        if resultados is not None and not resultados.empty and 'EHI' in resultados.columns:
+            ultimos = resultados.drop_duplicates('site_id', keep='last').set_index('site_id')
+            tabla['EHI'] = ultimos['EHI'].reindex(tabla['site_id']).to_numpy(dtype=float)
+            tabla['categoria'] = ultimos['categoria'].reindex(tabla['site_id']).fillna('Sin datos').to_numpy()
+        else:
+            tabla['EHI'] = np.nan
+            tabla['categoria'] = 'Sin datos'
+        tabla.loc[~tabla['categoria'].isin(CATEGORIAS_MAPA), 'categoria'] = 'Sin datos'
+
+        celdas = _celdas_de(tabla['latitude'].to_numpy(), tabla['longitude'].to_numpy(), tamano_celda)
+        orden = np.argsort(celdas, kind='stable')
+        self.tabla = tabla.iloc[orden].reset_index(drop=True)
+        self._lat = self.tabla['latitude'].to_numpy()
+        self._lon = self.tabla['longitude'].to_numpy()
+        self._ehi = self.tabla['EHI'].to_numpy(dtype=float)
+        self._categoria = pd.Categorical(self.tabla['categoria'], categories=CATEGORIAS_MAPA).codes
+
+        inicios, fines, claves = limites_grupos(celdas[orden])
+        self._celdas = dict(zip(claves.tolist(), zip(inicios.tolist(), fines.tolist())))
+        self._clusters = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tabla)
+
+    def en_rectangulo(self, sur, oeste, norte, este, limite=None):
+        """Sitios dentro del rectángulo (admite rectángulos que cruzan el antimeridiano)"""
+        posiciones = np.concatenate([self._posiciones(*caja) for caja in _partir_rectangulo(sur, oeste, norte, este)])
+        total = len(posiciones)
+        if limite is not None:
+            posiciones = posiciones[:limite]
+        return self.tabla.iloc[np.sort(posiciones)], total
+
+    def clusters(self, zoom, sur=-90, oeste=-180, norte=90, este=180):
+        """
+        Clusters del nivel de zoom dentro del rectángulo: centroide, número de
+        sitios, conteo por categoría EHI y EHI medio de los sitios con resultado.
+        """
+        zoom = max(0, min(int(zoom), ZOOM_MAXIMO))
+        nivel = self._nivel(zoom)
+
+        mascara = np.zeros(len(nivel['lat']), dtype=bool)
+        for s, o, n, e in _partir_rectangulo(sur, oeste, norte, este):
+            mascara |= (nivel['lat'] >= s) & (nivel['lat'] <= n) & (nivel['lon'] >= o) & (nivel['lon'] <= e)
+
+        clusters = []
+        for i in np.flatnonzero(mascara):
+            con_ehi = int(nivel['con_ehi'][i])
+            clusters.append({
+                'lat': float(nivel['lat'][i]),
+                'lon': float(nivel['lon'][i]),
+                'n': int(nivel['n'][i]),
+                'categorias': {c: int(v) for c, v in zip(CATEGORIAS_MAPA, nivel['categorias'][i]) if v},
+                'ehi_promedio': float(nivel['suma_ehi'][i] / con_ehi) if con_ehi else None,
+                'n_con_ehi': con_ehi
+            })
+        return clusters
+
+    def _nivel(self, zoom):
+        """Agregados por celda para un zoom (celda ≈ PIXELES_CLUSTER px en pantalla)"""
+        nivel = self._clusters.get(zoom)
+        if nivel is not None:
+            return nivel
+
+        with self._lock:
+            if zoom not in self._clusters:
+                tamano = 360.0 / (2 ** zoom) * PIXELES_CLUSTER / 256.0
+                celdas = _celdas_de(self._lat, self._lon, tamano)
+                grupos, inversa = np.unique(celdas, return_inverse=True)
+                k = len(grupos)
+
+                n = np.bincount(inversa, minlength=k)
+                tiene_ehi = ~np.isnan(self._ehi)
+                categorias = np.zeros((k, len(CATEGORIAS_MAPA)), dtype=np.int64)
+                np.add.at(categorias, (inversa, self._categoria), 1)
+
+                self._clusters[zoom] = {
+                    'lat': np.bincount(inversa, weights=self._lat, minlength=k) / np.maximum(n, 1),
+                    'lon': np.bincount(inversa, weights=self._lon, minlength=k) / np.maximum(n, 1),
+                    'n': n,
+                    'categorias': categorias,
+                    'suma_ehi': np.bincount(inversa, weights=np.where(tiene_ehi, self._ehi, 0.0), minlength=k),
+                    'con_ehi': np.bincount(inversa, weights=tiene_ehi.astype(float), minlength=k)
+                }
+            return self._clusters[zoom]
+
+    def _posiciones(self, sur, oeste, norte, este):
+        """Posiciones de los sitios dentro de un rectángulo que no cruza el antimeridiano"""
+        t = self.tamano_celda
+        fila_min, fila_max = math.floor((sur + 90) / t), math.floor((norte + 90) / t)
+        col_min, col_max = math.floor((oeste + 180) / t), math.floor((este + 180) / t)
+        columnas = _columnas(t)
+
+        if (fila_max - fila_min + 1) * (col_max - col_min + 1) > len(self._celdas):
+            # Rectángulo grande: es más barato filtrar todos los puntos de una vez
+            return np.flatnonzero((self._lat >= sur) & (self._lat <= norte) &
+                                  (self._lon >= oeste) & (self._lon <= este))
+
+        rangos = []
+        for fila in range(fila_min, fila_max + 1):
+            for col in range(col_min, col_max + 1):
+                rango = self._celdas.get(fila * columnas + col)
+                if rango:
+                    rangos.append(rango)
+
+        if not rangos:
+            return np.empty(0, dtype=np.int64)
+        candidatos = np.concatenate([np.arange(i, f) for i, f in rangos])
+        lat, lon = self._lat[candidatos], self._lon[candidatos]
+        return candidatos[(lat >= sur) & (lat <= norte) & (lon >= oeste) & (lon <= este)]
+
+
+def _celdas_de(lat, lon, tamano):
+    """Clave entera de la celda (fila * columnas + columna) de cada punto"""
+    filas = np.floor((lat + 90) / tamano).astype(np.int64)
+    cols = np.floor((lon + 180) / tamano).astype(np.int64)
+    return filas * _columnas(tamano) + cols
+
+
+def _columnas(tamano):
+    return int(math.ceil(360.0 / tamano)) + 1
+
+
+def _partir_rectangulo(sur, oeste, norte, este):
+    """Normaliza el rectángulo y lo parte en dos si cruza el antimeridiano"""
+    sur, norte = max(-90.0, min(sur, norte)), min(90.0, max(sur, norte))
+    if este - oeste >= 360:
+        return [(sur, -180.0, norte, 180.0)]
+    if not -180 <= oeste <= 180:
+        oeste = ((oeste + 180) % 360) - 180
+    if not -180 <= este <= 180:
+        este = ((este + 180) % 360) - 180
+    if oeste <= este:
+        return [(sur, oeste, norte, este)]
+    return [(sur, oeste, norte, 180.0), (sur, -180.0, norte, este)]
@@ -0,0 +1,35 @@
+"""
+Caché de fragmentos de plantilla por sitio.
+Las filas del panel de administración, las tarjetas del dashboard y las
+tarjetas de componentes del detalle solo dependen del sitio y de la versión
+de datos: se renderizan una vez y las páginas siguientes las reutilizan.
+"""
+from markupsafe import Markup
+
+from services.cache_respuestas import CacheRespuestas
+
+
+class CacheFragmentos(CacheRespuestas):
+    """LRU con TTL de HTML ya renderizado, por (plantilla, clave, versión de datos)"""
+
+    def renderizar(self, entorno, plantilla, clave, version, contexto):
+        """
+        HTML del fragmento (Markup, no se vuelve a escapar). El contexto debe
+        depender solo de la clave y de la versión: si cambia otra cosa, la
+        clave tiene que incluirla.
+        """
+        completa = (plantilla, clave, version)
+        html = self.obtener(completa)
+        if html is None:
+            html = Markup(entorno.get_template(plantilla).render(**contexto))
+            self.guardar(completa, html)
+        return html
+
+
+def resultados_por_sitio(datos):
+    """Último resultado de cada sitio como diccionario {site_id: registro}"""
+    resultados = datos['results']
+    if resultados is None or resultados.empty or 'site_id' not in resultados.columns:
+        return {}
+    ultimos = resultados.drop_duplicates('site_id', keep='last')
+    return dict(zip(ultimos['site_id'], ultimos.to_dict('records')))
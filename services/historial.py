@@ -0,0 +1,183 @@
+import threading
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from services.almacenamiento import conectar_sqlite
+
+# Las categorías se guardan como un entero pequeño (posición en esta tupla)
+CATEGORIAS_EHI = ('Excelente', 'Bueno', 'Regular', 'Pobre', 'Crítico')
+INDICES = ('BI', 'TFI', 'VSI', 'EHI')
+
+
+class HistorialEHI:
+    """
+    Historial de resultados de solo inserción, particionado por mes.
+    Cada partición es una tabla historial_AAAAMM agrupada físicamente por
+    (site_id, ts, seq) (WITHOUT ROWID), así que una consulta por sitio y rango de
+    fechas solo lee las particiones del rango y, dentro de ellas, las filas del sitio.
+    La fecha de los resultados llega en segundos: seq (una secuencia global) es lo
+    que distingue dos recálculos del mismo sitio en el mismo segundo, que así no se pisan.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._particiones = None
+
+    def _conexion(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = conectar_sqlite(self.ruta)
+            self._local.con = con
+        return con
+
+    def particiones(self):
+        """Nombres de las tablas de partición existentes, ordenados por mes"""
+        if self._particiones is None:
+            filas = self._conexion().execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'historial_[0-9]*'").fetchall()
+            self._particiones = sorted(nombre for (nombre,) in filas)
+        return self._particiones
+
+    def _crear_particion(self, con, nombre):
+        columnas = [fila[1] for fila in con.execute(f'PRAGMA table_info({nombre})')]
+        if columnas and 'seq' not in columnas:
+            # Partición de antes de la secuencia: se conserva renombrándola y copiando sus filas
+            con.execute(f'ALTER TABLE {nombre} RENAME TO {nombre}_anterior')
+        con.execute(f'''CREATE TABLE IF NOT EXISTS {nombre} (
+            site_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            bi REAL, tfi REAL, vsi REAL, ehi REAL,
+            categoria INTEGER,
+            PRIMARY KEY (site_id, ts, seq)
+        ) WITHOUT ROWID''')
+        if columnas and 'seq' not in columnas:
+            con.execute(f'INSERT INTO {nombre} SELECT site_id, ts, 0, bi, tfi, vsi, ehi, categoria '
+                        f'FROM {nombre}_anterior')
+            con.execute(f'DROP TABLE {nombre}_anterior')
+
+    def _reservar_secuencia(self, con, n):
+        """Primer número de un bloque de n secuencias (dentro de una transacción de escritura)"""
+        con.execute('CREATE TABLE IF NOT EXISTS secuencia (valor INTEGER NOT NULL)')
+        fila = con.execute('SELECT valor FROM secuencia').fetchone()
+        if fila is None:
+            con.execute('INSERT INTO secuencia VALUES (?)', (n,))
+            return 1
+        con.execute('UPDATE secuencia SET valor = ?', (fila[0] + n,))
+        return fila[0] + 1
+
+    def agregar(self, resultados_df):
+        """Añade al historial las filas de resultados (usa su columna fecha como marca de tiempo)"""
+        if resultados_df is None or resultados_df.empty:
+            return 0
+
+        fechas = pd.to_datetime(resultados_df['fecha'], errors='coerce').fillna(pd.Timestamp.now())
+        ts = (fechas.astype('datetime64[s]').astype('int64')).to_numpy()
+        particion = fechas.dt.strftime('historial_%Y%m').to_numpy()
+        codigos = resultados_df['categoria'].map({c: i for i, c in enumerate(CATEGORIAS_EHI)})
+
+        filas = pd.DataFrame({
+            'particion': particion,
+            'site_id': resultados_df['site_id'].astype(str).to_numpy(),
+            'ts': ts,
+            'bi': resultados_df['BI'].astype(float).to_numpy(),
+            'tfi': resultados_df['TFI'].astype(float).to_numpy(),
+            'vsi': resultados_df['VSI'].astype(float).to_numpy(),
+            'ehi': resultados_df['EHI'].astype(float).to_numpy(),
+            'categoria': codigos.astype(object).where(codigos.notna(), None).to_numpy()
+        })
+
+        with self._lock:
+            con = self._conexion()
+            with con:
+                # BEGIN IMMEDIATE: dos procesos no pueden reservar el mismo bloque de secuencias
+                con.execute('BEGIN IMMEDIATE')
+                primera = self._reservar_secuencia(con, len(filas))
+                filas.insert(3, 'seq', range(primera, primera + len(filas)))
+                for nombre, grupo in filas.groupby('particion', sort=True):
+                    self._crear_particion(con, nombre)
+                    con.executemany(
+                        f'INSERT INTO {nombre} (site_id, ts, seq, bi, tfi, vsi, ehi, categoria) '
+                        f'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        grupo.drop(columns='particion').astype(object).itertuples(index=False, name=None))
+            self._particiones = None
+        return len(filas)
+
+    def consultar(self, site_id, desde, hasta, puntos=None):
+        """
+        Serie de un sitio entre dos marcas de tiempo (segundos epoch, inclusive).
+        Con puntos se agrupa en ese número de intervalos y se devuelve min/max/media
+        de cada índice por intervalo; la agregación la hace SQLite sobre el índice
+        (site_id, ts), sin traer las filas crudas.
+        """
+        seleccion = [p for p in self.particiones()
+                     if _particion(desde) <= p <= _particion(hasta)]
+        if not seleccion:
+            return []
+
+        con = self._conexion()
+        if not puntos:
+            filas = []
+            for nombre in seleccion:
+                filas.extend(con.execute(
+                    f'SELECT ts, bi, tfi, vsi, ehi, categoria FROM {nombre} '
+                    f'WHERE site_id = ? AND ts BETWEEN ? AND ? ORDER BY ts, seq',
+                    (str(site_id), desde, hasta)).fetchall())
+            return [{
+                'fecha': _iso(ts),
+                'BI': bi, 'TFI': tfi, 'VSI': vsi, 'EHI': ehi,
+                'categoria': CATEGORIAS_EHI[cat] if cat is not None else None
+            } for ts, bi, tfi, vsi, ehi, cat in filas]
+
+        ancho = max(hasta - desde + 1, 1)
+        agregados = ', '.join(f'AVG({c}), MIN({c}), MAX({c})' for c in ('bi', 'tfi', 'vsi', 'ehi'))
+        cubetas = {}
+        for nombre in seleccion:
+            consulta = (f'SELECT ((ts - ?) * ?) / ? AS cubeta, COUNT(*), MIN(ts), MAX(ts), {agregados} '
+                        f'FROM {nombre} WHERE site_id = ? AND ts BETWEEN ? AND ? GROUP BY cubeta')
+            for fila in con.execute(consulta, (desde, int(puntos), ancho, str(site_id), desde, hasta)):
+                _combinar_cubeta(cubetas, fila)
+
+        serie = []
+        for cubeta in sorted(cubetas):
+            n, ts_min, ts_max, valores = cubetas[cubeta]
+            punto = {'desde': _iso(ts_min), 'hasta': _iso(ts_max), 'n': n}
+            for i, indice in enumerate(INDICES):
+                suma, minimo, maximo = valores[i]
+                punto[indice] = {'media': suma / n if suma is not None else None, 'min': minimo, 'max': maximo}
+            serie.append(punto)
+        return serie
+
+
+def _combinar_cubeta(cubetas, fila):
+    """Acumula una cubeta de una partición (una cubeta puede abarcar dos meses)"""
+    cubeta, n, ts_min, ts_max = fila[:4]
+    valores = []
+    for i in range(len(INDICES)):
+        media, minimo, maximo = fila[4 + 3 * i: 7 + 3 * i]
+        valores.append((media * n if media is not None else None, minimo, maximo))
+
+    if cubeta not in cubetas:
+        cubetas[cubeta] = (n, ts_min, ts_max, valores)
+        return
+
+    n0, ts_min0, ts_max0, valores0 = cubetas[cubeta]
+    combinados = []
+    for (s0, mn0, mx0), (s1, mn1, mx1) in zip(valores0, valores):
+        combinados.append((
+            None if s0 is None and s1 is None else (s0 or 0) + (s1 or 0),
+            min(v for v in (mn0, mn1) if v is not None) if (mn0 is not None or mn1 is not None) else None,
+            max(v for v in (mx0, mx1) if v is not None) if (mx0 is not None or mx1 is not None) else None
+        ))
+    cubetas[cubeta] = (n0 + n, min(ts_min0, ts_min), max(ts_max0, ts_max), combinados)
+
+
+def _particion(ts):
+    return datetime.fromtimestamp(max(ts, 0), timezone.utc).strftime('historial_%Y%m')
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
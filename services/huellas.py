@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+# Cambiar este valor invalida todas las huellas guardadas (p. ej. si cambian las fórmulas)
+VERSION_HUELLA = 2
+
+# Columnas de cada tabla que entran en el cálculo: ids y fecha no cambian el resultado
+COLUMNAS_ENTRADA = {
+    'biodiversity': ['abundance'],
+    'trophic': ['connectance_observed', 'connectance_expected', 'length_observed', 'length_expected'],
+    'vsi': ['coverage_pct', 'soil_quality_pct']
+}
+TABLAS_ENTRADA = tuple(COLUMNAS_ENTRADA)
+
+# Decimales con que se comparan los valores (la misma lectura como entero o real da la misma huella)
+DECIMALES = 9
+
+_PHI = np.uint64(0x9E3779B97F4A7C15)
+
+
+def huellas_sitios(datos, site_ids):
+    """
+    Huella de contenido de cada sitio sobre sus filas de biodiversidad, tróficas y VSI.
+    Solo cuentan las columnas que usa el cálculo (COLUMNAS_ENTRADA), convertidas
+    a reales redondeados: una fila nueva de otro sitio, ids vacíos o un cambio de
+    tipo de la columna no cambian la huella. Dos ejecuciones con las mismas
+    lecturas (en el mismo orden) dan la misma huella. Devuelve un arreglo de
+    cadenas hexadecimales alineado con site_ids.
+    """
+    site_ids = pd.Index(site_ids)
+    n = len(site_ids)
+    huella = np.full(n, np.uint64(VERSION_HUELLA), dtype=np.uint64)
+
+    with np.errstate(over='ignore'):
+        for numero, nombre in enumerate(TABLAS_ENTRADA, start=1):
+            parcial = _huella_tabla(datos.get(nombre), site_ids, COLUMNAS_ENTRADA[nombre])
+            huella = _mezclar(huella * np.uint64(31) + _mezclar(parcial + np.uint64(numero)))
+
+    return np.array([format(int(h), '016x') for h in huella], dtype=object)
+
+
+def huellas_tabla(df, site_ids, columnas=None):
+    """Huella (uint64) de las filas de cada sitio en una sola tabla; 0 si el sitio no tiene filas"""
+    return _huella_tabla(df, pd.Index(site_ids), columnas)
+
+
+def _huella_tabla(df, site_ids, columnas=None):
+    """
+    Suma (módulo 2^64) de los hashes de fila de cada sitio, ponderados por su posición.
+    Con columnas solo se usan esas (sin columnas, todas salvo site_id).
+    """
+    n = len(site_ids)
+    resultado = np.zeros(n, dtype=np.uint64)
+    if df is None or df.empty or 'site_id' not in df.columns:
+        return resultado
+
+    codigos = site_ids.get_indexer(df['site_id'])
+    filas = pd.util.hash_pandas_object(_normalizar(df, columnas), index=False).to_numpy(dtype=np.uint64)
+
+    validas = np.flatnonzero(codigos >= 0)
+    if not len(validas):
+        return resultado
+
+    # Orden estable: dentro de cada sitio se respeta el orden original de las filas
+    orden = validas[np.argsort(codigos[validas], kind='stable')]
+    codigos = codigos[orden]
+    filas = filas[orden]
+
+    inicios = np.concatenate(([0], np.flatnonzero(codigos[1:] != codigos[:-1]) + 1))
+    tamanos = np.diff(np.concatenate((inicios, [len(codigos)])))
+    posicion = np.arange(len(codigos)) - np.repeat(inicios, tamanos)
+
+    with np.errstate(over='ignore'):
+        mezcla = _mezclar(filas + posicion.astype(np.uint64) * _PHI)
+    resultado[codigos[inicios]] = np.add.reduceat(mezcla, inicios)
+    return resultado
+
+
+def _normalizar(df, columnas=None):
+    """
+    Columnas con tipos fijos para que el hash no dependa de cómo se leyó la tabla:
+    los números como reales redondeados (NaN si faltan) y el resto como texto.
+    """
+    if columnas is None:
+        columnas = [c for c in df.columns if c != 'site_id']
+    normalizadas = {}
+    for nombre in columnas:
+        if nombre not in df.columns:
+            normalizadas[nombre] = np.full(len(df), np.nan)
+            continue
+        serie = df[nombre]
+        if pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+            # + 0.0 convierte -0.0 en 0.0
+            normalizadas[nombre] = np.round(pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float), DECIMALES) + 0.0
+        else:
+            normalizadas[nombre] = serie.astype(object).where(serie.notna(), '').astype(str).to_numpy(dtype=object)
+    return pd.DataFrame(normalizadas, index=df.index)
+
+
+def _mezclar(x):
+    """Finalizador splitmix64 sobre arreglos uint64 (el desbordamiento es intencional)"""
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
@@ -0,0 +1,94 @@
+"""
+Incertidumbre de los índices por Monte Carlo para todos los sitios.
+Los sitios se reparten en fragmentos entre un ProcessPoolExecutor y cada
+proceso simula el suyo con models.incertidumbre. Los fragmentos son múltiplos
+de SITIOS_POR_BLOQUE y cada uno sabe en qué bloque empieza, así con la misma
+semilla el resultado no depende del número de procesos.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from models.incertidumbre import CATEGORIAS_EHI, INDICES, SITIOS_POR_BLOQUE, nueva_semilla, simular_incertidumbre
+from services.recalculo import fragmentar
+
+MUESTRAS_POR_DEFECTO = 1000
+MAX_MUESTRAS = 100_000       # Tope para una petición de un solo sitio
+BLOQUES_POR_FRAGMENTO = 4
+
+
+def simular_todos(datos, muestras=MUESTRAS_POR_DEFECTO, semilla=None, nivel=0.95, procesos=None,
+                  bloques_por_fragmento=BLOQUES_POR_FRAGMENTO):
+    """Simula todos los sitios de `datos` repartidos entre procesos; mismo formato que simular_incertidumbre"""
+    site_ids = pd.Index(datos['sites']['site_id']).unique()
+    tamano = bloques_por_fragmento * SITIOS_POR_BLOQUE
+    fragmentos = fragmentar(datos, site_ids, tamano)
+    if semilla is None:
+        # Una sola semilla para todos los fragmentos, para poder repetir la corrida
+        semilla = nueva_semilla()
+    tareas = [(fragmento, muestras, semilla, nivel, i * bloques_por_fragmento)
+              for i, fragmento in enumerate(fragmentos)]
+
+    procesos = procesos or os.cpu_count() or 1
+    if len(tareas) > 1 and procesos > 1:
+        with ProcessPoolExecutor(max_workers=min(procesos, len(tareas))) as executor:
+            partes = list(executor.map(simular_fragmento, tareas))
+    else:
+        partes = [simular_fragmento(tarea) for tarea in tareas]
+    return unir(partes)
+
+
+def simular_fragmento(tarea):
+    """Simula un fragmento (función de módulo para poder ejecutarla en otro proceso)"""
+    fragmento, muestras, semilla, nivel, bloque_inicial = tarea
+    return simular_incertidumbre(fragmento['biodiversity'], fragmento['trophic'], fragmento['vsi'],
+                                 fragmento['site_ids'], muestras=muestras, semilla=semilla,
+                                 nivel=nivel, bloque_inicial=bloque_inicial)
+
+
+def unir(partes):
+    """Concatena los resultados de varios fragmentos en el orden recibido"""
+    primera = partes[0]
+    resultado = {clave: primera[clave] for clave in ('muestras', 'nivel', 'semilla')}
+    resultado['site_id'] = np.concatenate([p['site_id'] for p in partes])
+    for indice in INDICES:
+        resultado[indice] = {clave: np.concatenate([p[indice][clave] for p in partes])
+                             for clave in primera[indice]}
+    resultado['probabilidades'] = np.concatenate([p['probabilidades'] for p in partes])
+    return resultado
+
+
+def resumen_sitio(resultado, posicion=0, decimales=4):
+    """Diccionario de un sitio: media, desviación e intervalo de cada índice y probabilidad por categoría"""
+    resumen = {
+        'site_id': resultado['site_id'][posicion],
+        'muestras': resultado['muestras'],
+        'nivel': resultado['nivel'],
+        'semilla': resultado['semilla']
+    }
+    for indice in INDICES:
+        valores = resultado[indice]
+        resumen[indice] = {
+            'media': round(float(valores['media'][posicion]), decimales),
+            'desviacion': round(float(valores['desviacion'][posicion]), decimales),
+            'intervalo': [round(float(valores['inferior'][posicion]), decimales),
+                          round(float(valores['superior'][posicion]), decimales)]
+        }
+    resumen['probabilidad_categoria'] = {
+        etiqueta: round(float(p), decimales)
+        for etiqueta, p in zip(CATEGORIAS_EHI, resultado['probabilidades'][posicion])
+    }
+    return resumen
+
+
+def a_dataframe(resultado):
+    """Una fila por sitio: <índice>_media/_desviacion/_inferior/_superior y p_<categoría>"""
+    columnas = {'site_id': resultado['site_id']}
+    for indice in INDICES:
+        for clave, valores in resultado[indice].items():
+            columnas[f'{indice}_{clave}'] = valores
+    for codigo, etiqueta in enumerate(CATEGORIAS_EHI):
+        columnas[f'p_{etiqueta}'] = resultado['probabilidades'][:, codigo]
+    return pd.DataFrame(columnas)
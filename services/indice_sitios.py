@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+# Columnas de cada tabla transformada (las de una tabla que falta, para devolverla vacía)
+COLUMNAS_TABLAS = {
+    'sites': ['site_id', 'site_name', 'latitude', 'longitude', 'location', 'ecosystem_type'],
+    'biodiversity': ['site_id', 'data_id', 'fecha', 'species', 'abundance'],
+    'trophic': ['site_id', 'trophic_id', 'fecha', 'connectance_observed', 'connectance_expected',
+                'length_observed', 'length_expected'],
+    'vsi': ['site_id', 'vsi_id', 'fecha', 'coverage_pct', 'soil_quality_pct'],
+    'results': ['site_id', 'fecha', 'BI', 'TFI', 'VSI', 'EHI', 'categoria']
+}
+
+
+class IndiceSitios:
+    """
+    Índice por site_id sobre las tablas transformadas.
+    Cada tabla se ordena una vez (orden estable, se conserva el orden original
+    de las filas de cada sitio) y se guarda el rango [inicio, fin) de cada sitio,
+    de modo que buscar las filas de un sitio es O(1) en lugar de un filtro por columna.
+    """
+
+    TABLAS = ('sites', 'biodiversity', 'trophic', 'vsi', 'results')
+
+    def __init__(self, datos):
+        self._ordenadas = {}
+        self._rangos = {}
+
+        for nombre in self.TABLAS:
+            df = datos.get(nombre)
+            if df is None or 'site_id' not in df.columns:
+                continue
+
+            ordenado = df.sort_values('site_id', kind='mergesort').reset_index(drop=True)
+            inicios, fines, claves = limites_grupos(ordenado['site_id'].to_numpy())
+
+            self._ordenadas[nombre] = ordenado
+            self._rangos[nombre] = dict(zip(claves.tolist(), zip(inicios.tolist(), fines.tolist())))
+
+    def tabla(self, nombre):
+        """Tabla completa ordenada por site_id (None si no existe)"""
+        return self._ordenadas.get(nombre)
+
+    def rangos(self, nombre):
+        """Diccionario site_id -> (inicio, fin) de la tabla ordenada"""
+        return self._rangos.get(nombre, {})
+
+    def filas(self, nombre, site_id):
+        """Filas de un sitio en la tabla indicada (DataFrame vacío si no hay o si falta la tabla)"""
+        ordenado = self._ordenadas.get(nombre)
+        if ordenado is None:
+            return pd.DataFrame(columns=COLUMNAS_TABLAS.get(nombre, ['site_id']))
+        inicio, fin = self._rangos[nombre].get(site_id, (0, 0))
+        return ordenado.iloc[inicio:fin]
+
+    def primera(self, nombre, site_id):
+        """Primera fila de un sitio como diccionario ({} si no hay)"""
+        filas = self.filas(nombre, site_id)
+        if filas.empty:
+            return {}
+        return filas.iloc[0].to_dict()
+
+    def ultima(self, nombre, site_id):
+        """Última fila de un sitio como diccionario ({} si no hay); en trophic y vsi, la medición más reciente"""
+        filas = self.filas(nombre, site_id)
+        if filas.empty:
+            return {}
+        return filas.iloc[-1].to_dict()
+
+
+def limites_grupos(claves):
+    """Devuelve (inicios, fines, claves únicas) de los grupos contiguos de un arreglo ordenado"""
+    n = len(claves)
+    if n == 0:
+        vacio = np.empty(0, dtype=np.int64)
+        return vacio, vacio, claves[:0]
+    cambios = np.flatnonzero(claves[1:] != claves[:-1]) + 1
+    inicios = np.concatenate(([0], cambios))
+    fines = np.concatenate((cambios, [n]))
+    return inicios, fines, claves[inicios]
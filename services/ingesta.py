@@ -0,0 +1,243 @@
+import io
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+
+from services import metricas
+from services.almacenamiento import HOJAS
+
+# Columnas que transformar_datos espera en cada hoja de observaciones
+COLUMNAS_INGESTA = {
+    'biodiversity': {
+        'requeridas': ['site_id', 'especie_nombre', 'abundancia'],
+        'opcionales': ['data_id', 'fecha'],
+        'numericas': ['abundancia']
+    },
+    'trophic': {
+        'requeridas': ['site_id', 'conn_obs', 'conn_exp', 'len_obs', 'len_exp'],
+        'opcionales': ['trophic_id', 'fecha'],
+        'numericas': ['conn_obs', 'conn_exp', 'len_obs', 'len_exp']
+    },
+    'vsi': {
+        'requeridas': ['site_id', 'cobertura_pct', 'calidad_suelo_pct'],
+        'opcionales': ['vsi_id', 'fecha'],
+        'numericas': ['cobertura_pct', 'calidad_suelo_pct']
+    }
+}
+
+MAX_ERRORES_REPORTADOS = 20
+MAX_REINTENTOS = 5         # Intentos de escritura de un lote antes de apartarlo
+MAX_ESPERA_REINTENTO = 60  # Segundos máximos entre reintentos (la espera se duplica en cada fallo)
+MAX_FALLIDOS = 100         # Lotes fallidos que se recuerdan para consultarlos
+
+
+class ErrorIngesta(ValueError):
+    """Lote rechazado completo (formato o columnas inválidas)"""
+
+
+def resolver_tabla(nombre):
+    """Acepta la clave interna ('biodiversity') o el nombre de la hoja ('2-biodiversity_data')"""
+    if nombre in COLUMNAS_INGESTA:
+        return nombre
+    for clave, hoja in HOJAS.items():
+        if hoja == nombre and clave in COLUMNAS_INGESTA:
+            return clave
+    raise ErrorIngesta(f"Tabla desconocida: {nombre}. Use una de: "
+                       f"{', '.join(HOJAS[c] for c in COLUMNAS_INGESTA)}")
+
+
+def parsear_lote(cuerpo, tipo_contenido):
+    """Convierte un cuerpo NDJSON o CSV en un DataFrame"""
+    if not cuerpo:
+        raise ErrorIngesta('El lote está vacío')
+
+    tipo = (tipo_contenido or '').split(';')[0].strip().lower()
+    try:
+        if tipo in ('text/csv', 'application/csv'):
+            return pd.read_csv(io.BytesIO(cuerpo), dtype={'site_id': str})
+        if tipo in ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/json-lines'):
+            return pd.read_json(io.BytesIO(cuerpo), lines=True, dtype={'site_id': str})
+    except ValueError as e:
+        raise ErrorIngesta(f'No se pudo leer el lote: {e}')
+
+    raise ErrorIngesta('Content-Type no soportado: use application/x-ndjson o text/csv')
+
+
+def validar_lote(clave, df):
+    """
+    Valida las columnas y los valores de un lote.
+    Devuelve (filas_validas, errores); las filas inválidas se descartan una a una
+    para que un registro malo no tumbe todo el lote.
+    """
+    esquema = COLUMNAS_INGESTA[clave]
+    faltantes = [c for c in esquema['requeridas'] if c not in df.columns]
+    if faltantes:
+        raise ErrorIngesta(f"Faltan columnas requeridas: {', '.join(faltantes)}")
+    desconocidas = [c for c in df.columns if c not in esquema['requeridas'] + esquema['opcionales']]
+    if desconocidas:
+        raise ErrorIngesta(f"Columnas no reconocidas: {', '.join(map(str, desconocidas))}")
+
+    df = df.copy()
+    invalidas = df['site_id'].isna() | (df['site_id'].astype(str).str.strip() == '')
+    motivos = pd.Series('', index=df.index)
+    motivos[invalidas] = 'site_id vacío'
+
+    for columna in esquema['numericas']:
+        valores = pd.to_numeric(df[columna], errors='coerce')
+        malas = valores.isna() & ~invalidas
+        motivos[malas] = f'{columna} no numérico'
+        invalidas |= malas
+        df[columna] = valores
+
+    # Sin fecha, la lectura es de ahora (la más reciente de su sitio)
+    ahora = pd.Timestamp.now().floor('s')
+    if 'fecha' in df.columns:
+        fechas = pd.to_datetime(df['fecha'], errors='coerce', format='mixed')
+        malas = fechas.isna() & df['fecha'].notna() & ~invalidas
+        motivos[malas] = 'fecha inválida'
+        invalidas |= malas
+        df['fecha'] = fechas.fillna(ahora)
+    else:
+        df['fecha'] = ahora
+    df['site_id'] = df['site_id'].astype(str).str.strip()
+
+    errores = [{'fila': int(i), 'error': motivos[i]} for i in df.index[invalidas][:MAX_ERRORES_REPORTADOS]]
+    return df[~invalidas].reset_index(drop=True), errores
+
+
+class ColaIngesta:
+    """
+    Cola acotada de filas aceptadas que se escriben al almacenamiento por lotes
+    en un hilo de fondo (write-behind). Si la cola está llena, encolar devuelve
+    False y la API responde 429 para que el cliente reintente más tarde.
+    Un lote que no se puede escribir se reintenta con espera creciente; tras
+    max_reintentos fallos se aparta a un CSV en la carpeta de fallidos (se puede
+    volver a enviar tal cual a la API) y deja de ocupar la cola, así que una
+    escritura rota no bloquea la ingesta de las demás filas.
+    """
+
+    def __init__(self, obtener_almacenamiento, max_filas=200000, tamano_lote=50000, intervalo=1.0,
+                 max_reintentos=MAX_REINTENTOS, obtener_carpeta_fallidos=None):
+        self._obtener_almacenamiento = obtener_almacenamiento
+        self._obtener_carpeta_fallidos = obtener_carpeta_fallidos  # Función que devuelve la carpeta (o None)
+        self.max_filas = max_filas
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.max_reintentos = max_reintentos
+        self._pendientes = {clave: deque() for clave in COLUMNAS_INGESTA}
+        self._intentos = {clave: 0 for clave in COLUMNAS_INGESTA}
+        self._reintentar_en = {clave: 0.0 for clave in COLUMNAS_INGESTA}
+        self._filas = 0
+        self._condicion = threading.Condition()
+        self._escritura = threading.Lock()  # Un solo escritor a la vez (hilo de fondo o vaciar)
+        self._hilo = None
+        self.escritas = 0
+        self.errores_escritura = 0
+        self.filas_fallidas = 0
+        self.fallidos = deque(maxlen=MAX_FALLIDOS)  # Últimos lotes apartados (más reciente al final)
+
+    @property
+    def pendientes(self):
+        return self._filas
+
+    def encolar(self, clave, df):
+        """Añade un lote validado; devuelve False si no cabe (contrapresión)"""
+        with self._condicion:
+            if self._filas + len(df) > self.max_filas:
+                return False
+            self._pendientes[clave].append(df)
+            self._filas += len(df)
+            self._iniciar_hilo()
+            if self._filas >= self.tamano_lote:
+                self._condicion.notify()
+        return True
+
+    def vaciar(self):
+        """Escribe ahora todo lo pendiente sin esperar a los reintentos (útil al apagar o en pruebas)"""
+        while self._escribir_lote(esperar=False):
+            pass
+
+    def _iniciar_hilo(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._bucle, name='ingesta-escritura', daemon=True)
+            self._hilo.start()
+
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                # Se espera a juntar un lote completo o a que pase el intervalo
+                if self._filas < self.tamano_lote:
+                    self._condicion.wait(self.intervalo)
+            if not self._escribir_lote():
+                time.sleep(self.intervalo)
+
+    def _escribir_lote(self, esperar=True):
+        """Escribe todo lo pendiente de una tabla; devuelve True si escribió algo"""
+        with self._escritura:
+            with self._condicion:
+                ahora = time.monotonic()
+                clave = next((c for c, cola in self._pendientes.items()
+                              if cola and (not esperar or self._reintentar_en[c] <= ahora)), None)
+                if clave is None:
+                    return False
+                partes = list(self._pendientes[clave])
+                self._pendientes[clave].clear()
+
+            lote = pd.concat(partes, ignore_index=True)
+            try:
+                with metricas.fase('persistencia'):
+                    self._obtener_almacenamiento().agregar_filas(clave, lote)
+            except Exception as e:
+                print(f"Error escribiendo lote de ingesta ({clave}): {e}")
+                self.errores_escritura += 1
+                self._intentos[clave] += 1
+                if self._intentos[clave] < self.max_reintentos:
+                    espera = min(self.intervalo * 2 ** self._intentos[clave], MAX_ESPERA_REINTENTO)
+                    with self._condicion:
+                        # Se devuelve a la cola para reintentarlo cuando pase la espera
+                        self._pendientes[clave].appendleft(lote)
+                        self._reintentar_en[clave] = time.monotonic() + espera
+                    return False
+                self._apartar(clave, lote, e)
+                return False
+
+            with self._condicion:
+                self._filas -= len(lote)
+                self.escritas += len(lote)
+                self._intentos[clave] = 0
+                self._reintentar_en[clave] = 0.0
+            return True
+
+    def _apartar(self, clave, lote, error):
+        """Saca de la cola un lote que agotó los reintentos y lo guarda en la carpeta de fallidos"""
+        archivo = None
+        carpeta = self._obtener_carpeta_fallidos() if self._obtener_carpeta_fallidos is not None else None
+        if carpeta is not None:
+            try:
+                os.makedirs(carpeta, exist_ok=True)
+                archivo = os.path.join(carpeta, f"{HOJAS[clave]}_{datetime.now():%Y%m%d_%H%M%S}_"
+                                                f"{uuid.uuid4().hex[:6]}.csv")
+                lote.to_csv(archivo, index=False)
+            except OSError as e:
+                print(f"No se pudo guardar el lote fallido de ingesta ({clave}): {e}")
+                archivo = None
+        print(f"Lote de ingesta ({clave}, {len(lote)} filas) apartado tras {self._intentos[clave]} intentos"
+              + (f": {archivo}" if archivo else ' (se descartó)'))
+
+        with self._condicion:
+            self._filas -= len(lote)
+            self.filas_fallidas += len(lote)
+            self._intentos[clave] = 0
+            self._reintentar_en[clave] = 0.0
+            self.fallidos.append({
+                'tabla': clave,
+                'filas': len(lote),
+                'error': str(error),
+                'archivo': archivo,
+                'fecha': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            })
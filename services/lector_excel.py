@@ -0,0 +1,112 @@
+"""
+Lectura por flujo de libros Excel grandes.
+pd.read_excel construye el modelo completo del libro en openpyxl y varias
+copias en pandas antes de devolver los DataFrames. Aquí cada hoja se recorre
+en modo de solo lectura, se toman solo las columnas pedidas y las filas se
+convierten por bloques a columnas tipadas, así la memoria máxima queda en un
+múltiplo pequeño del tamaño final de los datos.
+"""
+from operator import itemgetter
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+FILAS_POR_BLOQUE = 10000
+
+
+def leer_libro(ruta, hojas, columnas=None, tamano_bloque=FILAS_POR_BLOQUE):
+    """
+    Lee varias hojas abriendo el libro una sola vez.
+    hojas es {clave: nombre de hoja} y columnas {clave: [columnas]}: las columnas
+    que no estén en la hoja se omiten y sin entrada para una clave se leen todas.
+    Las hojas que no existen se omiten del resultado. Los tipos son los de
+    pd.read_excel salvo en dos casos: las filas vacías se saltan (read_excel las
+    deja como filas de NaN) y las columnas sin nombre en la cabecera no se leen.
+    """
+    columnas = columnas or {}
+    libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        return {clave: _leer_hoja(libro[hoja], columnas.get(clave), tamano_bloque)
+                for clave, hoja in hojas.items() if hoja in libro.sheetnames}
+    finally:
+        libro.close()
+
+
+def leer_hoja(ruta, hoja, columnas=None, tamano_bloque=FILAS_POR_BLOQUE):
+    """Una sola hoja; ValueError si no existe (igual que pd.read_excel)"""
+    datos = leer_libro(ruta, {hoja: hoja}, {hoja: columnas}, tamano_bloque)
+    if hoja not in datos:
+        raise ValueError(f"Worksheet named '{hoja}' not found")
+    return datos[hoja]
+
+
+def _leer_hoja(hoja, columnas, tamano_bloque):
+    filas = hoja.iter_rows(values_only=True)
+    cabecera = next(filas, None)
+    if cabecera is None:
+        return pd.DataFrame(columns=columnas or [])
+
+    # Posición de cada columna elegida, en el orden de la hoja
+    seleccion = [(nombre, i) for i, nombre in enumerate(cabecera)
+                 if nombre is not None and (columnas is None or nombre in columnas)]
+    if not seleccion:
+        return pd.DataFrame()
+    nombres = [nombre for nombre, _ in seleccion]
+    posiciones = [i for _, i in seleccion]
+    ancho = max(posiciones) + 1
+    tomar = itemgetter(*posiciones) if len(posiciones) > 1 else lambda fila: (fila[posiciones[0]],)
+
+    partes = {nombre: [] for nombre in nombres}
+    bloque = []
+    for fila in filas:
+        if len(fila) < ancho:
+            # Los libros sin dimensiones correctas entregan filas más cortas
+            fila = fila + (None,) * (ancho - len(fila))
+        valores = tomar(fila)
+        if all(v is None for v in valores):
+            continue
+        bloque.append(valores)
+        if len(bloque) >= tamano_bloque:
+            _convertir(bloque, nombres, partes)
+            bloque = []
+    _convertir(bloque, nombres, partes)
+
+    # Se une columna por columna soltando los bloques a medida que se copian
+    datos = {}
+    for nombre in nombres:
+        trozos = partes.pop(nombre)
+        if not trozos:
+            datos[nombre] = pd.Series(dtype=object)
+            continue
+        columna = pd.concat(trozos, ignore_index=True)
+        if len(trozos) > 1 and columna.dtype == object:
+            # Bloques de tipos distintos (fechas y un bloque solo de vacíos, p. ej.) se unen
+            # como objetos: se vuelve a inferir el tipo como si fuera un solo bloque
+            columna = columna.infer_objects()
+        del trozos
+        datos[nombre] = _numerica(columna)
+    return pd.DataFrame(datos)
+
+
+def _numerica(columna):
+    """
+    Como pd.read_excel, convierte a número las columnas de texto que son todas
+    números; en las que mezclan tipos las celdas vacías quedan como NaN (no None)
+    """
+    if not pd.api.types.is_string_dtype(columna) and columna.dtype != object:
+        return columna
+    try:
+        return pd.to_numeric(columna)
+    except (TypeError, ValueError):
+        if columna.dtype == object:
+            return columna.where(columna.notna(), np.nan)
+        return columna
+
+
+def _convertir(bloque, nombres, partes):
+    """Traspone un bloque de filas y convierte cada columna a un arreglo tipado"""
+    if not bloque:
+        return
+    for nombre, valores in zip(nombres, zip(*bloque)):
+        partes[nombre].append(pd.Series(valores))
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+from models.resultado import codificar
+
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+FORMATOS = ('json', 'ndjson', 'compacto')
+COLUMNAS_CATEGORIA = ('categoria',)  # Se envían como códigos de la tabla de categorías
+COLUMNAS_INTERNAS = ['huella']        # Columnas de resultados que no salen en los listados
+FILAS_POR_BLOQUE = 1000  # Filas que se convierten a la vez al transmitir NDJSON
+
+
+class ErrorListado(ValueError):
+    """Parámetros de paginación o de campos inválidos"""
+
+
+class ListadoSitios:
+    """
+    Sitios unidos con su último resultado, ordenados por site_id.
+    Se construye una vez por versión de datos; cada página es un corte por
+    búsqueda binaria a partir del cursor (el último site_id devuelto), sin
+    volver a unir ni ordenar las tablas en cada petición.
+    """
+
+    def __init__(self, datos):
+        sitios = datos['sites']
+        resultados = datos['results']
+
+        if resultados is not None and not resultados.empty and 'site_id' in resultados.columns:
+            # La huella es interna del recálculo incremental: no se publica en los listados
+            ultimos = resultados.drop_duplicates('site_id', keep='last').drop(columns=COLUMNAS_INTERNAS, errors='ignore')
+            tabla = pd.merge(sitios, ultimos, on='site_id', how='left', suffixes=('', '_resultado'))
+        else:
+            tabla = sitios.copy()
+
+        self.tabla = tabla.sort_values('site_id', kind='mergesort').reset_index(drop=True)
+        self._claves = self.tabla['site_id'].to_numpy(dtype=str)
+        self.columnas = list(self.tabla.columns)
+
+    def __len__(self):
+        return len(self.tabla)
+
+    def pagina(self, cursor=None, limite=None, site_ids=None):
+        """
+        Filas con site_id mayor que el cursor (como mucho `limite`; None = todas).
+        Con site_ids solo se consideran esos sitios. Devuelve (filas, siguiente_cursor);
+        siguiente_cursor es None cuando no quedan más filas.
+        """
+        inicio = int(np.searchsorted(self._claves, str(cursor), side='right')) if cursor else 0
+
+        if site_ids is None:
+            posiciones = np.arange(inicio, len(self._claves))
+        else:
+            buscados = np.unique(np.asarray([str(s) for s in site_ids], dtype=str))
+            izquierda = np.searchsorted(self._claves, buscados, side='left')
+            derecha = np.searchsorted(self._claves, buscados, side='right')
+            # Rangos [izquierda, derecha) de cada sitio pedido, ya en orden de site_id
+            posiciones = np.concatenate([np.arange(i, d) for i, d in zip(izquierda, derecha) if d > i] or
+                                        [np.empty(0, dtype=np.int64)])
+            posiciones = posiciones[posiciones >= inicio]
+
+        siguiente = None
+        if limite is not None and len(posiciones) > limite:
+            # La página no corta un sitio a la mitad (el cursor saltaría sus filas restantes)
+            ultimo = self._claves[posiciones[limite - 1]]
+            fin = limite + int(np.searchsorted(self._claves[posiciones[limite:]], ultimo, side='right'))
+            if fin < len(posiciones):
+                siguiente = str(ultimo)
+            posiciones = posiciones[:fin]
+
+        return self.tabla.iloc[posiciones], siguiente
+
+    def validar_campos(self, campos):
+        """Lista de columnas pedidas (None = todas); error si alguna no existe"""
+        if not campos:
+            return None
+        desconocidos = [c for c in campos if c not in self.columnas]
+        if desconocidos:
+            raise ErrorListado(f"Campos desconocidos: {', '.join(desconocidos)}. "
+                               f"Disponibles: {', '.join(self.columnas)}")
+        return list(dict.fromkeys(campos))
+
+
+def leer_campos(valor):
+    """Acepta 'a,b,c' o una lista ['a', 'b', 'c']"""
+    if not valor:
+        return None
+    if isinstance(valor, str):
+        valor = valor.split(',')
+    return [str(c).strip() for c in valor if str(c).strip()]
+
+
+def leer_limite(valor, formato='json'):
+    """
+    Tamaño de página. En JSON y compacto se aplica un valor por defecto y un máximo; en NDJSON
+    la respuesta se transmite por bloques, así que sin limite se devuelve todo.
+    """
+    if formato not in FORMATOS:
+        raise ErrorListado(f"formato debe ser uno de: {', '.join(FORMATOS)}")
+    if valor in (None, ''):
+        return None if formato == 'ndjson' else LIMITE_POR_DEFECTO
+    try:
+        limite = int(valor)
+    except (TypeError, ValueError):
+        raise ErrorListado('limite debe ser un entero')
+    if limite < 1:
+        raise ErrorListado('limite debe ser mayor que 0')
+    return limite if formato == 'ndjson' else min(limite, LIMITE_MAXIMO)
+
+
+def registros(filas, campos=None):
+    """Convierte filas a diccionarios (NaN como None) para serializarlas a JSON"""
+    if campos:
+        filas = filas[campos]
+    return filas.astype(object).where(filas.notna(), None).to_dict('records')
+
+
+def columnas_compactas(filas, campos=None):
+    """
+    Formato compacto: un arreglo por columna en lugar de un objeto por sitio.
+    Las categorías van como códigos (-1 = sin resultado) y NaN como None.
+    """
+    if campos:
+        filas = filas[campos]
+    columnas = {}
+    for nombre in filas.columns:
+        serie = filas[nombre]
+        if nombre in COLUMNAS_CATEGORIA:
+            columnas[nombre] = codificar(serie.to_numpy()).tolist()
+        else:
+            columnas[nombre] = serie.astype(object).where(serie.notna(), None).tolist()
+    return columnas
+
+
+def registros_en_bloques(filas, campos=None, tamano=FILAS_POR_BLOQUE):
+    """Generador de registros que convierte las filas por bloques (memoria constante)"""
+    for inicio in range(0, len(filas), tamano):
+        yield from registros(filas.iloc[inicio:inicio + tamano], campos)
@@ -0,0 +1,201 @@
+"""
+Métricas internas de EcoBalance en formato de texto de Prometheus.
+Cada petición acumula el tiempo de sus fases (carga, transformar, calculo,
+persistencia, render) y al terminar se registra en histogramas por ruta.
+Las fases que ocurren fuera de una petición (recálculos en segundo plano,
+escrituras de ingesta) se registran con la ruta "(segundo_plano)".
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites de los histogramas de duración, en segundos
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RUTA_FONDO = '(segundo_plano)'
+
+
+def _etiquetas(nombres, valores, extra=''):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    """Contador monótono con etiquetas"""
+
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *valores, n=1):
+        with self._lock:
+            self._series[valores] = self._series.get(valores, 0) + n
+
+    def exportar(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f'{self.nombre}{_etiquetas(self.etiquetas, valores)} {_numero(total)}'
+                for valores, total in series]
+
+
+class Histograma:
+    """Histograma acumulativo con límites fijos, como los de Prometheus"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.limites = tuple(limites)
+        self._series = {}   # valores de etiquetas -> [conteos por límite, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, *valores, valor):
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * len(self.limites), 0.0, 0]
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self):
+        with self._lock:
+            series = sorted((v, (list(c), s, t)) for v, (c, s, t) in self._series.items())
+        lineas = []
+        for valores, (conteos, suma, total) in series:
+            acumulado = 0
+            for limite, conteo in zip(self.limites, conteos):
+                acumulado += conteo
+                le = 'le="%s"' % limite
+                lineas.append(f'{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}')
+            le = 'le="+Inf"'
+            lineas.append(f'{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {total}')
+            lineas.append(f'{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {total}')
+        return lineas
+
+
+class RegistroMetricas:
+    """
+    Conjunto de métricas del proceso. Además de contadores e histogramas admite
+    colectores: funciones que se llaman al exportar y devuelven valores que ya
+    lleva otro objeto (aciertos de la caché, filas pendientes de ingesta…).
+    """
+
+    def __init__(self):
+        self._metricas = []
+        self._colectores = []
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        metrica = Histograma(nombre, ayuda, etiquetas, limites)
+        self._metricas.append(metrica)
+        return metrica
+
+    def colector(self, nombre, tipo, ayuda, funcion):
+        """funcion() devuelve una lista de (diccionario de etiquetas, valor)"""
+        self._colectores.append((nombre, tipo, ayuda, funcion))
+
+    def exportar(self):
+        lineas = []
+        for metrica in self._metricas:
+            lineas.append(f'# HELP {metrica.nombre} {metrica.ayuda}')
+            lineas.append(f'# TYPE {metrica.nombre} {metrica.tipo}')
+            lineas.extend(metrica.exportar())
+        for nombre, tipo, ayuda, funcion in self._colectores:
+            try:
+                valores = funcion()
+            except Exception as e:
+                print(f"Error en el colector de métricas {nombre}: {e}")
+                continue
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for etiquetas, valor in valores:
+                lineas.append(f'{nombre}{_etiquetas(etiquetas.keys(), etiquetas.values())} {_numero(valor)}')
+        return '\n'.join(lineas) + '\n'
+
+
+registro = RegistroMetricas()
+
+DURACION_PETICION = registro.histograma(
+    'ecobalance_peticion_segundos', 'Duración total de cada petición', ('ruta', 'metodo', 'estado'))
+DURACION_FASE = registro.histograma(
+    'ecobalance_fase_segundos', 'Duración de cada fase (carga, transformar, calculo, persistencia, render, otros)',
+    ('ruta', 'fase'))
+RECARGAS_DATOS = registro.contador(
+    'ecobalance_recargas_datos_total', 'Veces que se recargaron los datos desde el almacenamiento')
+SITIOS_RECALCULADOS = registro.contador(
+    'ecobalance_sitios_recalculados_total', 'Sitios recalculados por los trabajos de recálculo')
+SITIOS_OMITIDOS = registro.contador(
+    'ecobalance_sitios_omitidos_total', 'Sitios que un recálculo omitió porque sus datos no cambiaron')
+
+_local = threading.local()
+
+
+def iniciar_peticion():
+    """Empieza a acumular fases para la petición del hilo actual"""
+    _local.fases = {}
+    _local.inicio = time.perf_counter()
+
+
+def terminar_peticion(ruta, metodo, estado):
+    """Registra la duración total y la de cada fase; lo no medido cuenta como 'otros'"""
+    fases = getattr(_local, 'fases', None)
+    if fases is None:
+        return None
+    duracion = time.perf_counter() - _local.inicio
+    _local.fases = None
+
+    DURACION_PETICION.observar(ruta, metodo, str(estado), valor=duracion)
+    for nombre, segundos in fases.items():
+        DURACION_FASE.observar(ruta, nombre, valor=segundos)
+    DURACION_FASE.observar(ruta, 'otros', valor=max(duracion - sum(fases.values()), 0.0))
+    return duracion
+
+
+def descartar_peticion():
+    _local.fases = None
+
+
+def sumar_fase(nombre, segundos):
+    """Suma tiempo a una fase de la petición actual (o lo registra como segundo plano)"""
+    fases = getattr(_local, 'fases', None)
+    if fases is None:
+        DURACION_FASE.observar(RUTA_FONDO, nombre, valor=segundos)
+    else:
+        fases[nombre] = fases.get(nombre, 0.0) + segundos
+
+
+@contextmanager
+def fase(nombre):
+    """Mide el bloque como parte de la fase indicada"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        sumar_fase(nombre, time.perf_counter() - inicio)
@@ -0,0 +1,74 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+
+class PerfiladorMuestreo:
+    """
+    Perfilador por muestreo de las peticiones en curso.
+    Un hilo toma cada `intervalo` segundos la pila de cada hilo que está atendiendo
+    una petición (sys._current_frames) y cuenta las pilas vistas. Si la petición
+    tarda más que el umbral, se vuelcan las pilas en formato "colapsado"
+    (funcion;funcion;funcion muestras), el que leen flamegraph.pl y speedscope.
+    """
+
+    def __init__(self, carpeta, umbral, intervalo=0.005, max_perfiles=200):
+        self.carpeta = carpeta
+        self.umbral = umbral
+        self.intervalo = intervalo
+        self.max_perfiles = max_perfiles
+        self._activas = {}   # id de hilo -> Counter de pilas
+        self._lock = threading.Lock()
+        self._hilo = None
+        self.volcados = 0
+
+    def iniciar(self):
+        """Empieza a muestrear el hilo actual"""
+        with self._lock:
+            self._activas[threading.get_ident()] = Counter()
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._muestrear, name='perfilador', daemon=True)
+                self._hilo.start()
+
+    def terminar(self, duracion, descripcion):
+        """Deja de muestrear el hilo actual y vuelca el perfil si la petición fue lenta"""
+        with self._lock:
+            muestras = self._activas.pop(threading.get_ident(), None)
+        if not muestras or duracion < self.umbral or self.volcados >= self.max_perfiles:
+            return None
+
+        os.makedirs(self.carpeta, exist_ok=True)
+        nombre = f"perfil_{datetime.now():%Y%m%d_%H%M%S_%f}_{int(duracion * 1000)}ms.txt"
+        ruta = os.path.join(self.carpeta, nombre)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(f"# {descripcion} {duracion * 1000:.1f} ms, {sum(muestras.values())} muestras "
+                    f"cada {self.intervalo * 1000:g} ms\n")
+            for pila, veces in muestras.most_common():
+                f.write(f"{';'.join(pila)} {veces}\n")
+        self.volcados += 1
+        return ruta
+
+    def _muestrear(self):
+        while True:
+            time.sleep(self.intervalo)
+            with self._lock:
+                if not self._activas:
+                    continue
+                marcos = sys._current_frames()
+                for hilo, muestras in self._activas.items():
+                    marco = marcos.get(hilo)
+                    if marco is not None:
+                        muestras[_pila(marco)] += 1
+
+
+def _pila(marco):
+    """Pila desde la raíz como tupla de 'archivo:funcion:linea'"""
+    pila = []
+    while marco is not None:
+        codigo = marco.f_code
+        pila.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}:{marco.f_lineno}")
+        marco = marco.f_back
+    return tuple(reversed(pila))
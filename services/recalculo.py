@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from models.lote import calcular_lote
+from models.resultado import ETIQUETAS
+from services.huellas import COLUMNAS_ENTRADA, huellas_sitios
+
+COLUMNAS_RESULTADOS = ['site_id', 'fecha', 'BI', 'TFI', 'VSI', 'EHI', 'categoria', 'huella']
+
+# Columnas que necesita calcular_lote de cada tabla (lo único que viaja a los procesos)
+COLUMNAS_CALCULO = {clave: ['site_id'] + columnas for clave, columnas in COLUMNAS_ENTRADA.items()}
+
+
+def recalcular_sitios(datos, forzar=False):
+    """
+    Recalcula solo los sitios cuyas filas de entrada cambiaron desde el último cálculo.
+    Compara la huella actual de cada sitio con la guardada en los resultados; con
+    forzar=True se recalculan todos. Devuelve un diccionario con las filas nuevas
+    (para guardarlas como upsert) y los conteos de recalculados/omitidos.
+    """
+    cambios = detectar_cambios(datos, forzar)
+    lote = calcular_lote(datos['biodiversity'], datos['trophic'], datos['vsi'], cambios['ids_sucios'])
+    return resumir(cambios, [lote])
+
+
+def detectar_cambios(datos, forzar=False):
+    """Huellas actuales de todos los sitios y máscara de los que hay que recalcular"""
+    site_ids = pd.Index(datos['sites']['site_id'])
+    huellas = huellas_sitios(datos, site_ids)
+    previos = datos['results']
+
+    sucios = np.ones(len(site_ids), dtype=bool)
+    if not forzar and previos is not None and 'huella' in previos.columns and not previos.empty:
+        guardadas = previos.drop_duplicates('site_id', keep='last').set_index('site_id')['huella']
+        sucios = guardadas.reindex(site_ids).to_numpy(dtype=object) != huellas
+
+    previos_ids = set(previos['site_id']) if previos is not None and 'site_id' in previos.columns else set()
+    return {
+        'site_ids': site_ids,
+        'ids_sucios': site_ids[sucios],
+        'huellas_sucias': huellas[sucios],
+        'recalculados': int(sucios.sum()),
+        'omitidos': int((~sucios).sum()),
+        # Cambió el conjunto de sitios: hay que borrar resultados aunque no se recalcule nada
+        'sitios_cambiaron': previos_ids != set(site_ids)
+    }
+
+
+def fragmentar(datos, ids_sucios, tamano):
+    """
+    Reparte los sitios a recalcular en fragmentos de como mucho `tamano` sitios.
+    Cada fragmento lleva solo las filas y columnas de sus sitios, separadas en una
+    única pasada por tabla (sin filtrar la tabla completa una vez por fragmento).
+    """
+    ids_sucios = pd.Index(ids_sucios)
+    numero = max(1, -(-len(ids_sucios) // tamano))
+    fragmentos = [{'site_ids': ids_sucios[i * tamano:(i + 1) * tamano]} for i in range(numero)]
+
+    for clave, columnas in COLUMNAS_CALCULO.items():
+        df = datos[clave]
+        df = df[[c for c in columnas if c in df.columns]]
+        posicion = ids_sucios.get_indexer(df['site_id']) if len(df) else np.empty(0, dtype=np.intp)
+        fragmento_fila = np.where(posicion >= 0, posicion // tamano, -1)
+        partes = dict(tuple(df.groupby(fragmento_fila, sort=False))) if len(df) else {}
+        for i, fragmento in enumerate(fragmentos):
+            fragmento[clave] = partes.get(i, df.iloc[0:0])
+
+    return fragmentos
+
+
+def calcular_fragmento(fragmento):
+    """Calcula un fragmento (función de módulo para poder ejecutarla en otro proceso)"""
+    return calcular_lote(fragmento['biodiversity'], fragmento['trophic'], fragmento['vsi'], fragmento['site_ids'])
+
+
+def resumir(cambios, lotes):
+    """Une los lotes calculados en la tabla de resultados nuevos y arma el resumen"""
+    fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    partes = [pd.DataFrame({
+        'site_id': lote['site_id'],
+        'BI': lote['BI'],
+        'TFI': lote['TFI'],
+        'VSI': lote['VSI'],
+        'EHI': lote['EHI'],
+        'categoria': ETIQUETAS[lote['categoria']]
+    }) for lote in lotes if len(lote['site_id'])]
+
+    nuevos = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(columns=COLUMNAS_RESULTADOS)
+    nuevos['fecha'] = fecha
+    huellas = pd.Series(cambios['huellas_sucias'], index=cambios['ids_sucios'])
+    huellas = huellas[~huellas.index.duplicated()]
+    nuevos['huella'] = huellas.reindex(nuevos['site_id']).to_numpy() if len(nuevos) else []
+    nuevos = nuevos[COLUMNAS_RESULTADOS]
+
+    return {
+        'nuevos': nuevos,
+        'recalculados': cambios['recalculados'],
+        'omitidos': cambios['omitidos'],
+        # Hay que escribir si algo se recalculó o si cambió el conjunto de sitios
+        'requiere_guardar': bool(len(nuevos)) or cambios['sitios_cambiaron']
+    }
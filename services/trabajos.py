@@ -0,0 +1,350 @@
+"""
+Recálculos en segundo plano.
+El estado de cada trabajo se guarda en una base SQLite compartida
+(RegistroTrabajos): cualquier proceso de la app puede informar el progreso de
+un trabajo que ejecuta otro, y la comprobación de "ya hay uno en curso" se hace
+dentro de una transacción con el bloqueo de escritura tomado, así dos procesos
+nunca lanzan recálculos completos a la vez. El proceso que ejecuta el trabajo
+renueva un latido; si deja de hacerlo (se cayó) el trabajo se da por perdido y
+otro proceso puede lanzar uno nuevo.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from services import metricas
+from services.almacenamiento import conectar_sqlite
+from services.recalculo import calcular_fragmento, detectar_cambios, fragmentar, resumir
+
+MAX_TRABAJOS_GUARDADOS = 50
+LATIDO = 5.0          # Segundos entre renovaciones del estado de un trabajo en curso
+CADUCIDAD = 30.0      # Sin latido durante este tiempo, el trabajo se da por perdido
+ESPERA_REMOTA = 0.2   # Intervalo con que se consulta un trabajo que ejecuta otro proceso
+
+logger = logging.getLogger(__name__)
+
+
+class TrabajoRecalculo:
+    """Estado y progreso de un recálculo en segundo plano"""
+
+    def __init__(self, forzar):
+        self.id = uuid.uuid4().hex[:12]
+        self.forzar = forzar
+        self.estado = 'en_curso'   # en_curso, completado o error
+        self.fase = 'preparando'
+        self.total_sitios = 0
+        self.por_recalcular = 0
+        self.procesados = 0
+        self.recalculados = 0
+        self.omitidos = 0
+        self.fragmentos = 0
+        self.fragmentos_listos = 0
+        self.error = None
+        self.pid = os.getpid()
+        self.iniciado = time.time()
+        self.terminado = None
+        self._fin = threading.Event()
+
+    @property
+    def en_curso(self):
+        return self.estado == 'en_curso'
+
+    def esperar(self, timeout=None):
+        """Bloquea hasta que el trabajo termine (o venza el timeout)"""
+        return self._fin.wait(timeout)
+
+    def terminar(self, estado, error=None, publicar=None):
+        """Marca el final; publicar(trabajo) guarda el estado antes de avisar a quien espera"""
+        self.estado = estado
+        self.error = error
+        self.fase = estado
+        self.terminado = time.time()
+        if publicar is not None:
+            publicar(self)
+        self._fin.set()
+
+    def a_dict(self):
+        duracion = (self.terminado or time.time()) - self.iniciado
+        return {
+            'trabajo_id': self.id,
+            'estado': self.estado,
+            'fase': self.fase,
+            'forzar': self.forzar,
+            'total_sitios': self.total_sitios,
+            'por_recalcular': self.por_recalcular,
+            'procesados': self.procesados,
+            'progreso': round(self.procesados / self.por_recalcular, 4) if self.por_recalcular else (
+                1.0 if not self.en_curso else 0.0),
+            'fragmentos': self.fragmentos,
+            'fragmentos_listos': self.fragmentos_listos,
+            'sitios_por_segundo': round(self.procesados / duracion, 1) if duracion > 0 else None,
+            'duracion_s': round(duracion, 3),
+            'recalculados': self.recalculados,
+            'omitidos': self.omitidos,
+            'error': self.error,
+            'pid': self.pid,
+            'iniciado': self.iniciado
+        }
+
+
+class TrabajoRemoto:
+    """Trabajo que ejecuta otro proceso: se lee del registro compartido"""
+
+    def __init__(self, registro, estado):
+        self._registro = registro
+        self._estado = estado
+
+    def __getattr__(self, nombre):
+        # id, estado, recalculados, ... salen del último estado leído
+        clave = 'trabajo_id' if nombre == 'id' else nombre
+        if clave in self._estado:
+            return self._estado[clave]
+        raise AttributeError(nombre)
+
+    @property
+    def en_curso(self):
+        return self._estado['estado'] == 'en_curso'
+
+    def esperar(self, timeout=None):
+        """Consulta el registro hasta que el trabajo termine (o venza el timeout)"""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self.en_curso:
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(ESPERA_REMOTA)
+            self._estado = self._registro.obtener(self._estado['trabajo_id']) or self._estado
+        return True
+
+    def a_dict(self):
+        return dict(self._estado)
+
+
+class RegistroTrabajos:
+    """
+    Estado de los trabajos en una base SQLite compartida por todos los procesos.
+    tomar() es el único punto donde se decide si se lanza un recálculo nuevo.
+    """
+
+    def __init__(self, ruta, caducidad=CADUCIDAD):
+        self.ruta = ruta
+        self.caducidad = caducidad
+        self._local = threading.local()
+        con = self._conexion()
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS trabajos (id TEXT PRIMARY KEY, estado TEXT NOT NULL, '
+                        'datos TEXT NOT NULL, actualizado REAL NOT NULL)')
+            con.execute('CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos (estado)')
+
+    def _conexion(self):
+        # Una conexión por hilo: sqlite3 no permite compartirlas entre hilos
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = conectar_sqlite(self.ruta)
+            self._local.con = con
+        return con
+
+    def tomar(self, trabajo):
+        """
+        Registra el trabajo si no hay otro en curso (en cualquier proceso).
+        Devuelve None si lo registró o el estado del trabajo en curso.
+        """
+        con = self._conexion()
+        with con:
+            con.execute('BEGIN IMMEDIATE')
+            fila = con.execute("SELECT datos FROM trabajos WHERE estado = 'en_curso' AND actualizado >= ? "
+                               "ORDER BY actualizado DESC LIMIT 1", (time.time() - self.caducidad,)).fetchone()
+            if fila is not None:
+                return json.loads(fila[0])
+            self._escribir(con, trabajo)
+            con.execute('DELETE FROM trabajos WHERE id NOT IN '
+                        '(SELECT id FROM trabajos ORDER BY actualizado DESC LIMIT ?)', (MAX_TRABAJOS_GUARDADOS,))
+        return None
+
+    def publicar(self, trabajo):
+        """Guarda el estado actual del trabajo (también sirve de latido)"""
+        con = self._conexion()
+        with con:
+            self._escribir(con, trabajo)
+
+    def obtener(self, trabajo_id):
+        """Estado guardado de un trabajo (None si no existe)"""
+        fila = self._conexion().execute('SELECT datos, actualizado FROM trabajos WHERE id = ?',
+                                        (trabajo_id,)).fetchone()
+        if fila is None:
+            return None
+        estado = json.loads(fila[0])
+        if estado['estado'] == 'en_curso' and fila[1] < time.time() - self.caducidad:
+            estado.update(estado='error', fase='error',
+                          error='El proceso que ejecutaba el trabajo dejó de responder')
+        return estado
+
+    @staticmethod
+    def _escribir(con, trabajo):
+        estado = trabajo.a_dict()
+        con.execute('INSERT OR REPLACE INTO trabajos (id, estado, datos, actualizado) VALUES (?, ?, ?, ?)',
+                    (trabajo.id, trabajo.estado, json.dumps(estado), time.time()))
+
+
+class GestorRecalculo:
+    """
+    Ejecuta los recálculos en un hilo de fondo, repartiendo los sitios en
+    fragmentos entre un ProcessPoolExecutor. Solo hay un recálculo a la vez
+    entre todos los procesos que comparten el registro: las peticiones que
+    llegan mientras hay uno en curso se unen a ese trabajo.
+    """
+
+    def __init__(self, procesos=None, tamano_fragmento=5000, obtener_registro=None):
+        self.procesos = procesos or os.cpu_count() or 1
+        self.tamano_fragmento = tamano_fragmento
+        self._obtener_registro = obtener_registro
+        self._lock = threading.Lock()
+        self._publicacion = threading.Lock()
+        self._actual = None
+        self._trabajos = OrderedDict()
+        self._executor = None
+
+    def iniciar(self, instantanea, forzar, guardar):
+        """
+        Inicia un recálculo sobre la instantánea dada o devuelve el que ya está en curso.
+        guardar(resumen) persiste los resultados y devuelve True si tuvo éxito.
+        Devuelve (trabajo, nuevo).
+        """
+        with self._lock:
+            if self._actual is not None and self._actual.en_curso:
+                return self._actual, False
+
+            trabajo = TrabajoRecalculo(forzar)
+            registro = self._registro()
+            if registro is not None:
+                en_curso = registro.tomar(trabajo)
+                if en_curso is not None:
+                    # Lo está ejecutando otro proceso
+                    return TrabajoRemoto(registro, en_curso), False
+
+            self._actual = trabajo
+            self._trabajos[trabajo.id] = trabajo
+            while len(self._trabajos) > MAX_TRABAJOS_GUARDADOS:
+                self._trabajos.popitem(last=False)
+
+        hilo = threading.Thread(target=self._ejecutar, args=(trabajo, instantanea.datos, guardar, registro),
+                                name=f'recalculo-{trabajo.id}', daemon=True)
+        hilo.start()
+        return trabajo, True
+
+    def obtener(self, trabajo_id):
+        """Trabajo de este proceso o, si lo ejecutó otro, su estado en el registro (None si no existe)"""
+        trabajo = self._trabajos.get(trabajo_id)
+        if trabajo is not None:
+            return trabajo
+        registro = self._registro()
+        estado = registro.obtener(trabajo_id) if registro is not None else None
+        return TrabajoRemoto(registro, estado) if estado is not None else None
+
+    def _registro(self):
+        return self._obtener_registro() if self._obtener_registro is not None else None
+
+    def _ejecutar(self, trabajo, datos, guardar, registro):
+        # El estado final se guarda en el registro antes de despertar a quien espera el trabajo
+        publicar = lambda t: self._publicar(t, registro)
+        latido = threading.Thread(target=self._latir, args=(trabajo, registro),
+                                  name=f'latido-{trabajo.id}', daemon=True) if registro is not None else None
+        if latido is not None:
+            latido.start()
+        try:
+            trabajo.fase = 'detectando_cambios'
+            cambios = detectar_cambios(datos, trabajo.forzar)
+            trabajo.total_sitios = len(cambios['site_ids'])
+            trabajo.por_recalcular = cambios['recalculados']
+            trabajo.omitidos = cambios['omitidos']
+
+            trabajo.fase = 'calculando'
+            self._publicar(trabajo, registro)
+            with metricas.fase('calculo'):
+                lotes = self._calcular(trabajo, datos, cambios['ids_sucios'], registro)
+
+            trabajo.fase = 'guardando'
+            self._publicar(trabajo, registro)
+            resumen = resumir(cambios, lotes)
+            with metricas.fase('persistencia'):
+                guardado = not resumen['requiere_guardar'] or guardar(resumen)
+            if not guardado:
+                trabajo.terminar('error', 'Error guardando resultados', publicar)
+                return
+
+            trabajo.recalculados = resumen['recalculados']
+            metricas.SITIOS_RECALCULADOS.incrementar(n=resumen['recalculados'])
+            metricas.SITIOS_OMITIDOS.incrementar(n=resumen['omitidos'])
+            trabajo.terminar('completado', publicar=publicar)
+        except Exception as e:
+            logger.exception('Error en recálculo %s', trabajo.id)
+            trabajo.terminar('error', str(e), publicar)
+
+    def _latir(self, trabajo, registro):
+        """Renueva el estado del trabajo mientras sigue en curso"""
+        while not trabajo.esperar(LATIDO):
+            self._publicar(trabajo, registro, solo_en_curso=True)
+
+    def _publicar(self, trabajo, registro, solo_en_curso=False):
+        if registro is None:
+            return
+        # Un latido no puede pisar el estado final que publicó el hilo del trabajo
+        with self._publicacion:
+            if solo_en_curso and not trabajo.en_curso:
+                return
+            try:
+                registro.publicar(trabajo)
+            except sqlite3.Error as e:
+                # El progreso es informativo: un fallo al guardarlo no corta el recálculo
+                logger.warning('No se pudo guardar el estado del trabajo %s: %s', trabajo.id, e)
+
+    def _calcular(self, trabajo, datos, ids_sucios, registro=None):
+        fragmentos = fragmentar(datos, ids_sucios, self.tamano_fragmento)
+        trabajo.fragmentos = len(fragmentos)
+
+        # Con un solo fragmento o un solo proceso no compensa serializar hacia otro proceso
+        executor = self._obtener_executor() if len(fragmentos) > 1 and self.procesos > 1 else None
+        if executor is None:
+            lotes = []
+            for fragmento in fragmentos:
+                lotes.append(calcular_fragmento(fragmento))
+                self._avanzar(trabajo, fragmento, registro)
+            return lotes
+
+        lotes = [None] * len(fragmentos)
+        try:
+            futuros = {executor.submit(calcular_fragmento, fragmento): i for i, fragmento in enumerate(fragmentos)}
+            for futuro in as_completed(futuros):
+                i = futuros[futuro]
+                lotes[i] = futuro.result()
+                self._avanzar(trabajo, fragmentos[i], registro)
+        except BrokenProcessPool:
+            # Un proceso murió: se descarta el pool y se terminan aquí los fragmentos que faltan
+            self._executor = None
+            for i, fragmento in enumerate(fragmentos):
+                if lotes[i] is None:
+                    lotes[i] = calcular_fragmento(fragmento)
+                    self._avanzar(trabajo, fragmento, registro)
+        return lotes
+
+    def _avanzar(self, trabajo, fragmento, registro=None):
+        trabajo.procesados += len(fragmento['site_ids'])
+        trabajo.fragmentos_listos += 1
+        self._publicar(trabajo, registro)
+
+    def _obtener_executor(self):
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.procesos)
+            except (OSError, NotImplementedError) as e:
+                # Entornos sin multiprocessing: se calcula en el propio hilo
+                logger.warning('No se pudo crear el pool de procesos, se calcula en el hilo: %s', e)
+                self.procesos = 1
+                return None
+        return self._executor
@@ -0,0 +1,27 @@
+import os
+import shutil
+
+import pytest
+
+LIBRO_EJEMPLO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'data', 'EcoBalance_Datos.xlsx')
+
+
+@pytest.fixture
+def carpeta_datos(tmp_path):
+    """Carpeta temporal con una copia del libro de ejemplo (los datos del repositorio no se tocan)"""
+    shutil.copy(LIBRO_EJEMPLO, tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def aplicacion(carpeta_datos, monkeypatch):
+    """Módulo app apuntando a la carpeta temporal"""
+    import app
+    monkeypatch.setitem(app.app.config, 'DATA_FOLDER', str(carpeta_datos))
+    return app
+
+
+@pytest.fixture
+def cliente(aplicacion):
+    return aplicacion.app.test_client()
@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.agregados import AgregadosEHI, ecosistemas_de
+from services.almacen_datos import Instantanea
+
+CATEGORIAS = ['Excelente', 'Bueno', 'Regular', 'Pobre', 'Crítico']
+ECOSISTEMAS = ['Bosque', 'Humedal', 'Minería']
+
+
+def _resultados(rng, site_ids):
+    n = len(site_ids)
+    valores = rng.uniform(-0.05, 1.05, (n, 4))  # También fuera de [0, 1]: cubetas de los extremos
+    valores[rng.random((n, 4)) < 0.05] = np.nan
+    return pd.DataFrame({'site_id': site_ids, 'EHI': valores[:, 0], 'BI': valores[:, 1], 'TFI': valores[:, 2],
+                         'VSI': valores[:, 3], 'categoria': rng.choice(CATEGORIAS, n)})
+
+
+def _datos(sitios, resultados):
+    return {'sites': sitios.reset_index(drop=True), 'results': resultados.reset_index(drop=True)}
+
+
+def _comparar(incremental, completo):
+    """Resúmenes iguales (las sumas pueden diferir en el redondeo)"""
+    if isinstance(completo, dict):
+        assert incremental.keys() == completo.keys()
+        for clave in completo:
+            _comparar(incremental[clave], completo[clave])
+    elif isinstance(completo, float):
+        assert incremental == pytest.approx(completo, rel=1e-12, abs=1e-12)
+    else:
+        assert incremental == completo
+
+
+def test_los_deltas_coinciden_con_recalcular_todo():
+    rng = np.random.default_rng(7)
+    site_ids = [str(i) for i in range(300)]
+    sitios = pd.DataFrame({'site_id': site_ids, 'ecosystem_type': rng.choice(ECOSISTEMAS, 300)})
+    resultados = _resultados(rng, site_ids)
+
+    agregados = AgregadosEHI()
+    agregados.sincronizar(Instantanea(1, _datos(sitios, resultados), time.time()))
+
+    for paso in range(20):
+        # Altas: sitios nuevos, algunos de un ecosistema que aún no existía
+        nuevos = [f'n{paso}_{i}' for i in range(5)]
+        sitios = pd.concat([sitios, pd.DataFrame({'site_id': nuevos, 'ecosystem_type': ['Nuevo'] + ['Bosque'] * 4})])
+        # Modificaciones: sitios existentes con valores y categoría nuevos
+        modificados = list(rng.choice(sitios['site_id'].iloc[:-5], 15, replace=False))
+        # Bajas: desaparecen sitios (y su resultado)
+        borrados = set(rng.choice(sitios['site_id'], 3, replace=False))
+        sitios = sitios[~sitios['site_id'].isin(borrados)]
+
+        cambios = _resultados(rng, [s for s in nuevos + modificados if s not in borrados])
+        resultados = pd.concat([resultados[~resultados['site_id'].isin(set(cambios['site_id']) | borrados)],
+                                cambios])
+        agregados.aplicar(cambios, ecosistemas_de(_datos(sitios, resultados)), sitios['site_id'])
+
+    final = Instantanea(2, _datos(sitios, resultados), time.time())
+    completo = AgregadosEHI()
+    completo.sincronizar(final)
+    _comparar(agregados.resumen(), completo.resumen())
+
+    # La huella mantenida coincide con la de los datos: sincronizar no reconstruye
+    agregados.sincronizar(final)
+    assert agregados.comprobaciones == 2 and agregados.reconstrucciones == 1
+
+
+def test_un_cambio_externo_reconstruye_una_vez():
+    rng = np.random.default_rng(1)
+    site_ids = [str(i) for i in range(10)]
+    sitios = pd.DataFrame({'site_id': site_ids, 'ecosystem_type': 'Bosque'})
+    resultados = _resultados(rng, site_ids)
+    agregados = AgregadosEHI()
+    agregados.sincronizar(Instantanea(1, _datos(sitios, resultados), time.time()))
+
+    externos = resultados.copy()
+    externos.loc[0, 'EHI'] = 0.123
+    agregados.sincronizar(Instantanea(2, _datos(sitios, externos), time.time()))
+    agregados.sincronizar(Instantanea(2, _datos(sitios, externos), time.time()))
+    assert agregados.reconstrucciones == 2 and agregados.comprobaciones == 2
@@ -0,0 +1,163 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from services.alertas import CUSUM_H, DetectorAnomalias
+
+
+def _resultado(site_id, ehi, bi=0.5, tfi=0.5, vsi=0.5):
+    return pd.DataFrame({'site_id': [site_id], 'EHI': [ehi], 'BI': [bi], 'TFI': [tfi], 'VSI': [vsi]})
+
+
+def _instantanea(etiqueta, resultados, modificado=1.0):
+    return SimpleNamespace(etiqueta=etiqueta, modificado=modificado, datos={'results': resultados})
+
+
+def _tipos(alertas):
+    return [a['tipo'] for a in alertas]
+
+
+@pytest.fixture
+def detector(tmp_path):
+    return DetectorAnomalias(str(tmp_path / 'alertas.db'))
+
+
+def test_cambio_de_categoria(detector):
+    assert detector.observar(_resultado('101', 0.6)) == []   # Primer resultado: solo línea base
+    mejora, = detector.observar(_resultado('101', 0.8))
+    assert mejora['tipo'] == 'cambio_categoria' and mejora['direccion'] == 'mejora'
+    assert (mejora['categoria_anterior'], mejora['categoria']) == ('Bueno', 'Excelente')
+
+    empeora = detector.observar(_resultado('101', 0.45))
+    cambio = next(a for a in empeora if a['tipo'] == 'cambio_categoria')
+    assert (cambio['categoria_anterior'], cambio['categoria'], cambio['direccion']) == ('Excelente', 'Regular',
+                                                                                          'empeora')
+    # Sigue en Regular: no hay otro cambio de categoría
+    assert 'cambio_categoria' not in _tipos(detector.observar(_resultado('101', 0.46)))
+
+
+def test_desviacion_de_mas_de_3_sigma(detector):
+    for _ in range(4):
+        assert detector.observar(pd.concat([_resultado('101', 0.6), _resultado('102', 0.6)])) == []
+
+    salto, = detector.observar(_resultado('101', 0.6, bi=0.7))
+    assert (salto['tipo'], salto['indice'], salto['site_id']) == ('desviacion', 'BI', '101')
+    assert salto['z'] == pytest.approx(0.2 / 0.02) and salto['esperado'] == pytest.approx(0.5)
+    # Dos desviaciones mínimas no alcanzan
+    assert detector.observar(_resultado('102', 0.6, bi=0.54)) == []
+
+
+def test_cusum_detecta_la_caida_sostenida(detector):
+    emitidas = []
+    for ehi in (0.70, 0.70, 0.70, 0.67, 0.64, 0.61, 0.58):
+        emitidas += detector.observar(_resultado('101', ehi))
+
+    # Ningún resultado se aleja 3σ ni cambia de categoría: solo la suma acumulada lo detecta
+    tendencia, = emitidas
+    assert tendencia['tipo'] == 'tendencia_baja' and tendencia['valor'] == 0.58
+    assert tendencia['caida_acumulada'] > CUSUM_H
+    # Al alertar la suma vuelve a cero
+    assert detector.observar(_resultado('101', 0.58)) == []
+
+
+def test_el_estado_y_la_secuencia_se_comparten_entre_procesos(tmp_path):
+    ruta = str(tmp_path / 'alertas.db')
+    uno, otro = DetectorAnomalias(ruta), DetectorAnomalias(ruta)
+
+    uno.observar(_resultado('101', 0.6))
+    # La línea base que tomó un proceso sirve al otro, que continúa la misma secuencia
+    primera, = otro.observar(_resultado('101', 0.8))
+    segunda, = uno.observar(_resultado('101', 0.6))
+    assert (primera['seq'], segunda['seq']) == (1, 2)
+    assert uno.seq == otro.seq == 2 and otro.conteos == {'cambio_categoria': 2}
+
+    # Un reinicio no pierde nada
+    reiniciado = DetectorAnomalias(ruta)
+    assert [a['seq'] for a in reiniciado.consultar(0)['alertas']] == [1, 2]
+    assert [a['seq'] for a in reiniciado.recientes()] == [2, 1]
+
+
+def test_cada_version_nueva_toma_la_linea_base_de_los_sitios_sin_estado(detector):
+    detector.sincronizar(_instantanea('v1', _resultado('101', 0.6)))
+    assert _tipos(detector.observar(_resultado('101', 0.8))) == ['cambio_categoria']
+
+    # Un sitio que llegó por otra vía: con la versión nueva su resultado guardado es la línea base
+    nuevos = pd.concat([_resultado('101', 0.1), _resultado('104', 0.3)])
+    detector.sincronizar(_instantanea('v2', nuevos, modificado=2.0))
+    assert _tipos(detector.observar(_resultado('104', 0.9))) == ['cambio_categoria']
+    # Los sitios con estado lo conservan (101 sigue en Excelente, no en el 0.1 guardado)
+    assert detector.observar(_resultado('101', 0.8)) == []
+
+    # Una versión más vieja que la ya tomada no cambia nada
+    detector.sincronizar(_instantanea('v0', _resultado('105', 0.3), modificado=0.5))
+    assert detector.observar(_resultado('105', 0.9)) == []
+
+
+def test_los_sitios_borrados_pierden_su_estado(detector):
+    detector.observar(pd.concat([_resultado('101', 0.6), _resultado('102', 0.6)]))
+    detector.observar(_resultado('101', 0.6), site_ids_vigentes=['101'])
+    # 102 vuelve como un sitio nuevo: sin alerta por el salto de categoría
+    assert detector.observar(_resultado('102', 0.9)) == []
+
+
+def test_consulta_paginada_y_registro_acotado(tmp_path):
+    detector = DetectorAnomalias(str(tmp_path / 'alertas.db'), max_alertas=3)
+    detector.observar(pd.concat([_resultado('101', 0.6), _resultado('102', 0.6)]))
+    for ehi in (0.8, 0.6, 0.8):
+        detector.observar(pd.concat([_resultado('101', ehi), _resultado('102', ehi)]))
+
+    assert detector.seq == 6
+    pagina = detector.consultar(3, limite=2)
+    assert [a['seq'] for a in pagina['alertas']] == [4, 5] and pagina['siguiente'] == 5
+    assert not pagina['truncado']
+    assert detector.consultar(1)['truncado'] and not detector.consultar(6)['truncado']
+    assert [a['seq'] for a in detector.consultar(0, site_id='102')['alertas']] == [4, 6]
+
+
+def _eventos(respuesta, n):
+    """Los primeros n bloques del flujo SSE (el flujo no termina solo)"""
+    try:
+        flujo = iter(respuesta.response)
+        return [next(flujo).decode() for _ in range(n)]
+    finally:
+        respuesta.close()
+
+
+def _ids(bloques):
+    return [int(b.split('\n')[0][len('id: '):]) for b in bloques]
+
+
+@pytest.fixture
+def alertas_app(aplicacion, monkeypatch):
+    monkeypatch.setitem(aplicacion.app.config, 'ALERTAS_SSE_ESPERA', 0.05)
+    detector = aplicacion.obtener_detector_anomalias()
+    detector.observar(_resultado('101', 0.6))
+    for ehi in (0.8, 0.6, 0.8):
+        detector.observar(_resultado('101', ehi))
+    return aplicacion
+
+
+def test_sse_se_reanuda_con_last_event_id(alertas_app, cliente, monkeypatch):
+    assert _ids(_eventos(cliente.get('/api/alertas/stream?desde=0', buffered=False), 3)) == [1, 2, 3]
+    # Last-Event-ID (reconexión del navegador) manda sobre ?desde
+    reconexion = cliente.get('/api/alertas/stream?desde=0', headers={'Last-Event-ID': '1'}, buffered=False)
+    bloques = _eventos(reconexion, 2)
+    assert _ids(bloques) == [2, 3] and 'event: alerta' in bloques[0]
+
+    # Sin desde ni Last-Event-ID solo llegan las nuevas
+    assert _eventos(cliente.get('/api/alertas/stream', buffered=False), 1) == [': latido\n\n']
+
+    # Otro proceso (o un reinicio) atiende la reconexión y continúa desde el mismo punto
+    monkeypatch.setattr(alertas_app, '_almacenamientos', {})
+    reconexion = cliente.get('/api/alertas/stream', headers={'Last-Event-ID': '2'}, buffered=False)
+    assert _ids(_eventos(reconexion, 1)) == [3]
+
+
+def test_sse_avisa_si_se_perdieron_alertas(alertas_app, cliente, monkeypatch):
+    monkeypatch.setattr(alertas_app.obtener_detector_anomalias(), 'max_alertas', 1)
+    alertas_app.obtener_detector_anomalias().observar(_resultado('101', 0.6))
+
+    bloques = _eventos(cliente.get('/api/alertas/stream', headers={'Last-Event-ID': '1'}, buffered=False), 2)
+    assert bloques[0].startswith('event: truncado') and _ids(bloques[1:]) == [4]
+    assert cliente.get('/api/alertas?desde=1').get_json()['truncado']
@@ -0,0 +1,46 @@
+import os
+
+import pandas as pd
+
+from app import transformar_datos
+from services.almacen_datos import AlmacenDatos
+from services.almacenamiento import AlmacenamientoExcel
+
+
+def _almacen(carpeta):
+    fuente = AlmacenamientoExcel(str(carpeta / 'EcoBalance_Datos.xlsx'))
+    return fuente, AlmacenDatos(lambda: fuente, transformar_datos)
+
+
+def test_sin_cambios_se_reutiliza_la_misma_instantanea(carpeta_datos):
+    _, almacen = _almacen(carpeta_datos)
+    primera = almacen.obtener()
+    assert almacen.obtener() is primera
+    assert almacen.version == 1
+
+
+def test_cambiar_la_fecha_sin_cambiar_el_contenido_no_recarga(carpeta_datos):
+    fuente, almacen = _almacen(carpeta_datos)
+    primera = almacen.obtener()
+    os.utime(fuente.ruta, (1, 1))
+    assert almacen.obtener() is primera
+    assert almacen.version == 1
+
+
+def test_un_cambio_de_contenido_da_una_version_nueva(carpeta_datos):
+    fuente, almacen = _almacen(carpeta_datos)
+    primera = almacen.obtener()
+    fuente.agregar_filas('vsi', pd.DataFrame({'site_id': ['101'], 'fecha': [pd.Timestamp('2030-01-01')],
+                                              'cobertura_pct': [10.0], 'calidad_suelo_pct': [10.0]}))
+    segunda = almacen.obtener()
+    assert segunda is not primera
+    assert segunda.version == almacen.version == 2
+    assert len(segunda.datos['vsi']) == len(primera.datos['vsi']) + 1
+    assert segunda.etiqueta != primera.etiqueta
+
+
+def test_sin_fuente_se_siguen_sirviendo_los_ultimos_datos(carpeta_datos):
+    fuente, almacen = _almacen(carpeta_datos)
+    primera = almacen.obtener()
+    os.remove(fuente.ruta)
+    assert almacen.obtener() is primera
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from app import transformar_datos
+from services.almacenamiento import AlmacenamientoExcel, AlmacenamientoSQLite, importar_excel
+from services.recalculo import recalcular_sitios
+
+
+@pytest.fixture
+def backends(carpeta_datos):
+    excel = AlmacenamientoExcel(str(carpeta_datos / 'EcoBalance_Datos.xlsx'))
+    importar_excel(excel.ruta, str(carpeta_datos / 'EcoBalance.db'))
+    return excel, AlmacenamientoSQLite(str(carpeta_datos / 'EcoBalance.db'))
+
+
+def _comparables(datos):
+    """Tablas transformadas sin depender de con qué tipo devuelve cada backend números, fechas e ids"""
+    return {clave: df.apply(lambda c: c.astype(float) if pd.api.types.is_numeric_dtype(c) else c.astype(str))
+            .reset_index(drop=True) for clave, df in transformar_datos(datos).items()}
+
+
+def test_sqlite_devuelve_las_mismas_tablas_que_el_excel(backends):
+    excel, sqlite = backends
+    de_excel, de_sqlite = _comparables(excel.cargar()), _comparables(sqlite.cargar())
+    for clave in ('sites', 'biodiversity', 'trophic', 'vsi'):
+        pd.testing.assert_frame_equal(de_sqlite[clave][de_excel[clave].columns], de_excel[clave], check_dtype=False)
+
+
+@pytest.mark.parametrize('indice', [0, 1], ids=['excel', 'sqlite'])
+def test_guardar_resultados_hace_upsert_y_borra_sitios_que_ya_no_existen(backends, indice):
+    almacenamiento = backends[indice]
+    datos = transformar_datos(almacenamiento.cargar())
+    nuevos = recalcular_sitios(datos, forzar=True)['nuevos']
+    assert almacenamiento.guardar_resultados(nuevos, ['101', '102'])
+
+    guardados = almacenamiento.cargar()['results']
+    assert sorted(guardados['site_id']) == ['101', '102']
+    esperados = nuevos.set_index('site_id').loc[['101', '102'], 'EHI'].tolist()
+    assert guardados.set_index('site_id').loc[['101', '102'], 'EHI'].tolist() == pytest.approx(esperados)
+
+
+@pytest.mark.parametrize('indice', [0, 1], ids=['excel', 'sqlite'])
+def test_cada_escritura_cambia_la_firma(backends, indice):
+    almacenamiento = backends[indice]
+    firma, huella = almacenamiento.firma(), almacenamiento.huella_contenido()
+    almacenamiento.agregar_filas('vsi', pd.DataFrame({'site_id': ['101'], 'fecha': [pd.Timestamp('2030-01-01')],
+                                                      'cobertura_pct': [1.0], 'calidad_suelo_pct': [1.0]}))
+    assert almacenamiento.firma() != firma and almacenamiento.huella_contenido() != huella
@@ -0,0 +1,56 @@
+import copy
+
+import pandas as pd
+import pytest
+
+from app import transformar_datos
+from benchmarks import generador
+from benchmarks.ejecutar import comparar, ejecutar
+from benchmarks.generador import escribir, generar_datos
+from services.almacenamiento import HOJAS, AlmacenamientoExcel, AlmacenamientoSQLite
+
+
+def test_los_datos_generados_tienen_el_esquema_del_libro(carpeta_datos):
+    datos = generar_datos(sitios=50, especies=4, mediciones=2, semilla=5)
+    ejemplo = pd.read_excel(carpeta_datos / 'EcoBalance_Datos.xlsx', sheet_name=None)
+    for clave, hoja in HOJAS.items():
+        assert list(datos[clave].columns) == list(ejemplo[hoja].columns), hoja
+
+    assert (len(datos['sites']), len(datos['biodiversity']), len(datos['trophic'])) == (50, 200, 100)
+    assert datos['results'].empty
+    # Misma semilla, mismos datos
+    pd.testing.assert_frame_equal(datos['vsi'], generar_datos(50, 4, 2, semilla=5)['vsi'])
+    transformados = transformar_datos(datos)
+    assert set(transformados['sites']['ecosystem_type']) == {'Bosque', 'Humedal', 'Zona Minera'}
+
+
+@pytest.mark.parametrize('archivo, clase', [('datos.xlsx', AlmacenamientoExcel), ('datos.db', AlmacenamientoSQLite)])
+def test_escribir_en_excel_o_sqlite(tmp_path, archivo, clase):
+    datos = generar_datos(sitios=20, especies=3)
+    escribir(datos, str(tmp_path / archivo))
+    cargados = clase(str(tmp_path / archivo)).cargar()
+    assert {clave: len(df) for clave, df in cargados.items()} == {clave: len(df) for clave, df in datos.items()}
+
+
+def test_excel_rechaza_hojas_demasiado_grandes(tmp_path, monkeypatch):
+    monkeypatch.setattr(generador, 'MAX_FILAS_EXCEL', 10)
+    with pytest.raises(ValueError, match='2-biodiversity_data'):
+        escribir(generar_datos(sitios=5, especies=3), str(tmp_path / 'datos.xlsx'))
+
+
+def test_el_benchmark_mide_modelos_y_rutas_y_detecta_regresiones(monkeypatch):
+    import app
+    # ejecutar apunta la app a sus datos temporales: se restaura al terminar
+    for clave in ('DATA_FOLDER', 'STORAGE_BACKEND', 'EXCEL_FILE', 'SQLITE_FILE'):
+        monkeypatch.setitem(app.app.config, clave, app.app.config[clave])
+
+    informe = ejecutar([30], especies=3, repeticiones=2, muestra=5, backend='sqlite', semilla=0,
+                       partes=('modelos', 'rutas'))
+    casos = informe['resultados']['30']
+    assert {'carga_datos', 'calcular_lote', 'GET /api/sitios', 'POST /api/calcular_lote', 'GET /admin'} <= set(casos)
+    assert all('p50_ms' in r or 'omitido' in r for r in casos.values())
+
+    assert comparar(informe, copy.deepcopy(informe), 1.25) == []
+    base = copy.deepcopy(informe)
+    base['resultados']['30']['GET /api/sitios']['p50_ms'] = casos['GET /api/sitios']['p50_ms'] / 2
+    assert [r['caso'] for r in comparar(informe, base, 1.25)] == ['GET /api/sitios']
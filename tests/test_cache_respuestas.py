@@ -0,0 +1,64 @@
+import time
+
+import pandas as pd
+
+from services.cache_respuestas import CacheRespuestas
+
+
+def test_lru_desaloja_la_menos_usada_y_respeta_el_ttl():
+    cache = CacheRespuestas(max_entradas=2, ttl=60)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    assert cache.obtener('a') == 1   # 'a' pasa a ser la más reciente
+    cache.guardar('c', 3)
+    assert cache.obtener('b') is None and cache.obtener('a') == 1 and cache.obtener('c') == 3
+    assert (cache.aciertos, cache.fallos) == (3, 1)
+
+    caduca = CacheRespuestas(ttl=0.01)
+    caduca.guardar('a', 1)
+    time.sleep(0.02)
+    assert caduca.obtener('a') is None and len(caduca) == 0
+
+
+def test_etag_y_304_con_if_none_match(cliente):
+    primera = cliente.get('/api/calcular/101')
+    etag = primera.headers['ETag']
+    assert primera.status_code == 200 and etag.startswith('W/')
+    assert primera.headers['Cache-Control'] == 'no-cache' and 'Last-Modified' in primera.headers
+
+    no_modificada = cliente.get('/api/calcular/101', headers={'If-None-Match': etag})
+    assert no_modificada.status_code == 304 and no_modificada.get_data() == b''
+    assert no_modificada.headers['ETag'] == etag
+
+    otra = cliente.get('/api/calcular/101', headers={'If-None-Match': 'W/"otra"'})
+    assert otra.status_code == 200 and otra.get_data() == primera.get_data()
+    # Cada consulta y sitio tiene su propio ETag
+    assert cliente.get('/api/calcular/102').headers['ETag'] != etag
+    assert cliente.get('/api/calcular/101?formato=compacto').headers['ETag'] != etag
+
+
+def test_una_version_nueva_de_los_datos_invalida_etag_y_cache(aplicacion, cliente):
+    antes = cliente.get('/api/calcular/101')
+    aplicacion.obtener_almacenamiento().agregar_filas('vsi', pd.DataFrame({
+        'site_id': ['101'], 'fecha': [pd.Timestamp('2030-01-01')], 'cobertura_pct': [10], 'calidad_suelo_pct': [10]}))
+
+    despues = cliente.get('/api/calcular/101', headers={'If-None-Match': antes.headers['ETag']})
+    assert despues.status_code == 200 and despues.headers['ETag'] != antes.headers['ETag']
+    assert despues.get_json()['VSI']['valor'] != antes.get_json()['VSI']['valor']
+
+
+def test_los_errores_no_se_cachean(cliente):
+    respuesta = cliente.get('/api/incertidumbre/101?semilla=-1')
+    assert respuesta.status_code == 400 and 'ETag' not in respuesta.headers
+
+
+def test_la_aplicacion_desaloja_por_lru(aplicacion, cliente, monkeypatch):
+    cache = CacheRespuestas(max_entradas=2)
+    monkeypatch.setattr(aplicacion, 'cache_respuestas', cache)
+    for site_id in ('101', '102', '103'):
+        cliente.get(f'/api/calcular/{site_id}')
+    assert len(cache) == 2 and cache.fallos == 3
+
+    cliente.get('/api/calcular/103')
+    cliente.get('/api/calcular/101')
+    assert (cache.aciertos, cache.fallos) == (1, 4)
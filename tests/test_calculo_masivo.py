@@ -0,0 +1,138 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import services.calculo_masivo as calculo_masivo
+from models.lote import calcular_lote
+from services.calculo_masivo import ErrorCalculoMasivo, calcular_en_bloques, registros_lote, seleccionar_sitios
+from services.espacial import IndiceEspacial
+
+
+def _datos(n=40, semilla=3):
+    rng = np.random.default_rng(semilla)
+    site_ids = [f's{i}' for i in range(n)]
+    especies = rng.integers(1, 5, n)
+    bio_ids = np.repeat(site_ids, especies)
+    return {
+        'sites': pd.DataFrame({'site_id': site_ids, 'ecosystem_type': rng.choice(['Bosque', 'Humedal'], n),
+                               'latitude': rng.uniform(-60, 60, n), 'longitude': rng.uniform(-170, 170, n)}),
+        'biodiversity': pd.DataFrame({'site_id': bio_ids, 'species': [f'e{i}' for i in range(len(bio_ids))],
+                                      'abundance': rng.integers(1, 30, len(bio_ids))}),
+        'trophic': pd.DataFrame({'site_id': site_ids, 'connectance_observed': rng.uniform(0, 0.5, n),
+                                 'connectance_expected': rng.uniform(0.2, 0.5, n),
+                                 'length_observed': rng.uniform(1, 5, n), 'length_expected': rng.uniform(3, 5, n)}),
+        'vsi': pd.DataFrame({'site_id': site_ids, 'coverage_pct': rng.uniform(0, 100, n),
+                             'soil_quality_pct': rng.uniform(0, 100, n)}),
+        'results': pd.DataFrame({'site_id': site_ids, 'categoria': rng.choice(['Bueno', 'Pobre'], n)})
+    }
+
+
+def _lineas(respuesta):
+    """Cada línea del NDJSON tiene que ser un JSON completo"""
+    texto = respuesta.get_data(as_text=True)
+    assert texto.endswith('\n')
+    return [json.loads(linea) for linea in texto.splitlines()]
+
+
+def test_el_calculo_por_bloques_no_depende_del_tamano_del_bloque():
+    datos = _datos()
+    site_ids = pd.Index(datos['sites']['site_id'])
+    directo = registros_lote(calcular_lote(datos['biodiversity'], datos['trophic'], datos['vsi'], site_ids))
+
+    for tamano in (1, 7, 500):
+        assert list(calcular_en_bloques(datos, site_ids, tamano)) == directo
+
+
+def test_un_sitio_que_falla_solo_corta_su_linea(monkeypatch):
+    original = calculo_masivo.calcular_fragmento
+
+    def calcular(fragmento):
+        if 's5' in fragmento['site_ids']:
+            raise ValueError('datos corruptos')
+        return original(fragmento)
+
+    monkeypatch.setattr(calculo_masivo, 'calcular_fragmento', calcular)
+    datos = _datos()
+    registros = list(calcular_en_bloques(datos, pd.Index(datos['sites']['site_id']), tamano=4))
+
+    assert [r['site_id'] for r in registros] == list(datos['sites']['site_id'])
+    assert registros[5] == {'site_id': 's5', 'error': 'datos corruptos'}
+    assert all('EHI' in r for i, r in enumerate(registros) if i != 5)
+
+
+def test_seleccion_por_filtros():
+    datos = _datos()
+    indice = IndiceEspacial(datos)
+    sitios = datos['sites'].set_index('site_id')
+    categorias = datos['results'].set_index('site_id')['categoria']
+
+    elegidos, faltantes = seleccionar_sitios(datos, indice, filtro={'ecosistema': 'Bosque', 'categoria': ['Bueno']})
+    esperados = [s for s in sitios.index if sitios.at[s, 'ecosystem_type'] == 'Bosque' and categorias[s] == 'Bueno']
+    assert list(elegidos) == esperados and faltantes == []
+
+    elegidos, _ = seleccionar_sitios(datos, indice, filtro={'rectangulo': {'sur': 0, 'oeste': 0, 'norte': 60,
+                                                                           'este': 170}})
+    dentro = (sitios['latitude'] >= 0) & (sitios['longitude'] >= 0)
+    assert sorted(elegidos) == sorted(sitios.index[dentro])
+
+    # Con site_ids se respeta su orden, sin repetidos, y el filtro se aplica sobre ellos
+    elegidos, faltantes = seleccionar_sitios(datos, indice, ['s3', 'nada', 's1', 's3', 's2'],
+                                             {'categoria': categorias['s1']})
+    assert list(elegidos) == [s for s in ['s3', 's1', 's2'] if categorias[s] == categorias['s1']]
+    assert faltantes == ['nada']
+
+
+@pytest.mark.parametrize('site_ids, filtro', [
+    (None, None),
+    ('s1', None),
+    (None, ['Bosque']),
+    (None, {'color': 'verde'}),
+    (None, {'rectangulo': [0, 0, 10]}),
+    ([f's{i}' for i in range(11)], None)
+])
+def test_pedidos_invalidos(site_ids, filtro):
+    datos = _datos()
+    with pytest.raises(ErrorCalculoMasivo):
+        seleccionar_sitios(datos, IndiceEspacial(datos), site_ids, filtro, max_sitios=10)
+
+
+def test_api_transmite_un_registro_por_linea(cliente):
+    respuesta = cliente.post('/api/calcular_lote', json={'site_ids': ['999', 102, '101']})
+    assert respuesta.status_code == 200 and respuesta.mimetype == 'application/x-ndjson'
+    assert respuesta.headers['X-Total-Sitios'] == '3'
+
+    lineas = _lineas(respuesta)
+    assert lineas[0] == {'site_id': '999', 'error': 'Sitio no encontrado'}
+    assert [linea['site_id'] for linea in lineas[1:]] == ['102', '101']
+    # Mismos valores que el cálculo de un solo sitio
+    for linea in lineas[1:]:
+        individual = cliente.get(f"/api/calcular/{linea['site_id']}").get_json()
+        assert linea['EHI'] == pytest.approx(individual['EHI']['valor'])
+        assert linea['categoria'] == individual['EHI']['categoria']
+
+
+def test_api_filtro_por_ecosistema(cliente):
+    lineas = _lineas(cliente.post('/api/calcular_lote', json={'filtro': {'ecosistema': ['Humedal', 'Bosque']}}))
+    assert sorted(linea['site_id'] for linea in lineas) == ['101', '102']
+
+
+@pytest.mark.parametrize('cuerpo', [
+    {'data': '{"site_ids": [101', 'content_type': 'application/json'},
+    {'json': ['101']},
+    {'json': {}},
+    {'json': {'site_ids': '101'}},
+    {'json': {'filtro': {'color': 'verde'}}}
+], ids=['json_roto', 'lista', 'vacio', 'site_ids_texto', 'filtro_desconocido'])
+def test_api_cuerpos_invalidos_dan_400(cliente, cuerpo):
+    respuesta = cliente.post('/api/calcular_lote', **cuerpo)
+    assert respuesta.status_code == 400 and 'error' in respuesta.get_json()
+
+
+def test_api_respeta_el_maximo_de_sitios(aplicacion, cliente, monkeypatch):
+    monkeypatch.setitem(aplicacion.app.config, 'LOTE_MAX_SITIOS', 2)
+    respuesta = cliente.post('/api/calcular_lote', json={'site_ids': ['101', '102', '103']})
+    assert respuesta.status_code == 400 and 'máximo' in respuesta.get_json()['error']
+    assert cliente.post('/api/calcular_lote', json={'filtro': {'categoria': ['Excelente', 'Regular', 'Pobre']}}
+                        ).status_code == 400
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from services.cambios import RegistroCambios
+
+
+def _instantanea(etiqueta, modificado, resultados):
+    return SimpleNamespace(etiqueta=etiqueta, modificado=modificado, datos={
+        'sites': pd.DataFrame({'site_id': ['101', '102'], 'site_name': ['Bosque', 'Humedal']}),
+        'results': pd.DataFrame({'site_id': list(resultados), 'EHI': list(resultados.values())})})
+
+
+def test_dos_procesos_comparten_epoca_y_secuencia(tmp_path):
+    ruta = str(tmp_path / 'cambios.db')
+    # Cada proceso de la app abre su propio registro sobre la misma base
+    uno, otro = RegistroCambios(ruta), RegistroCambios(ruta)
+    inicial = _instantanea('v1', 1.0, {'101': 0.5, '102': 0.5})
+    uno.sincronizar(inicial)
+    otro.sincronizar(inicial)
+    assert uno.estado() == otro.estado()
+    epoca, seq = uno.estado()
+
+    uno.sincronizar(_instantanea('v2', 2.0, {'101': 0.5, '102': 0.7}))
+    assert otro.estado() == (epoca, seq + 1)
+    # Con los datos aún en v1, el otro proceso no entrega cambios que no puede mostrar
+    assert otro.consultar(seq, epoca, otro.seq_de('v1')) == (seq, [])
+    assert otro.consultar(seq, epoca, otro.seq_de('v2')) == (
+        seq + 1, [{'seq': seq + 1, 'tabla': 'results', 'operacion': 'modificacion', 'site_id': '102'}])
+
+    # Una versión más vieja que la registrada no hace retroceder el registro
+    otro.sincronizar(inicial)
+    otro.sincronizar(_instantanea('v0', 0.5, {'101': 0.1}))
+    assert otro.seq_de('v0') is None and otro.estado() == (epoca, seq + 1)
+
+
+def _version(etiqueta, modificado, sitios, resultados):
+    return SimpleNamespace(etiqueta=etiqueta, modificado=modificado, datos={
+        'sites': pd.DataFrame({'site_id': sitios, 'site_name': [f'Sitio {s}' for s in sitios]}),
+        'results': pd.DataFrame({'site_id': list(resultados), 'EHI': list(resultados.values())})})
+
+
+def test_altas_modificaciones_y_bajas_compactadas(tmp_path):
+    registro = RegistroCambios(str(tmp_path / 'cambios.db'))
+    registro.sincronizar(_version('v1', 1.0, ['101', '102'], {'101': 0.5, '102': 0.5}))
+    epoca, inicio = registro.estado()
+
+    registro.sincronizar(_version('v2', 2.0, ['101', '102', '103'], {'101': 0.6, '102': 0.5}))
+    registro.sincronizar(_version('v3', 3.0, ['101', '103'], {'101': 0.7}))
+    seq, cambios = registro.consultar(inicio, epoca)
+    resumen = {(c['tabla'], c['site_id']): c['operacion'] for c in cambios}
+    assert resumen == {('sites', '103'): 'alta', ('results', '101'): 'modificacion',
+                       ('sites', '102'): 'baja', ('results', '102'): 'baja'}
+    # 101 cambió dos veces: queda una sola entrada, con la secuencia del último cambio
+    assert [c['seq'] for c in cambios] == sorted(c['seq'] for c in cambios) and cambios[-1]['seq'] == seq
+    assert registro.consultar(seq, epoca) == (seq, [])
+
+
+def test_se_pide_resincronizar_si_el_registro_no_cubre_la_secuencia(tmp_path):
+    registro = RegistroCambios(str(tmp_path / 'cambios.db'), max_entradas=2)
+    registro.sincronizar(_version('v1', 1.0, ['101'], {'101': 0.1}))
+    epoca, inicio = registro.estado()
+    for i in range(2, 6):
+        registro.sincronizar(_version(f'v{i}', float(i), ['101'], {'101': i / 10}))
+    _, seq = registro.estado()
+
+    assert registro.consultar(inicio, epoca) is None            # Ya se descartaron
+    assert registro.consultar(seq - 1, epoca) is not None
+    assert registro.consultar(seq, 'otra_epoca') is None         # Se borró el registro
+    assert registro.consultar(seq + 1, epoca) is None            # Secuencia que nunca existió
+
+
+def test_api_entrega_solo_los_sitios_cambiados(aplicacion, cliente, monkeypatch):
+    primera = cliente.get('/api/cambios').get_json()
+    assert primera['resync'] and 'sitios' not in primera
+    epoca, seq = primera['epoca'], primera['seq']
+    assert cliente.get(f'/api/cambios?desde={seq}&epoca={epoca}').get_json()['cambios'] == []
+
+    resultados = aplicacion.obtener_almacenamiento().cargar()['results']
+    assert aplicacion.guardar_resultados_ehi(resultados[resultados['site_id'].astype(str) == '101'].assign(EHI=0.2),
+                                             forzar=True)
+
+    delta = cliente.get(f'/api/cambios?desde={seq}&epoca={epoca}').get_json()
+    assert not delta['resync'] and delta['seq'] > seq and delta['borrados'] == []
+    assert [(c['tabla'], c['operacion'], c['site_id']) for c in delta['cambios']] == [('results', 'modificacion',
+                                                                                       '101')]
+    assert [str(s['site_id']) for s in delta['sitios']] == ['101'] and delta['sitios'][0]['EHI'] == 0.2
+
+    # Las tarjetas pedidas llegan en HTML en lugar de en sitios
+    con_tarjetas = cliente.get(f'/api/cambios?desde={seq}&epoca={epoca}&tarjetas=101,103').get_json()
+    assert list(con_tarjetas['tarjetas']) == ['101'] and con_tarjetas['sitios'] == []
+    assert 'data-site-id="101"' in con_tarjetas['tarjetas']['101']
+
+    assert cliente.get(f'/api/cambios?desde={seq}&epoca=otra').get_json()['resync']
+    monkeypatch.setitem(aplicacion.app.config, 'CAMBIOS_MAX_SITIOS', 0)
+    assert cliente.get(f'/api/cambios?desde={seq}&epoca={epoca}').get_json()['resync']
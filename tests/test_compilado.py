@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import transformar_datos
+from models.lote import calcular_lote
+from services import compilado
+from services.almacenamiento import AlmacenamientoExcel
+
+
+def _comparar_con_fuente(abierto, fuente):
+    """Mismos valores y tipos; las columnas de texto vuelven como Categorical sobre el mismo tipo de texto"""
+    assert list(abierto.columns) == list(fuente.columns) and len(abierto) == len(fuente)
+    for nombre in fuente.columns:
+        original, leida = fuente[nombre].reset_index(drop=True), abierto[nombre]
+        if isinstance(leida.dtype, pd.CategoricalDtype):
+            assert leida.cat.categories.dtype == original.dtype, nombre
+            assert leida.cat.categories.is_monotonic_increasing
+            pd.testing.assert_series_equal(leida.astype(original.dtype), original, check_names=False)
+        else:
+            assert leida.dtype == original.dtype, nombre
+            pd.testing.assert_series_equal(leida, original, check_names=False)
+
+
+def test_ida_y_vuelta_conserva_valores_y_tipos(tmp_path):
+    fuente = pd.DataFrame({
+        'entero': np.array([3, -1, 7], dtype=np.int64),
+        'pequeno': np.array([1, 2, 3], dtype=np.uint8),
+        'real': [0.5, np.nan, -0.0],
+        'logico': [True, False, True],
+        'fecha': pd.to_datetime(['2025-01-01 00:00:00', None, '2030-12-31 23:59:59']),
+        'texto': pd.Series(['b', None, 'ñandú'], dtype='str'),
+        'objeto': pd.Series(['x', 'y', np.nan], dtype=object),
+    })
+    ruta = str(tmp_path / 'datos.snap')
+    compilado.compilar({'tabla': fuente, 'vacia': fuente.iloc[:0]}, ruta, 'prueba', 'h1')
+    datos = compilado.abrir(ruta, 'prueba', 'h1')
+
+    _comparar_con_fuente(datos['tabla'], fuente)
+    _comparar_con_fuente(datos['vacia'], fuente.iloc[:0])
+    # Las columnas numéricas se usan desde el mapa, en solo lectura
+    assert not datos['tabla']['entero'].to_numpy().flags.writeable
+
+
+def test_los_datos_de_la_app_dan_los_mismos_resultados(carpeta_datos):
+    datos = transformar_datos(AlmacenamientoExcel(str(carpeta_datos / 'EcoBalance_Datos.xlsx')).cargar())
+    ruta = str(carpeta_datos / 'datos.snap')
+    compilado.compilar(datos, ruta, 'excel', 'h1')
+    abiertos = compilado.abrir(ruta, 'excel', 'h1')
+
+    for clave, df in datos.items():
+        _comparar_con_fuente(abiertos[clave], df)
+    site_ids = datos['sites']['site_id']
+    original = calcular_lote(datos['biodiversity'], datos['trophic'], datos['vsi'], site_ids)
+    desde_mapa = calcular_lote(abiertos['biodiversity'], abiertos['trophic'], abiertos['vsi'], abiertos['sites']['site_id'])
+    for clave in ('BI', 'TFI', 'VSI', 'EHI', 'categoria'):
+        np.testing.assert_array_equal(desde_mapa[clave], original[clave])
+
+
+def test_huella_distinta_o_archivo_invalido_no_se_abren(tmp_path):
+    ruta = str(tmp_path / 'datos.snap')
+    compilado.compilar({'t': pd.DataFrame({'a': [1]})}, ruta, 'prueba', 'h1')
+    assert compilado.abrir(ruta, 'prueba', 'h2') is None
+    assert compilado.abrir(ruta, 'otra', 'h1') is None
+    assert compilado.leer_cabecera(ruta)['huella'] == 'h1'
+
+    (tmp_path / 'roto.snap').write_bytes(b'no es una instantanea')
+    assert compilado.abrir(str(tmp_path / 'roto.snap')) is None
+    assert compilado.abrir(str(tmp_path / 'no_existe.snap')) is None
+
+
+def test_una_columna_con_tipos_mezclados_no_se_compila(tmp_path):
+    ruta = tmp_path / 'datos.snap'
+    with pytest.raises(ValueError, match='mezcla'):
+        compilado.compilar({'t': pd.DataFrame({'a': ['x', 1]})}, str(ruta), 'prueba', 'h1')
+    assert not ruta.exists() and not list(tmp_path.iterdir())
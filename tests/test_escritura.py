@@ -0,0 +1,114 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from services.almacenamiento import AlmacenamientoSQLite, escribir_sqlite
+from services.escritura import CoordinadorEscritura, _Pedido, sin_cambios
+
+
+def _resultados(site_ids, fecha):
+    return pd.DataFrame({'site_id': site_ids, 'fecha': fecha, 'BI': 0.5, 'TFI': 0.6, 'VSI': 0.7, 'EHI': 0.6,
+                         'categoria': 'Regular', 'huella': 'h'})
+
+
+def _almacenamiento(tmp_path):
+    ruta = str(tmp_path / 'datos.db')
+    escribir_sqlite({'sites': pd.DataFrame({'site_id': ['101', '102', '103']}),
+                     'results': _resultados(['101', '102', '103'], '2025-01-01 00:00:00')}, ruta)
+    return AlmacenamientoSQLite(ruta)
+
+
+def _fechas(almacenamiento):
+    return almacenamiento.cargar()['results'].set_index('site_id')['fecha'].astype(str).to_dict()
+
+
+def test_resultados_iguales_no_se_reescriben(tmp_path):
+    almacenamiento = _almacenamiento(tmp_path)
+    huella = almacenamiento.huella_contenido()
+
+    assert almacenamiento.guardar_resultados(_resultados(['101'], '2025-02-01 00:00:00'), ['101', '102', '103'])
+    assert almacenamiento.huella_contenido() == huella
+    assert _fechas(almacenamiento)['101'] == '2025-01-01 00:00:00'
+
+
+def test_forzar_guarda_la_fecha_nueva(tmp_path):
+    almacenamiento = _almacenamiento(tmp_path)
+    huella = almacenamiento.huella_contenido()
+
+    assert almacenamiento.guardar_resultados(_resultados(['101'], '2025-02-01 00:00:00'), forzar=True)
+    assert almacenamiento.huella_contenido() != huella
+    assert _fechas(almacenamiento) == {'101': '2025-02-01 00:00:00', '102': '2025-01-01 00:00:00',
+                                       '103': '2025-01-01 00:00:00'}
+
+
+def test_sitios_borrados_se_eliminan_aunque_no_cambien_los_resultados(tmp_path):
+    almacenamiento = _almacenamiento(tmp_path)
+
+    assert almacenamiento.guardar_resultados(_resultados(['101'], '2025-02-01 00:00:00'), ['101', '102'])
+    assert sorted(_fechas(almacenamiento)) == ['101', '102']
+
+
+class AlmacenamientoRegistra:
+    """Backend de prueba que anota cada escritura"""
+
+    def __init__(self, exito=True):
+        self.exito = exito
+        self.escrituras = []
+
+    def guardar_resultados(self, resultados, site_ids_vigentes=None, forzar=False):
+        self.escrituras.append((resultados.set_index('site_id')['EHI'].to_dict(), site_ids_vigentes, forzar))
+        return self.exito
+
+
+def _en_paralelo(coordinador, pedidos):
+    exitos = [None] * len(pedidos)
+
+    def guardar(i, argumentos):
+        exitos[i] = coordinador.guardar_resultados(*argumentos)
+
+    hilos = [threading.Thread(target=guardar, args=(i, argumentos)) for i, argumentos in enumerate(pedidos)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return exitos
+
+
+def _ehi(site_id, valor):
+    return _resultados([site_id], '2025-01-01 00:00:00').assign(EHI=valor)
+
+
+def test_pedidos_simultaneos_se_escriben_juntos():
+    almacenamiento = AlmacenamientoRegistra()
+    coordinador = CoordinadorEscritura(lambda: almacenamiento, espera=0.2)
+    exitos = _en_paralelo(coordinador, [(_ehi(str(i), 0.1 * i),) for i in range(8)])
+
+    assert exitos == [True] * 8
+    assert coordinador.pedidos == 8 and coordinador.escrituras == len(almacenamiento.escrituras) < 8
+    escritos = {}
+    for valores, _, _ in almacenamiento.escrituras:
+        escritos.update(valores)
+    assert escritos == {str(i): pytest.approx(0.1 * i) for i in range(8)}
+
+
+def test_en_un_lote_gana_el_ultimo_pedido_y_forzar_de_cualquiera():
+    almacenamiento = AlmacenamientoRegistra()
+    coordinador = CoordinadorEscritura(lambda: almacenamiento, espera=0)
+    pedidos = [_Pedido(_ehi('101', 0.1), ['101', '102'], False), _Pedido(_ehi('101', 0.9), None, True)]
+
+    assert coordinador._escribir(pedidos)
+    assert almacenamiento.escrituras == [({'101': 0.9}, ['101', '102'], True)]
+
+
+def test_un_fallo_de_escritura_llega_a_todos_los_pedidos_del_lote():
+    coordinador = CoordinadorEscritura(lambda: AlmacenamientoRegistra(exito=False), espera=0.2)
+    assert _en_paralelo(coordinador, [(_ehi(str(i), 0.5),) for i in range(4)]) == [False] * 4
+
+
+def test_sin_cambios_tolera_el_redondeo_del_xlsx_pero_no_cambios_reales():
+    previos = _resultados(['101', '102'], '2025-01-01 00:00:00')
+    releidos = previos.assign(EHI=previos['EHI'] * (1 + 1e-15), fecha='2025-02-01 00:00:00').iloc[::-1]
+    assert sin_cambios(previos, releidos)
+    assert not sin_cambios(previos, previos.assign(EHI=[0.6, 0.61]))
+    assert not sin_cambios(previos, previos.iloc[:1])
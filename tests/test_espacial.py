@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.espacial import IndiceEspacial
+
+
+def _datos(n=2000, semilla=3):
+    rng = np.random.default_rng(semilla)
+    site_ids = [str(i) for i in range(n)]
+    sitios = pd.DataFrame({'site_id': site_ids, 'site_name': site_ids,
+                           'latitude': rng.uniform(-89, 89, n), 'longitude': rng.uniform(-180, 180, n),
+                           'ecosystem_type': 'Bosque'})
+    # Un tercio de los sitios sin resultado
+    con_resultado = site_ids[: 2 * n // 3]
+    resultados = pd.DataFrame({'site_id': con_resultado, 'EHI': rng.uniform(0, 1, len(con_resultado)),
+                               'categoria': rng.choice(['Excelente', 'Bueno', 'Pobre'], len(con_resultado))})
+    return {'sites': sitios, 'results': resultados}
+
+
+def _a_fuerza(sitios, sur, oeste, norte, este):
+    lat, lon = sitios['latitude'], sitios['longitude']
+    dentro_lon = (lon >= oeste) & (lon <= este) if oeste <= este else (lon >= oeste) | (lon <= este)
+    return set(sitios.loc[(lat >= sur) & (lat <= norte) & dentro_lon, 'site_id'])
+
+
+@pytest.mark.parametrize('rectangulo', [
+    (10, 20, 12.5, 23.7),        # pocas celdas
+    (-60, -170, 70, 150),        # casi todo el mundo
+    (-5, 170, 5, -170),          # cruza el antimeridiano
+    (40.2, 0.1, 40.3, 0.2),      # más pequeño que una celda
+])
+def test_el_rectangulo_coincide_con_el_filtro_a_fuerza_bruta(rectangulo):
+    datos = _datos()
+    sitios, total = IndiceEspacial(datos).en_rectangulo(*rectangulo)
+    esperados = _a_fuerza(datos['sites'], *rectangulo)
+    assert set(sitios['site_id']) == esperados and total == len(esperados)
+
+
+def test_el_limite_trunca_pero_informa_el_total():
+    sitios, total = IndiceEspacial(_datos()).en_rectangulo(-90, -180, 90, 180, limite=10)
+    assert len(sitios) == 10 and total == 2000
+
+
+@pytest.mark.parametrize('zoom', [0, 4, 12])
+def test_los_clusters_reparten_todos_los_sitios(zoom):
+    datos = _datos()
+    clusters = IndiceEspacial(datos).clusters(zoom)
+
+    assert sum(c['n'] for c in clusters) == 2000
+    assert sum(c['n_con_ehi'] for c in clusters) == len(datos['results'])
+    assert sum(sum(c['categorias'].values()) for c in clusters) == 2000
+    assert sum(c['categorias'].get('Sin datos', 0) for c in clusters) == 2000 - len(datos['results'])
+    suma_ehi = sum(c['ehi_promedio'] * c['n_con_ehi'] for c in clusters if c['n_con_ehi'])
+    assert suma_ehi == pytest.approx(datos['results']['EHI'].sum())
+
+
+def test_a_mayor_zoom_mas_clusters():
+    indice = IndiceEspacial(_datos())
+    assert len(indice.clusters(1)) < len(indice.clusters(6)) <= len(indice.clusters(14))
+
+
+def test_coordenadas_invalidas_quedan_fuera_del_mapa():
+    datos = _datos(10)
+    datos['sites'].loc[0, 'latitude'] = 120
+    datos['sites'].loc[1, 'longitude'] = None
+    assert len(IndiceEspacial(datos)) == 8
+
+
+def test_api_bbox_y_clusters(cliente):
+    bbox = cliente.get('/api/sitios/bbox?sur=30&oeste=-120&norte=41&este=-70').get_json()
+    assert sorted(s['site_id'] for s in bbox['sitios']) == ['101', '102'] and not bbox['truncado']
+
+    clusters = cliente.get('/api/sitios/clusters?zoom=0').get_json()
+    assert clusters['total_sitios'] == 3 and sum(c['n'] for c in clusters['clusters']) == 3
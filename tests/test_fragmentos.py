@@ -0,0 +1,68 @@
+import re
+
+import pandas as pd
+from jinja2 import DictLoader, Environment
+
+from services.fragmentos import CacheFragmentos, resultados_por_sitio
+
+FILA = re.compile(r'<tr data-site-id="([^"]+)">(.*?)</tr>', re.S)
+EHI = re.compile(r'class="ehi-badge"[^>]*>\s*([0-9.]+|--)\s*<')
+
+
+def _filas_admin(html):
+    """{site_id: EHI mostrado en su fila del panel}"""
+    return {site_id: EHI.search(fila).group(1) for site_id, fila in FILA.findall(html)}
+
+
+def test_resultados_por_sitio_usa_el_ultimo_de_cada_sitio():
+    resultados = pd.DataFrame({'site_id': [101, 102, 101], 'EHI': [0.1, 0.2, 0.3]})
+    por_sitio = resultados_por_sitio({'results': resultados})
+    assert {site_id: r['EHI'] for site_id, r in por_sitio.items()} == {101: 0.3, 102: 0.2}
+    assert resultados_por_sitio({'results': None}) == {}
+    assert resultados_por_sitio({'results': pd.DataFrame()}) == {}
+
+
+def test_fragmento_se_renderiza_una_vez_por_version_y_no_se_reescapa():
+    entorno = Environment(loader=DictLoader({'f.html': '<b>{{ valor }}</b>'}), autoescape=True)
+    cache = CacheFragmentos()
+
+    primero = cache.renderizar(entorno, 'f.html', '101', 'v1', {'valor': '<i>'})
+    assert str(primero) == '<b>&lt;i&gt;</b>'
+    # Misma clave y versión: no se vuelve a renderizar aunque cambie el contexto
+    assert cache.renderizar(entorno, 'f.html', '101', 'v1', {'valor': 'otro'}) == primero
+    assert cache.renderizar(entorno, 'f.html', '101', 'v2', {'valor': 'otro'}) == '<b>otro</b>'
+    assert cache.renderizar(entorno, 'f.html', '102', 'v1', {'valor': 'x'}) == '<b>x</b>'
+    assert (cache.aciertos, cache.fallos) == (1, 3)
+    # Dentro de otra plantilla con autoescape el HTML llega tal cual
+    assert entorno.from_string('{{ f }}').render(f=primero) == '<b>&lt;i&gt;</b>'
+
+
+def test_admin_cada_fila_muestra_el_resultado_de_su_sitio(aplicacion, cliente, monkeypatch):
+    monkeypatch.setattr(aplicacion, 'cache_fragmentos', CacheFragmentos())
+    datos = aplicacion.obtener_almacenamiento().cargar()
+    resultados = datos['results'].drop_duplicates('site_id', keep='last')
+    esperados = {str(site_id): f'{ehi:.3f}' for site_id, ehi in zip(resultados['site_id'], resultados['EHI'])}
+
+    primera = cliente.get('/admin')
+    assert primera.status_code == 200
+    filas = _filas_admin(primera.get_data(as_text=True))
+    assert list(filas) == [str(site_id) for site_id in datos['sites']['site_id']]
+    assert {site_id: filas[site_id] for site_id in esperados} == esperados
+    assert all(ehi == '--' for site_id, ehi in filas.items() if site_id not in esperados)
+
+    # La segunda visita reutiliza los fragmentos y la página es la misma
+    fallos = aplicacion.cache_fragmentos.fallos
+    assert cliente.get('/admin').get_data() == primera.get_data()
+    assert aplicacion.cache_fragmentos.fallos == fallos and aplicacion.cache_fragmentos.aciertos >= len(filas)
+
+
+def test_admin_muestra_los_resultados_de_la_version_nueva(aplicacion, cliente, monkeypatch):
+    monkeypatch.setattr(aplicacion, 'cache_fragmentos', CacheFragmentos())
+    assert _filas_admin(cliente.get('/admin').get_data(as_text=True))['101'] != '0.123'
+
+    resultados = aplicacion.obtener_almacenamiento().cargar()['results']
+    nuevo = resultados[resultados['site_id'].astype(str) == '101'].assign(EHI=0.123)
+    assert aplicacion.guardar_resultados_ehi(nuevo, forzar=True)
+
+    html = cliente.get('/admin').get_data(as_text=True)
+    assert _filas_admin(html)['101'] == '0.123'
@@ -0,0 +1,70 @@
+import sqlite3
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from services.historial import HistorialEHI
+
+
+def _resultados(site_id, fechas, ehi):
+    return pd.DataFrame({'site_id': site_id, 'fecha': fechas, 'BI': 0.5, 'TFI': 0.6, 'VSI': 0.7, 'EHI': ehi,
+                         'categoria': 'Bueno'})
+
+
+def _ts(texto):
+    return int(datetime.fromisoformat(texto).replace(tzinfo=timezone.utc).timestamp())
+
+
+def test_dos_recalculos_en_el_mismo_segundo_no_se_pisan(tmp_path):
+    historial = HistorialEHI(str(tmp_path / 'historial.db'))
+    historial.agregar(_resultados('101', ['2025-01-10 12:00:00'], 0.6))
+    historial.agregar(_resultados('101', ['2025-01-10 12:00:00'], 0.7))
+
+    serie = historial.consultar('101', _ts('2025-01-01'), _ts('2025-02-01'))
+    assert [punto['EHI'] for punto in serie] == [0.6, 0.7]
+
+
+def test_solo_se_leen_las_particiones_del_rango(tmp_path):
+    historial = HistorialEHI(str(tmp_path / 'historial.db'))
+    historial.agregar(_resultados('101', ['2025-01-15', '2025-02-15', '2025-03-15'], [0.1, 0.2, 0.3]))
+    assert historial.particiones() == ['historial_202501', 'historial_202502', 'historial_202503']
+
+    consultas = []
+    historial._conexion().set_trace_callback(consultas.append)
+    serie = historial.consultar('101', _ts('2025-02-01'), _ts('2025-03-31'))
+
+    assert [punto['EHI'] for punto in serie] == [0.2, 0.3]
+    assert not any('historial_202501' in consulta for consulta in consultas)
+
+
+def test_la_reduccion_la_hace_sqlite_por_intervalos(tmp_path):
+    historial = HistorialEHI(str(tmp_path / 'historial.db'))
+    # Cuatro lecturas en enero y febrero: la segunda cubeta abarca las dos particiones
+    historial.agregar(_resultados('101', ['2025-01-01', '2025-01-20', '2025-02-05', '2025-02-25'],
+                                  [0.2, 0.4, 0.6, 1.0]))
+    historial.agregar(_resultados('102', ['2025-01-01'], [0.9]))
+
+    serie = historial.consultar('101', _ts('2025-01-01'), _ts('2025-02-28 23:59:59'), puntos=2)
+
+    assert [punto['n'] for punto in serie] == [2, 2]
+    assert serie[0]['EHI'] == {'media': pytest.approx(0.3), 'min': 0.2, 'max': 0.4}
+    assert serie[1]['EHI'] == {'media': pytest.approx(0.8), 'min': 0.6, 'max': 1.0}
+    assert serie[1]['desde'] == '2025-02-05 00:00:00' and serie[1]['hasta'] == '2025-02-25 00:00:00'
+
+
+def test_las_particiones_sin_secuencia_se_migran(tmp_path):
+    ruta = str(tmp_path / 'historial.db')
+    with sqlite3.connect(ruta) as con:
+        con.execute('CREATE TABLE historial_202501 (site_id TEXT NOT NULL, ts INTEGER NOT NULL, bi REAL, tfi REAL, '
+                    'vsi REAL, ehi REAL, categoria INTEGER, PRIMARY KEY (site_id, ts)) WITHOUT ROWID')
+        con.execute('INSERT INTO historial_202501 VALUES (?, ?, 0.5, 0.6, 0.7, 0.4, 1)',
+                    ('101', _ts('2025-01-10 12:00:00')))
+    con.close()
+
+    historial = HistorialEHI(ruta)
+    historial.agregar(_resultados('101', ['2025-01-10 12:00:00'], 0.8))
+
+    serie = historial.consultar('101', _ts('2025-01-01'), _ts('2025-02-01'))
+    assert [punto['EHI'] for punto in serie] == [0.4, 0.8]
+    assert historial.particiones() == ['historial_202501']
@@ -0,0 +1,78 @@
+import pandas as pd
+
+from app import transformar_datos
+from services.almacenamiento import AlmacenamientoSQLite, escribir_sqlite
+from services.huellas import huellas_sitios
+from services.ingesta import validar_lote
+from services.recalculo import detectar_cambios, recalcular_sitios
+
+
+def _datos_iniciales():
+    return {
+        'sites': pd.DataFrame({'site_id': ['101', '102', '103'], 'nombre': ['Bosque_1', 'Humedal_2', 'Mina_3'],
+                               'latitud': [40.0, 41.0, 42.0], 'longitud': [-3.0, -4.0, -5.0]}),
+        'biodiversity': pd.DataFrame({'site_id': ['101', '101', '102', '103'], 'data_id': [1, 2, 3, 4],
+                                      'especie_nombre': ['a', 'b', 'a', 'c'], 'abundancia': [10, 5, 7, 3]}),
+        'trophic': pd.DataFrame({'site_id': ['101', '102', '103'], 'trophic_id': [1, 2, 3],
+                                 'conn_obs': [0.3, 0.2, 0.1], 'conn_exp': [0.4, 0.4, 0.4],
+                                 'len_obs': [3.0, 2.0, 1.0], 'len_exp': [4.0, 4.0, 4.0]}),
+        'vsi': pd.DataFrame({'site_id': ['101', '102', '103'], 'vsi_id': [1, 2, 3],
+                             'cobertura_pct': [80.0, 50.0, 30.0], 'calidad_suelo_pct': [70.0, 40.0, 20.0]}),
+        'results': pd.DataFrame(columns=['site_id'])
+    }
+
+
+def _recalcular_y_guardar(almacenamiento):
+    datos = transformar_datos(almacenamiento.cargar())
+    resumen = recalcular_sitios(datos)
+    assert almacenamiento.guardar_resultados(resumen['nuevos'], datos['sites']['site_id'])
+    return resumen
+
+
+def test_una_fila_ingestada_marca_un_solo_sitio(tmp_path):
+    ruta = str(tmp_path / 'datos.db')
+    escribir_sqlite(_datos_iniciales(), ruta)
+    almacenamiento = AlmacenamientoSQLite(ruta)
+
+    assert _recalcular_y_guardar(almacenamiento)['recalculados'] == 3
+    assert _recalcular_y_guardar(almacenamiento)['recalculados'] == 0
+
+    # La fila llega sin data_id: no debe cambiar la huella de los demás sitios
+    lote, errores = validar_lote('biodiversity', pd.DataFrame(
+        {'site_id': ['101'], 'especie_nombre': ['nueva'], 'abundancia': [4]}))
+    assert not errores
+    almacenamiento.agregar_filas('biodiversity', lote)
+
+    cambios = detectar_cambios(transformar_datos(almacenamiento.cargar()))
+    assert list(cambios['ids_sucios']) == ['101']
+    assert cambios['omitidos'] == 2
+
+
+def test_la_huella_no_depende_del_tipo_ni_de_los_ids():
+    datos = transformar_datos(_datos_iniciales())
+    site_ids = datos['sites']['site_id']
+    base = huellas_sitios(datos, site_ids)
+
+    otros = {clave: df.copy() for clave, df in datos.items()}
+    otros['biodiversity']['abundance'] = otros['biodiversity']['abundance'].astype(float)
+    otros['biodiversity']['data_id'] = [40, 30, 20, 10]
+    assert list(huellas_sitios(otros, site_ids)) == list(base)
+
+    otros['vsi'].loc[otros['vsi']['site_id'] == '102', 'coverage_pct'] = 51.0
+    cambiadas = huellas_sitios(otros, site_ids) != base
+    assert list(site_ids[cambiadas]) == ['102']
+
+
+def test_forzar_y_sitios_nuevos_o_borrados(tmp_path):
+    ruta = str(tmp_path / 'datos.db')
+    escribir_sqlite(_datos_iniciales(), ruta)
+    almacenamiento = AlmacenamientoSQLite(ruta)
+    _recalcular_y_guardar(almacenamiento)
+
+    datos = transformar_datos(almacenamiento.cargar())
+    assert detectar_cambios(datos, forzar=True)['recalculados'] == 3
+
+    # Un sitio que ya no existe no se recalcula, pero sus resultados hay que borrarlos
+    datos['sites'] = datos['sites'][datos['sites']['site_id'] != '103']
+    cambios = detectar_cambios(datos)
+    assert cambios['recalculados'] == 0 and cambios['sitios_cambiaron']
@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from models.incertidumbre import INDICES, MAX_SEMILLA, simular_incertidumbre
+from models.lote import calcular_lote
+from services.incertidumbre import MAX_MUESTRAS, a_dataframe, resumen_sitio, simular_todos
+
+
+def _datos():
+    return {
+        'sites': pd.DataFrame({'site_id': ['101', '102']}),
+        'biodiversity': pd.DataFrame({'site_id': ['101', '101', '102'], 'species': ['a', 'b', 'a'],
+                                      'abundance': [10, 5, 7]}),
+        'trophic': pd.DataFrame({'site_id': ['101', '102'], 'connectance_observed': [0.3, 0.2],
+                                 'connectance_expected': [0.4, 0.4], 'length_observed': [3.0, 2.0],
+                                 'length_expected': [4.0, 4.0]}),
+        'vsi': pd.DataFrame({'site_id': ['101', '102'], 'coverage_pct': [80.0, 50.0],
+                             'soil_quality_pct': [70.0, 40.0]})
+    }
+
+
+def test_la_semilla_generada_repite_la_corrida_tras_pasar_por_json():
+    primera = simular_todos(_datos(), muestras=200, procesos=1)
+    # Un cliente JavaScript lee los enteros como double: la semilla debe llegar exacta
+    semilla = json.loads(json.dumps(resumen_sitio(primera)), parse_int=float)['semilla']
+    assert 0 <= semilla < MAX_SEMILLA and semilla == int(semilla)
+
+    repetida = simular_todos(_datos(), muestras=200, semilla=int(semilla), procesos=1)
+    assert resumen_sitio(repetida, 1) == resumen_sitio(primera, 1)
+
+
+def _muchos_sitios(n=600, semilla=5):
+    rng = np.random.default_rng(semilla)
+    site_ids = [f's{i}' for i in range(n)]
+    especies = rng.integers(1, 5, n)
+    bio_ids = np.repeat(site_ids, especies)
+    return {
+        'sites': pd.DataFrame({'site_id': site_ids}),
+        'biodiversity': pd.DataFrame({'site_id': bio_ids, 'species': [f'e{i}' for i in range(len(bio_ids))],
+                                      'abundance': rng.integers(1, 40, len(bio_ids))}),
+        'trophic': pd.DataFrame({'site_id': site_ids, 'connectance_observed': rng.uniform(0.1, 0.4, n),
+                                 'connectance_expected': rng.uniform(0.3, 0.5, n),
+                                 'length_observed': rng.uniform(2, 4, n), 'length_expected': rng.uniform(3, 5, n)}),
+        'vsi': pd.DataFrame({'site_id': site_ids, 'coverage_pct': rng.uniform(10, 90, n),
+                             'soil_quality_pct': rng.uniform(10, 90, n)})
+    }
+
+
+def test_el_resultado_no_depende_de_los_procesos_ni_de_los_fragmentos():
+    datos = _muchos_sitios()
+    base = a_dataframe(simular_todos(datos, muestras=50, semilla=11, procesos=1))
+    # 600 sitios son tres bloques de semilla: un fragmento por bloque, repartidos entre dos procesos
+    repartido = a_dataframe(simular_todos(datos, muestras=50, semilla=11, procesos=2, bloques_por_fragmento=1))
+    pd.testing.assert_frame_equal(base, repartido)
+    assert not base.equals(a_dataframe(simular_todos(datos, muestras=50, semilla=12, procesos=1)))
+
+
+def test_la_simulacion_rodea_el_valor_determinista():
+    datos = _datos()
+    site_ids = pd.Index(datos['sites']['site_id'])
+    lote = calcular_lote(datos['biodiversity'], datos['trophic'], datos['vsi'], site_ids)
+    resultado = simular_incertidumbre(datos['biodiversity'], datos['trophic'], datos['vsi'], site_ids,
+                                      muestras=5000, semilla=3)
+
+    for indice in INDICES:
+        valores = resultado[indice]
+        assert (valores['inferior'] <= lote[indice]).all() and (lote[indice] <= valores['superior']).all()
+        if indice in ('TFI', 'VSI'):
+            # Lineales en las lecturas perturbadas: la media no se desplaza (BI, acotado a 1, sí)
+            assert valores['media'] == pytest.approx(lote[indice], abs=0.01)
+    assert resultado['probabilidades'].sum(axis=1) == pytest.approx(1.0)
+
+
+def test_sitios_repetidos_reciben_el_mismo_resultado():
+    datos = _datos()
+    resultado = simular_incertidumbre(datos['biodiversity'], datos['trophic'], datos['vsi'],
+                                      ['102', '101', '102'], muestras=200, semilla=1)
+    assert list(resultado['site_id']) == ['102', '101', '102']
+    assert resumen_sitio(resultado, 0) == resumen_sitio(resultado, 2)
+
+
+def test_api_repetible_con_semilla_y_parametros_validados(cliente):
+    primera = cliente.get('/api/incertidumbre/101?muestras=300&semilla=7').get_json()
+    assert primera['semilla'] == 7 and primera['muestras'] == 300
+    assert cliente.get('/api/incertidumbre/101?muestras=300&semilla=7').get_json() == primera
+    assert sum(primera['probabilidad_categoria'].values()) == pytest.approx(1.0, abs=1e-3)
+
+    for consulta in (f'muestras={MAX_MUESTRAS + 1}', 'muestras=0', 'nivel=1', 'semilla=-1',
+                     f'semilla={MAX_SEMILLA}'):
+        assert cliente.get(f'/api/incertidumbre/101?{consulta}').status_code == 400
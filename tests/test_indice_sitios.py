@@ -0,0 +1,44 @@
+import pandas as pd
+
+from app import calcular_indices_sitio, simular_sitio
+from services.indice_sitios import IndiceSitios
+
+
+def _datos():
+    return {
+        'sites': pd.DataFrame({'site_id': ['b', 'a', 'c'], 'site_name': ['Bosque_b', 'Humedal_a', 'Mina_c']}),
+        'biodiversity': pd.DataFrame({'site_id': ['a', 'b', 'a', 'b'], 'species': ['x', 'x', 'y', 'z'],
+                                      'abundance': [1, 2, 3, 4]}),
+        'vsi': pd.DataFrame({'site_id': ['a', 'a'], 'coverage_pct': [10.0, 20.0], 'soil_quality_pct': [5.0, 6.0]})
+    }
+
+
+def test_filas_de_un_sitio_en_su_orden_original():
+    indice = IndiceSitios(_datos())
+    assert indice.filas('biodiversity', 'a')['species'].tolist() == ['x', 'y']
+    assert indice.filas('biodiversity', 'b')['abundance'].tolist() == [2, 4]
+    assert indice.primera('vsi', 'a')['coverage_pct'] == 10.0
+    assert indice.ultima('vsi', 'a')['coverage_pct'] == 20.0
+
+
+def test_sitio_sin_filas_da_tabla_vacia_con_sus_columnas():
+    indice = IndiceSitios(_datos())
+    vacias = indice.filas('biodiversity', 'c')
+    assert vacias.empty and 'abundance' in vacias.columns
+    assert indice.primera('vsi', 'c') == {}
+
+
+def test_tabla_que_falta_da_tabla_vacia_con_sus_columnas():
+    indice = IndiceSitios(_datos())
+    vacias = indice.filas('trophic', 'a')
+    assert vacias.empty and 'connectance_observed' in vacias.columns
+    assert indice.ultima('trophic', 'a') == {}
+
+
+def test_los_calculos_de_un_sitio_no_fallan_si_falta_una_tabla():
+    datos = _datos()
+    del datos['biodiversity']
+    indice = IndiceSitios(datos)
+    _, bi, tfi, _, _ = calcular_indices_sitio(indice, 'a')
+    assert bi['categoria'] == 'Sin datos' and tfi['categoria'] == 'Sin datos'
+    assert simular_sitio(indice, 'a', muestras=10, semilla=1)['site_id'] == 'a'
@@ -0,0 +1,92 @@
+import pandas as pd
+
+from services.ingesta import ColaIngesta, parsear_lote, validar_lote
+
+
+class AlmacenamientoFalla:
+    """Backend de prueba cuya escritura falla las primeras `fallos` veces"""
+
+    def __init__(self, fallos):
+        self.fallos = fallos
+        self.llamadas = 0
+        self.escritas = []
+
+    def agregar_filas(self, clave, df):
+        self.llamadas += 1
+        if self.llamadas <= self.fallos:
+            raise OSError('disco lleno')
+        self.escritas.append((clave, len(df)))
+
+
+def _lote(n, site_id='101'):
+    return validar_lote('vsi', pd.DataFrame({'site_id': [site_id] * n, 'cobertura_pct': [50] * n,
+                                             'calidad_suelo_pct': [40] * n}))[0]
+
+
+def _cola(almacenamiento, carpeta=None, **opciones):
+    # Intervalo largo: el hilo de fondo no escribe durante la prueba, solo vaciar/_escribir_lote
+    return ColaIngesta(lambda: almacenamiento, tamano_lote=10 ** 6, intervalo=30,
+                       obtener_carpeta_fallidos=(lambda: str(carpeta)) if carpeta else None, **opciones)
+
+
+def test_un_fallo_pasajero_se_reintenta_tras_la_espera():
+    almacenamiento = AlmacenamientoFalla(fallos=1)
+    cola = _cola(almacenamiento)
+    cola.encolar('vsi', _lote(3))
+
+    cola.vaciar()
+    assert cola.pendientes == 3 and cola.errores_escritura == 1
+    # En espera de reintento: el escritor de fondo no vuelve a intentarlo aún
+    assert not cola._escribir_lote() and almacenamiento.llamadas == 1
+
+    cola.vaciar()
+    assert cola.pendientes == 0 and almacenamiento.escritas == [('vsi', 3)]
+
+
+def test_una_tabla_en_espera_no_frena_a_las_demas():
+    almacenamiento = AlmacenamientoFalla(fallos=1)
+    cola = _cola(almacenamiento)
+    cola.encolar('vsi', _lote(2))
+    cola.vaciar()
+
+    cola.encolar('trophic', validar_lote('trophic', pd.DataFrame({
+        'site_id': ['101'], 'conn_obs': [0.5], 'conn_exp': [0.6], 'len_obs': [4], 'len_exp': [5]}))[0])
+    assert cola._escribir_lote()
+    assert almacenamiento.escritas == [('trophic', 1)] and cola.pendientes == 2
+
+
+def test_tras_agotar_los_reintentos_el_lote_se_aparta_y_la_cola_se_libera(tmp_path):
+    almacenamiento = AlmacenamientoFalla(fallos=10)
+    cola = _cola(almacenamiento, tmp_path / 'fallidos', max_filas=5, max_reintentos=3)
+    assert cola.encolar('vsi', _lote(5))
+    assert not cola.encolar('vsi', _lote(1))
+
+    for _ in range(3):
+        cola.vaciar()
+
+    assert cola.pendientes == 0 and cola.filas_fallidas == 5 and almacenamiento.llamadas == 3
+    fallido = cola.fallidos[-1]
+    assert fallido['tabla'] == 'vsi' and fallido['filas'] == 5 and 'disco lleno' in fallido['error']
+    # El CSV apartado se puede volver a enviar tal cual
+    with open(fallido['archivo'], 'rb') as f:
+        reenviado, errores = validar_lote('vsi', parsear_lote(f.read(), 'text/csv'))
+    assert len(reenviado) == 5 and not errores
+    assert cola.encolar('vsi', _lote(1))
+
+
+def test_la_api_responde_429_con_la_cola_llena(aplicacion, cliente, monkeypatch):
+    cola = ColaIngesta(aplicacion.obtener_almacenamiento, max_filas=2, tamano_lote=10 ** 6, intervalo=30)
+    monkeypatch.setattr(aplicacion, 'cola_ingesta', cola)
+    cuerpo = b'{"site_id": "101", "cobertura_pct": 50, "calidad_suelo_pct": 40}\n' * 2
+    try:
+        aceptada = cliente.post('/api/ingesta/vsi', data=cuerpo, content_type='application/x-ndjson')
+        assert aceptada.status_code == 202 and aceptada.get_json()['pendientes'] == 2
+
+        llena = cliente.post('/api/ingesta/4-vsi_data', data=cuerpo[:len(cuerpo) // 2],
+                             content_type='application/x-ndjson')
+        assert llena.status_code == 429 and llena.headers['Retry-After'] == '1'
+        assert llena.get_json()['pendientes'] == 2
+    finally:
+        # Se escribe en la copia temporal antes de que la configuración vuelva a la carpeta real
+        cola.vaciar()
+    assert cola.escritas == 2 and cliente.get('/api/ingesta/fallidos').get_json()['lotes'] == []
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from services.almacenamiento import COLUMNAS_EXCEL, HOJAS
+from services.lector_excel import leer_hoja, leer_libro
+
+CABECERA = ['id', 'entero_con_vacios', 'real', 'mixto', 'texto', 'fecha', 'codigo', 'booleano', 'vacia', None, 'extra']
+FILAS = [
+    [1, 5, 1.5, 1, 'a', datetime(2025, 1, 1), '007', True, None, 'sin nombre', 1],
+    [2, None, 2.0, 2.5, None, datetime(2025, 1, 2), '010', False, None],
+    [3, 7, 3.25, 'x', 'c', None, '12', True, None],
+    [4, 8],  # Fila corta: el resto de celdas vacías
+]
+
+
+def _libro(ruta, filas=FILAS, cabecera=CABECERA):
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.title = 'datos'
+    if cabecera:
+        hoja.append(cabecera)
+    for fila in filas:
+        hoja.append(fila)
+    libro.create_sheet('vacia')
+    libro.save(ruta)
+    return str(ruta)
+
+
+@pytest.mark.parametrize('tamano_bloque', [1, 2, 10000])
+def test_mismos_tipos_y_valores_que_read_excel(tmp_path, tamano_bloque):
+    ruta = _libro(tmp_path / 'libro.xlsx')
+    esperado = pd.read_excel(ruta, sheet_name='datos').drop(columns='Unnamed: 9')
+    leido = leer_hoja(ruta, 'datos', tamano_bloque=tamano_bloque)
+
+    pd.testing.assert_frame_equal(leido, esperado)
+    # Enteros con vacíos pasan a reales, los textos numéricos a número y las mezclas quedan como objetos con NaN
+    assert leido['entero_con_vacios'].dtype == float and leido['codigo'].iloc[:3].tolist() == [7, 10, 12]
+    assert pd.api.types.is_datetime64_any_dtype(leido['fecha'])
+    assert leido['mixto'].dtype == object and pd.isna(leido['mixto'].iloc[3])
+
+
+def test_solo_las_columnas_pedidas_en_el_orden_de_la_hoja(tmp_path):
+    ruta = _libro(tmp_path / 'libro.xlsx')
+    leido = leer_hoja(ruta, 'datos', ['texto', 'id', 'no_existe'])
+    pd.testing.assert_frame_equal(leido, pd.read_excel(ruta, sheet_name='datos', usecols=['id', 'texto']))
+
+
+def test_filas_vacias_se_saltan(tmp_path):
+    ruta = _libro(tmp_path / 'libro.xlsx', filas=FILAS[:2] + [[None] * 11] + FILAS[2:])
+    esperado = pd.read_excel(ruta, sheet_name='datos').drop(columns='Unnamed: 9')
+    leido = leer_hoja(ruta, 'datos')
+    pd.testing.assert_frame_equal(leido, esperado.dropna(how='all').reset_index(drop=True), check_dtype=False)
+    assert leido['id'].tolist() == [1, 2, 3, 4]
+
+
+def test_hojas_sin_filas_o_sin_cabecera(tmp_path):
+    ruta = _libro(tmp_path / 'libro.xlsx', filas=[])
+    for hoja in ('datos', 'vacia'):
+        esperado = pd.read_excel(ruta, sheet_name=hoja)
+        leido = leer_hoja(ruta, hoja)
+        assert [c for c in esperado.columns if not str(c).startswith('Unnamed')] == list(leido.columns)
+        assert leido.empty
+    with pytest.raises(ValueError):
+        leer_hoja(ruta, 'no_existe')
+
+
+def test_el_libro_de_ejemplo_se_lee_igual(carpeta_datos):
+    ruta = str(carpeta_datos / 'EcoBalance_Datos.xlsx')
+    leidos = leer_libro(ruta, HOJAS, COLUMNAS_EXCEL)
+    for clave, hoja in HOJAS.items():
+        esperado = pd.read_excel(ruta, sheet_name=hoja)
+        esperado = esperado[[c for c in esperado.columns if c in COLUMNAS_EXCEL[clave]]]
+        pd.testing.assert_frame_equal(leidos[clave], esperado)
@@ -0,0 +1,90 @@
+import json
+
+import pandas as pd
+import pytest
+
+from models.resultado import ETIQUETAS
+from services.listados import ListadoSitios
+
+
+def _datos(site_ids):
+    sitios = pd.DataFrame({'site_id': site_ids, 'site_name': [f'Sitio_{s}' for s in site_ids]})
+    # Dos resultados del primer sitio: el listado usa el último
+    resultados = pd.DataFrame({'site_id': [site_ids[0]] + site_ids, 'EHI': [0.1] + [0.5] * len(site_ids),
+                               'categoria': 'Regular', 'huella': 'h'})
+    return {'sites': sitios, 'results': resultados}
+
+
+def _recorrer(listado, limite, **opciones):
+    vistos, cursor = [], None
+    while True:
+        filas, cursor = listado.pagina(cursor, limite, **opciones)
+        vistos.extend(filas['site_id'])
+        if cursor is None:
+            return vistos
+
+
+def test_las_paginas_recorren_todo_sin_repetir_ni_saltar():
+    site_ids = [str(i) for i in range(1, 51)]
+    listado = ListadoSitios(_datos(site_ids))
+
+    assert _recorrer(listado, 7) == sorted(site_ids)
+    assert _recorrer(listado, 7, site_ids=['3', '30', '49', 'no_existe']) == ['3', '30', '49']
+    assert 'huella' not in listado.columnas and listado.pagina(None, 1)[0]['EHI'].tolist() == [0.5]
+
+
+def test_una_pagina_no_corta_las_filas_de_un_sitio():
+    datos = _datos(['a', 'b', 'c'])
+    datos['sites'] = pd.concat([datos['sites'], datos['sites'].iloc[[1]]], ignore_index=True)
+    filas, cursor = ListadoSitios(datos).pagina(None, 2)
+    assert filas['site_id'].tolist() == ['a', 'b', 'b'] and cursor == 'b'
+
+
+def test_un_cursor_de_un_sitio_borrado_sigue_desde_el_siguiente():
+    site_ids = [f'{i:03d}' for i in range(20)]
+    antes = ListadoSitios(_datos(site_ids))
+    filas, cursor = antes.pagina(None, 5)
+    assert cursor == '004'
+
+    # Entre página y página se borra el sitio del cursor y se añade uno anterior a él
+    despues = ListadoSitios(_datos([s for s in site_ids if s != '004'] + ['0035']))
+    filas, _ = despues.pagina(cursor, 5)
+    assert filas['site_id'].tolist() == ['005', '006', '007', '008', '009']
+
+
+@pytest.mark.parametrize('cursor, primero', [('', '000'), ('zzz', None), ('00', '000'), ("' OR 1=1 --", '000')])
+def test_un_cursor_manipulado_no_falla(cursor, primero):
+    filas, _ = ListadoSitios(_datos([f'{i:03d}' for i in range(20)])).pagina(cursor, 5)
+    assert (filas['site_id'].iloc[0] if len(filas) else None) == primero
+
+
+def test_api_formatos_json_ndjson_y_compacto(cliente):
+    json_ = cliente.get('/api/sitios?limite=2&campos=site_id,EHI').get_json()
+    assert [s['site_id'] for s in json_['datos']] == ['101', '102'] and json_['siguiente_cursor'] == '102'
+    assert set(json_['datos'][0]) == {'site_id', 'EHI'}
+
+    ndjson = cliente.get('/api/sitios?formato=ndjson&limite=2&campos=site_id')
+    assert ndjson.mimetype == 'application/x-ndjson' and ndjson.headers['X-Siguiente-Cursor'] == '102'
+    assert [json.loads(linea) for linea in ndjson.get_data(as_text=True).splitlines()] == \
+        [{'site_id': '101'}, {'site_id': '102'}]
+    # NDJSON sin limite transmite todo, sin cursor siguiente
+    completo = cliente.get('/api/sitios?formato=ndjson')
+    assert len(completo.get_data(as_text=True).splitlines()) == 3 and 'X-Siguiente-Cursor' not in completo.headers
+
+    compacto = cliente.get('/api/sitios?formato=compacto&campos=site_id,categoria&cursor=101').get_json()
+    assert compacto['columnas']['site_id'] == ['102', '103'] and compacto['siguiente_cursor'] is None
+    assert [compacto['categorias'][c] for c in compacto['columnas']['categoria']] == ['Regular', 'Pobre']
+    assert compacto['categorias'] == ETIQUETAS.tolist()
+
+
+@pytest.mark.parametrize('consulta', ['limite=0', 'limite=abc', 'formato=xml', 'campos=site_id,no_existe'])
+def test_api_parametros_invalidos_dan_400(cliente, consulta):
+    respuesta = cliente.get(f'/api/sitios?{consulta}')
+    assert respuesta.status_code == 400 and 'error' in respuesta.get_json()
+
+
+def test_api_comparar_pagina_los_sitios_pedidos(cliente):
+    pagina = cliente.post('/api/comparar', json={'site_ids': ['103', '101'], 'limite': 1}).get_json()
+    assert [s['site_id'] for s in pagina['datos']] == ['101'] and pagina['siguiente_cursor'] == '101'
+    resto = cliente.post('/api/comparar', json={'site_ids': ['103', '101'], 'limite': 1, 'cursor': '101'}).get_json()
+    assert [s['site_id'] for s in resto['datos']] == ['103'] and resto['siguiente_cursor'] is None
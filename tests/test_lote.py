@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from models.biodiversidad import calcular_shannon_wiener
+from models.ehi import calcular_ehi_completo
+from models.lote import calcular_lote
+from models.resultado import ETIQUETAS
+from models.tfi import calcular_tfi
+from models.vsi import calcular_vsi
+from services.indice_sitios import IndiceSitios
+
+
+def _datos_aleatorios(n=300, semilla=7):
+    rng = np.random.default_rng(semilla)
+    site_ids = [f's{i}' for i in range(n)]
+    especies = rng.integers(1, 8, n)
+    bio_ids = np.repeat(site_ids, especies)
+    biodiversidad = pd.DataFrame({'site_id': bio_ids, 'species': [f'e{i}' for i in range(len(bio_ids))],
+                                  'abundance': rng.integers(0, 50, len(bio_ids))})
+    lecturas = rng.integers(1, 3, n)
+    trof_ids = np.repeat(site_ids, lecturas)
+    troficos = pd.DataFrame({'site_id': trof_ids,
+                             'connectance_observed': rng.uniform(0, 0.5, len(trof_ids)),
+                             'connectance_expected': rng.uniform(0.2, 0.5, len(trof_ids)),
+                             'length_observed': rng.uniform(1, 5, len(trof_ids)),
+                             'length_expected': rng.uniform(3, 5, len(trof_ids))})
+    vsi = pd.DataFrame({'site_id': site_ids, 'coverage_pct': rng.uniform(0, 100, n),
+                        'soil_quality_pct': rng.uniform(0, 100, n)})
+    return site_ids, biodiversidad, troficos, vsi
+
+
+def _casos_limite():
+    """Sitios sin especies, con abundancia cero, con una sola especie, sin vegetación, sin datos y con divisores cero"""
+    site_ids = ['sin_especies', 'abundancia_cero', 'una_especie', 'sin_vegetacion', 'sin_nada', 'divisor_cero',
+                'abundancia_nan']
+    biodiversidad = pd.DataFrame({
+        'site_id': ['abundancia_cero', 'abundancia_cero', 'una_especie', 'sin_vegetacion', 'sin_vegetacion',
+                    'divisor_cero', 'abundancia_nan', 'abundancia_nan'],
+        'species': ['a', 'b', 'a', 'a', 'b', 'a', 'a', 'b'],
+        'abundance': [0, 0, 12, 3, 9, 4, np.nan, 5]})
+    troficos = pd.DataFrame({'site_id': ['sin_especies', 'sin_vegetacion', 'divisor_cero'],
+                             'connectance_observed': [0.3, 0.2, 0.3], 'connectance_expected': [0.4, 0.4, 0.0],
+                             'length_observed': [3.0, 2.0, 3.0], 'length_expected': [4.0, 4.0, 0.0]})
+    vsi = pd.DataFrame({'site_id': ['sin_especies', 'abundancia_cero', 'una_especie', 'divisor_cero'],
+                        'coverage_pct': [50.0, 80.0, 0.0, 100.0], 'soil_quality_pct': [40.0, 0.0, 0.0, 100.0]})
+    return site_ids, biodiversidad, troficos, vsi
+
+
+@pytest.mark.parametrize('datos', [_datos_aleatorios(), _casos_limite()], ids=['aleatorios', 'casos_limite'])
+def test_el_lote_coincide_con_los_modelos_escalares(datos):
+    site_ids, biodiversidad, troficos, vsi = datos
+    lote = calcular_lote(biodiversidad, troficos, vsi, site_ids)
+    indice = IndiceSitios({'biodiversity': biodiversidad, 'trophic': troficos, 'vsi': vsi})
+
+    for i, site_id in enumerate(site_ids):
+        bi = calcular_shannon_wiener(indice.filas('biodiversity', site_id))
+        tfi = calcular_tfi(indice.ultima('trophic', site_id))
+        vsi_sitio = calcular_vsi(indice.ultima('vsi', site_id))
+        ehi = calcular_ehi_completo(tfi, bi, vsi_sitio)
+        for nombre, escalar in (('BI', bi), ('TFI', tfi), ('VSI', vsi_sitio), ('EHI', ehi)):
+            assert lote[nombre][i] == pytest.approx(escalar['valor'], abs=1e-12), (site_id, nombre)
+        assert ETIQUETAS[lote['categoria'][i]] == ehi['categoria'], site_id
+        assert ETIQUETAS[lote['categoria_bi'][i]] == bi['categoria'], site_id
+        assert ETIQUETAS[lote['categoria_tfi'][i]] == tfi['categoria'], site_id
+        assert ETIQUETAS[lote['categoria_vsi'][i]] == vsi_sitio['categoria'], site_id
+
+
+def test_casos_limite_dan_las_categorias_esperadas():
+    site_ids, biodiversidad, troficos, vsi = _casos_limite()
+    lote = calcular_lote(biodiversidad, troficos, vsi, site_ids)
+    categorias_bi = dict(zip(site_ids, ETIQUETAS[lote['categoria_bi']]))
+    assert categorias_bi['sin_especies'] == 'Sin datos'
+    assert categorias_bi['abundancia_cero'] == 'Sin especies'
+    assert ETIQUETAS[lote['categoria_vsi'][site_ids.index('sin_vegetacion')]] == 'Sin datos'
+    assert lote['TFI'][site_ids.index('divisor_cero')] == 0.0
+
+
+def test_sitios_repetidos_se_expanden_en_el_orden_pedido():
+    site_ids, biodiversidad, troficos, vsi = _datos_aleatorios(20)
+    pedidos = [site_ids[3], site_ids[0], site_ids[3]]
+    lote = calcular_lote(biodiversidad, troficos, vsi, pedidos)
+    completo = calcular_lote(biodiversidad, troficos, vsi, site_ids)
+    assert lote['site_id'].tolist() == pedidos
+    assert lote['EHI'].tolist() == [completo['EHI'][3], completo['EHI'][0], completo['EHI'][3]]
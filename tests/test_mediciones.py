@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from app import calcular_indices_sitio, transformar_datos
+from models.lote import calcular_lote
+from services.almacenamiento import AlmacenamientoExcel
+from services.indice_sitios import IndiceSitios
+
+
+def _datos(carpeta_datos):
+    return transformar_datos(AlmacenamientoExcel(str(carpeta_datos / 'EcoBalance_Datos.xlsx')).cargar())
+
+
+def _ehi_lote(datos, site_ids):
+    resultado = calcular_lote(datos['biodiversity'], datos['trophic'], datos['vsi'], pd.Index(site_ids))
+    return dict(zip(site_ids, resultado['EHI']))
+
+
+def test_el_sitio_101_usa_su_lectura_del_22_de_octubre(carpeta_datos):
+    datos = _datos(carpeta_datos)
+    _, _, tfi, vsi, ehi = calcular_indices_sitio(IndiceSitios(datos), '101')
+
+    assert tfi['valor'] == pytest.approx((0.58 / 0.6) * (4.3 / 4.5))
+    assert vsi['valor'] == pytest.approx(0.87 * 0.6 + 0.72 * 0.4)
+    assert ehi.valor == pytest.approx(0.861, abs=5e-4)
+    assert _ehi_lote(datos, ['101'])['101'] == pytest.approx(ehi.valor)
+
+
+def test_cuenta_la_fecha_y_no_el_orden_de_las_filas(carpeta_datos):
+    datos = _datos(carpeta_datos)
+    crudos = AlmacenamientoExcel(str(carpeta_datos / 'EcoBalance_Datos.xlsx')).cargar()
+    # Una lectura antigua que llega al final no desplaza a la más reciente
+    antigua = pd.DataFrame({'site_id': ['101'], 'vsi_id': [305], 'fecha': [pd.Timestamp('2025-01-01')],
+                            'cobertura_pct': [1], 'calidad_suelo_pct': [1]})
+    crudos['vsi'] = pd.concat([crudos['vsi'], antigua], ignore_index=True)
+    assert _ehi_lote(transformar_datos(crudos), ['101']) == pytest.approx(_ehi_lote(datos, ['101']))
+
+    # Con la misma fecha gana la última insertada
+    empate = antigua.assign(vsi_id=306, fecha=pd.Timestamp('2025-10-22'))
+    crudos['vsi'] = pd.concat([crudos['vsi'], empate], ignore_index=True)
+    _, _, _, vsi, _ = calcular_indices_sitio(IndiceSitios(transformar_datos(crudos)), '101')
+    assert vsi['valor'] == pytest.approx(0.01)
@@ -0,0 +1,77 @@
+import re
+import time
+
+import pytest
+
+from services import metricas
+from services.metricas import RegistroMetricas
+
+LINEA = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{.*\})? [-+0-9.eInf]+$')
+
+
+def _valor(texto, prefijo):
+    """Valor de la primera serie que empieza por prefijo (nombre y etiquetas)"""
+    for linea in texto.splitlines():
+        if linea.startswith(prefijo):
+            return float(linea.rsplit(' ', 1)[1])
+    return None
+
+
+def test_histograma_acumulativo_y_etiquetas_escapadas():
+    registro = RegistroMetricas()
+    histograma = registro.histograma('prueba_segundos', 'Ayuda', ('ruta',), limites=(0.1, 1.0))
+    for valor in (0.05, 0.5, 0.7, 3.0):
+        histograma.observar('/a"b', valor=valor)
+    contador = registro.contador('prueba_total', 'Ayuda', ('tipo',))
+    contador.incrementar('x', n=2)
+    registro.colector('prueba_roto', 'gauge', 'Falla al leerse', lambda: 1 / 0)
+
+    texto = registro.exportar()
+    assert 'prueba_segundos_bucket{ruta="/a\\"b",le="0.1"} 1' in texto
+    assert 'prueba_segundos_bucket{ruta="/a\\"b",le="1.0"} 3' in texto
+    assert 'prueba_segundos_bucket{ruta="/a\\"b",le="+Inf"} 4' in texto
+    assert _valor(texto, 'prueba_segundos_sum') == 4.25 and _valor(texto, 'prueba_segundos_count') == 4
+    assert 'prueba_total{tipo="x"} 2' in texto
+    # Un colector que falla no rompe el resto de la exportación
+    assert 'prueba_roto' not in texto
+
+
+# Las pruebas que exportan el registro global usan `aplicacion`: los colectores de la app
+# (alertas, cachés) abren sus bases en DATA_FOLDER, que debe ser la carpeta temporal
+def test_las_fases_fuera_de_una_peticion_van_a_segundo_plano(aplicacion):
+    metricas.descartar_peticion()
+    antes = _valor(metricas.registro.exportar(),
+                   'ecobalance_fase_segundos_count{ruta="(segundo_plano)",fase="prueba"}') or 0
+    with metricas.fase('prueba'):
+        time.sleep(0.001)
+    despues = _valor(metricas.registro.exportar(),
+                     'ecobalance_fase_segundos_count{ruta="(segundo_plano)",fase="prueba"}')
+    assert despues == antes + 1
+
+
+def test_el_tiempo_no_medido_de_una_peticion_cuenta_como_otros(aplicacion):
+    metricas.iniciar_peticion()
+    with metricas.fase('calculo'):
+        time.sleep(0.01)
+    duracion = metricas.terminar_peticion('/prueba_otros', 'GET', 200)
+    texto = metricas.registro.exportar()
+    calculo = _valor(texto, 'ecobalance_fase_segundos_sum{ruta="/prueba_otros",fase="calculo"}')
+    otros = _valor(texto, 'ecobalance_fase_segundos_sum{ruta="/prueba_otros",fase="otros"}')
+    assert calculo >= 0.01 and calculo + otros == pytest.approx(duracion)
+
+
+def test_metrics_en_formato_prometheus(cliente):
+    cliente.get('/api/calcular/101')
+    cliente.get('/no/existe')
+    respuesta = cliente.get('/metrics')
+    texto = respuesta.get_data(as_text=True)
+
+    assert respuesta.content_type.startswith('text/plain; version=0.0.4')
+    assert all(LINEA.match(linea) for linea in texto.splitlines() if not linea.startswith('#')), texto
+    assert _valor(texto, 'ecobalance_peticion_segundos_count{ruta="/api/calcular/<site_id>",metodo="GET",'
+                         'estado="200"}') >= 1
+    assert _valor(texto, 'ecobalance_fase_segundos_count{ruta="/api/calcular/<site_id>",fase="calculo"}') >= 1
+    # Las URL sin ruta comparten una sola serie
+    assert _valor(texto, 'ecobalance_peticion_segundos_count{ruta="(sin_ruta)",metodo="GET",estado="404"}') >= 1
+    assert _valor(texto, 'ecobalance_version_datos') >= 1
+    assert '# TYPE ecobalance_ingesta_filas_fallidas_total counter' in texto
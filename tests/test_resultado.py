@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from models import calcular_ehi_completo, calcular_ehi_compacto
+from models.resultado import ETIQUETAS, SIN_CODIGO, TABLA_CATEGORIAS, codificar
+
+# Categorías y textos del cálculo original, antes de la tabla compartida
+CATEGORIAS_ORIGINALES = [
+    (0.76, 'Excelente', '#3B9A6F', 'El ecosistema se encuentra en excelente estado de salud'),
+    (0.51, 'Bueno', '#36A2EB', 'El ecosistema presenta buena salud con algunos aspectos a mejorar'),
+    (0.26, 'Regular', '#FFC107', 'El ecosistema requiere atención y posibles intervenciones'),
+    (0.11, 'Pobre', '#DC3545', 'El ecosistema está en estado pobre, requiere intervención urgente'),
+    (float('-inf'), 'Crítico', '#0F1D1F', 'El ecosistema está en estado crítico, necesita restauración inmediata'),
+]
+
+
+def _ehi_original(tfi, bi, vsi):
+    """calcular_ehi_completo tal como devolvía sus resultados antes de la representación compacta"""
+    componentes, ehi = {}, 0.0
+    for nombre, indice, peso in (('TFI', tfi, 0.5), ('BI', bi, 0.3), ('VSI', vsi, 0.2)):
+        valor = indice.get('valor', 0) if isinstance(indice, dict) else (indice or 0)
+        categoria = indice.get('categoria', 'N/A') if isinstance(indice, dict) else 'N/A'
+        componentes[nombre] = {'valor': valor, 'contribucion': valor * peso, 'categoria': categoria}
+        ehi += valor * peso
+    _, categoria, color, interpretacion = next(c for c in CATEGORIAS_ORIGINALES if ehi > c[0] or c[0] == float('-inf'))
+    return {'valor': ehi, 'categoria': categoria, 'color': color, 'interpretacion': interpretacion,
+            'componentes': componentes}
+
+
+@pytest.mark.parametrize('tfi, bi, vsi', [
+    ({'valor': 0.9, 'categoria': 'Excelente'}, {'valor': 0.7, 'categoria': 'Bueno'}, {'valor': 0.5, 'categoria': 'Regular'}),
+    ({'valor': 1.52, 'categoria': 'Excelente'}, {'valor': 0.0, 'categoria': 'Sin especies'}, {'valor': 0.0, 'categoria': 'Sin datos'}),
+    ({'valor': 0.0, 'categoria': 'Sin datos'}, {'valor': 0.0, 'categoria': 'Sin datos'}, {'valor': 0.0, 'categoria': 'Sin datos'}),
+    ({'valor': 0.2}, 0.4, None),                 # sin categoría, número suelto y None: 'N/A'
+    ({'valor': 1.52, 'categoria': 'Bueno'}, {'valor': 0, 'categoria': 'Pobre'}, {'valor': 0, 'categoria': 'Pobre'}),
+])
+def test_el_formato_completo_es_el_original(tfi, bi, vsi):
+    assert calcular_ehi_completo(tfi, bi, vsi) == _ehi_original(tfi, bi, vsi)
+
+
+@pytest.mark.parametrize('ehi', [0.76, 0.51, 0.26, 0.11, 0.0])
+def test_los_umbrales_son_exclusivos_como_antes(ehi):
+    # TFI pesa 0.5: TFI = 2 × EHI deja el EHI justo en el umbral
+    tfi = {'valor': ehi * 2, 'categoria': 'Bueno'}
+    assert calcular_ehi_completo(tfi, 0, 0)['categoria'] == _ehi_original(tfi, 0, 0)['categoria']
+
+
+def test_el_compacto_lleva_los_mismos_valores_como_codigos():
+    tfi, bi, vsi = {'valor': 0.9, 'categoria': 'Excelente'}, {'valor': 0.3, 'categoria': 'Pobre'}, 0.5
+    completo = calcular_ehi_completo(tfi, bi, vsi)
+    compacto = calcular_ehi_compacto(tfi, bi, vsi).a_compacto()
+
+    assert compacto['EHI'] == completo['valor']
+    assert ETIQUETAS[compacto['categoria']] == completo['categoria']
+    assert ETIQUETAS[compacto['categoria_tfi']] == 'Excelente' and ETIQUETAS[compacto['categoria_bi']] == 'Pobre'
+    assert compacto['categoria_vsi'] == SIN_CODIGO   # VSI sin categoría ('N/A')
+    assert codificar(['Bueno', None, 'Desconocida']).tolist() == [1, SIN_CODIGO, SIN_CODIGO]
+    assert codificar(['Bueno']).dtype == np.int8
+
+
+def test_api_compacta_y_completa_coinciden(cliente):
+    categorias = cliente.get('/api/categorias').get_json()
+    assert [c['etiqueta'] for c in categorias] == [fila[0] for fila in TABLA_CATEGORIAS]
+    assert [c['codigo'] for c in categorias] == list(range(len(TABLA_CATEGORIAS)))
+
+    for site_id in ('101', '102', '103'):
+        respuesta_completa = cliente.get(f'/api/calcular/{site_id}')
+        respuesta_compacta = cliente.get(f'/api/calcular/{site_id}?formato=compacto')
+        assert len(respuesta_compacta.get_data()) < len(respuesta_completa.get_data())
+        completo, compacto = respuesta_completa.get_json(), respuesta_compacta.get_json()
+        assert compacto['EHI'] == completo['EHI']['valor']
+        assert categorias[compacto['categoria']]['etiqueta'] == completo['EHI']['categoria']
+        assert categorias[compacto['categoria']]['color'] == completo['EHI']['color']
+        for indice in ('BI', 'TFI', 'VSI'):
+            assert compacto[indice] == completo[indice]['valor']
+            assert categorias[compacto[f'categoria_{indice.lower()}']]['etiqueta'] == completo[indice]['categoria']
+        assert 'interpretacion' not in compacto
@@ -0,0 +1,58 @@
+import threading
+import time
+
+from app import transformar_datos
+from services.almacen_datos import Instantanea
+from services.almacenamiento import AlmacenamientoExcel
+from services.trabajos import GestorRecalculo, RegistroTrabajos, TrabajoRecalculo
+
+
+def test_solo_un_trabajo_en_curso_entre_registros_del_mismo_archivo(tmp_path):
+    ruta = str(tmp_path / 'trabajos.db')
+    uno, otro = RegistroTrabajos(ruta), RegistroTrabajos(ruta)
+    primero = TrabajoRecalculo(forzar=False)
+
+    assert uno.tomar(primero) is None
+    en_curso = otro.tomar(TrabajoRecalculo(forzar=True))
+    assert en_curso['trabajo_id'] == primero.id and en_curso['estado'] == 'en_curso'
+
+    primero.terminar('completado', publicar=uno.publicar)
+    assert otro.obtener(primero.id)['estado'] == 'completado'
+    assert otro.tomar(TrabajoRecalculo(forzar=True)) is None
+
+
+def test_un_trabajo_sin_latido_se_da_por_perdido(tmp_path):
+    ruta = str(tmp_path / 'trabajos.db')
+    registro = RegistroTrabajos(ruta, caducidad=0.05)
+    perdido = TrabajoRecalculo(forzar=False)
+    registro.tomar(perdido)
+    time.sleep(0.1)
+
+    estado = RegistroTrabajos(ruta, caducidad=0.05).obtener(perdido.id)
+    assert estado['estado'] == 'error' and 'dejó de responder' in estado['error']
+    assert registro.tomar(TrabajoRecalculo(forzar=False)) is None
+
+
+def test_el_segundo_proceso_se_une_al_trabajo_en_curso(carpeta_datos):
+    datos = transformar_datos(AlmacenamientoExcel(str(carpeta_datos / 'EcoBalance_Datos.xlsx')).cargar())
+    instantanea = Instantanea(1, datos, time.time())
+    registro = RegistroTrabajos(str(carpeta_datos / 'trabajos.db'))
+    # Dos gestores sobre el mismo registro hacen de dos procesos de la app
+    gestor, otro_gestor = (GestorRecalculo(procesos=1, obtener_registro=lambda: registro) for _ in range(2))
+
+    liberar = threading.Event()
+    guardados = []
+
+    def guardar(resumen):
+        liberar.wait(5)
+        guardados.append(resumen['recalculados'])
+        return True
+
+    trabajo, nuevo = gestor.iniciar(instantanea, True, guardar)
+    remoto, nuevo_remoto = otro_gestor.iniciar(instantanea, True, guardar)
+    assert nuevo and not nuevo_remoto and remoto.id == trabajo.id
+
+    liberar.set()
+    assert remoto.esperar(10)
+    assert remoto.estado == 'completado' and remoto.recalculados == 3
+    assert guardados == [3]